@@ -0,0 +1,125 @@
+from fastapi import HTTPException
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from passlib.context import CryptContext
+import asyncio
+import math
+import os
+import time
+
+# bcrypt runs in a dedicated, size-limited process pool so a login burst cannot
+# starve the threadpool the other endpoints need. When too many hashes are
+# waiting we answer 503 + Retry-After right away instead of queueing forever.
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "32"))
+HASH_BULK_WORKERS = int(os.getenv("HASH_BULK_WORKERS", "2"))  # bulk imports, separate from logins
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Hashes with a different cost are flagged by needs_rehash and upgraded after login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def _hash(password):
+    return pwd_context.hash(password)
+
+
+def _verify(password, hashed_password):
+    return pwd_context.verify(password, hashed_password)
+
+
+def _hash_many(passwords):
+    return [pwd_context.hash(password) for password in passwords]
+
+
+class HashPool:
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0  # only touched from the event loop
+        self.rejected = 0
+        self.latencies = deque(maxlen=1000)
+        self._executor = None
+
+    @property
+    def executor(self):
+        # Created lazily so each uvicorn worker gets its own pool after fork
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def queued(self):
+        return max(0, self.in_flight - self.workers)
+
+    def retry_after(self):
+        avg = sum(self.latencies) / len(self.latencies) if self.latencies else 0.25
+        return max(1, math.ceil(self.queued() * avg / self.workers))
+
+    async def run(self, fn, *args, admit=True):
+        if admit and self.queued() >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, try again shortly",
+                headers={"Retry-After": str(self.retry_after())},
+            )
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.latencies.append(time.perf_counter() - start)
+
+    async def map_hash(self, passwords):
+        """Bulk hashing split over every process of the pool; not subject to max_queue."""
+        if not passwords:
+            return []
+        size = max(1, math.ceil(len(passwords) / (self.workers * 4)))
+        loop = asyncio.get_running_loop()
+        self.in_flight += len(passwords)
+        start = time.perf_counter()
+        try:
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(self.executor, _hash_many, passwords[i:i + size])
+                for i in range(0, len(passwords), size)
+            ))
+        finally:
+            self.in_flight -= len(passwords)
+            self.latencies.append((time.perf_counter() - start) * self.workers / len(passwords))
+        return [hashed for part in parts for hashed in part]
+
+    def stats(self):
+        ordered = sorted(self.latencies)
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 1) if ordered else None
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued(),
+            "rejected": self.rejected,
+            "latency_p50_ms": pct(0.50),
+            "latency_p95_ms": pct(0.95),
+        }
+
+
+hash_pool = HashPool(HASH_WORKERS, HASH_MAX_QUEUE)
+bulk_hash_pool = HashPool(HASH_BULK_WORKERS, 0)
+
+
+async def hash_password(password: str) -> str:
+    return await hash_pool.run(_hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await hash_pool.run(_verify, password, hashed_password)
+
+
+async def hash_passwords(passwords) -> list:
+    return await bulk_hash_pool.map_hash(list(passwords))
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    # Cheap: only parses the hash header
+    return pwd_context.needs_update(hashed_password)
@@ -0,0 +1,210 @@
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal
+from models import User, UserSearchTerm
+import hashing
+import search
+import codecs
+import csv
+import json
+import os
+import tempfile
+
+# Bulk onboarding (POST /admin/users/import). The upload is first spooled to a temp file
+# (in memory up to IMPORT_SPOOL_BYTES, on disk past that): a StreamingResponse listens for
+# disconnects on the same channel the body arrives on, so it cannot read the request itself.
+# The file is then read one line at a time and handled IMPORT_CHUNK_SIZE rows at a time:
+# validation with the UserCreate rules, uniqueness with one IN query per field for the
+# whole chunk, bcrypt on the bulk hash pool (not the one logins use), then a bulk insert
+# of users and search terms in one commit.
+# The report is streamed back as JSON lines as chunks finish; chunks already reported are
+# committed even if the import stops halfway.
+#
+# CSV: header row with username,password and optionally full_name,cedula,phone,role.
+# Values cannot contain line breaks. JSONL: one object per line with the same keys.
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(1024 * 1024)))
+READ_SIZE = 64 * 1024
+
+UNIQUE_FIELDS = (("username", "Username"), ("cedula", "Cedula"), ("phone", "Phone"))
+
+
+async def spool(stream):
+    upload = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    async for chunk in stream:
+        upload.write(chunk)
+    upload.seek(0)
+    return upload
+
+
+async def read_chunks(upload):
+    try:
+        while True:
+            chunk = await run_in_threadpool(upload.read, READ_SIZE)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        upload.close()
+
+
+async def read_lines(chunks):
+    """Decoded lines of a byte stream; a UTF-8 BOM (Excel CSV) is dropped."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending.rstrip("\r")
+
+
+async def read_rows(chunks, fmt: str):
+    """(line number, dict or error message) for every non-empty line."""
+    header = None
+    line_no = 0
+    async for line in read_lines(chunks):
+        line_no += 1
+        if not line.strip():
+            continue
+        if fmt == "jsonl":
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_no, "Invalid JSON"
+                continue
+            yield line_no, row if isinstance(row, dict) else "Expected a JSON object"
+        elif header is None:
+            header = [name.strip().lower() for name in next(csv.reader([line]))]
+        else:
+            values = next(csv.reader([line]))
+            if len(values) != len(header):
+                yield line_no, f"Expected {len(header)} columns, got {len(values)}"
+                continue
+            yield line_no, dict(zip(header, values))
+
+
+def validate(row: dict, schema, allowed_roles):
+    """UserCreate for a row, or an error message."""
+    # Empty CSV cells are missing values
+    row = {k: v.strip() if isinstance(v, str) else v for k, v in row.items()}
+    row = {k: v for k, v in row.items() if v not in ("", None)}
+    row.setdefault("role", "client")
+    try:
+        user = schema(**row)
+    except ValidationError as e:
+        return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+    if user.role not in allowed_roles:
+        return f"Role not allowed: {user.role}"
+    return user
+
+
+def unique_errors(db, pending):
+    """pending are (line, UserCreate). line -> error for rows clashing with the DB or an earlier row."""
+    errors = {}
+    for field, label in UNIQUE_FIELDS:
+        values = {getattr(user, field) for _, user in pending if getattr(user, field)}
+        taken = set(db.scalars(select(getattr(User, field)).where(getattr(User, field).in_(values)))) if values else set()
+        seen = set()
+        for line, user in pending:
+            value = getattr(user, field)
+            if not value or line in errors:
+                continue
+            if value in taken:
+                errors[line] = f"{label} already registered"
+            elif value in seen:
+                errors[line] = f"{label} repeated in the file"
+            seen.add(value)
+    return errors
+
+
+def check_chunk(pending):
+    db = SessionLocal()
+    try:
+        return unique_errors(db, pending)
+    finally:
+        db.close()
+
+
+def insert_chunk(pending, hashes):
+    """Bulk insert of the users and their search terms. Returns (line -> error, inserted count)."""
+    db = SessionLocal()
+    errors = {}
+    try:
+        for attempt in range(2):
+            rows = [
+                dict(username=user.username, full_name=user.full_name, hashed_password=hashes[line],
+                     role=user.role, cedula=user.cedula, phone=user.phone)
+                for line, user in pending
+            ]
+            if not rows:
+                return errors, 0
+            try:
+                db.execute(insert(User), rows)
+                ids = dict(db.execute(select(User.username, User.id).where(User.username.in_([row["username"] for row in rows]))).all())
+                terms = search.term_rows([User(id=ids[row["username"]], **row) for row in rows])
+                if terms:
+                    db.execute(insert(UserSearchTerm), terms)
+                db.commit()
+                return errors, len(rows)
+            except IntegrityError:
+                db.rollback()
+                if attempt:
+                    raise
+                # Someone registered one of these since the check: drop the clashing rows, try again
+                errors = unique_errors(db, pending)
+                pending = [(line, user) for line, user in pending if line not in errors]
+    finally:
+        db.close()
+
+
+def report_line(**fields) -> str:
+    return json.dumps(fields) + "\n"
+
+
+async def import_users(chunks, fmt: str, schema, allowed_roles, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """Streams the JSON lines report: one per rejected row, one per chunk, a summary at the end."""
+    totals = {"rows": 0, "imported": 0, "failed": 0}
+
+    async def flush(batch):
+        errors = {}
+        pending = []
+        usernames = {}
+        for line, row in batch:
+            usernames[line] = row.get("username") if isinstance(row, dict) else None
+            user = validate(row, schema, allowed_roles) if isinstance(row, dict) else row
+            if isinstance(user, str):
+                errors[line] = user
+            else:
+                pending.append((line, user))
+        errors.update(await run_in_threadpool(check_chunk, pending))
+        pending = [(line, user) for line, user in pending if line not in errors]
+        hashed = await hashing.hash_passwords([user.password for _, user in pending])
+        late_errors, inserted = await run_in_threadpool(insert_chunk, pending, {line: h for (line, _), h in zip(pending, hashed)})
+        errors.update(late_errors)
+        totals["rows"] += len(batch)
+        totals["imported"] += inserted
+        totals["failed"] += len(errors)
+        out = "".join(report_line(line=line, username=usernames[line], error=errors[line]) for line in sorted(errors))
+        return out + report_line(progress=dict(totals))
+
+    batch = []
+    try:
+        async for line, row in read_rows(chunks, fmt):
+            batch.append((line, row))
+            if len(batch) >= chunk_size:
+                yield await flush(batch)
+                batch = []
+        if batch:
+            yield await flush(batch)
+    except Exception as e:
+        print(f"User import stopped: {e!r}")
+        yield report_line(done=False, error="Import stopped, rows reported so far are saved", **totals)
+        return
+    yield report_line(done=True, **totals)
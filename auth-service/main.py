@@ -1,17 +1,27 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from database import Base, engine, get_db, SessionLocal
-from models import User
+from database import get_db, get_read_db, SessionLocal, pool_status, readiness, warm_up
+from models import User, RevokedToken
 from pydantic import BaseModel, validator
-from passlib.context import CryptContext
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from typing import Optional
-
-# Create tables
-Base.metadata.create_all(bind=engine)
+from fastapi.security import OAuth2PasswordRequestForm
+from bankcommon.tokens import create_access_token, get_current_user_payload, require_roles, revoke_token, use_database_revocations
+from bankcommon.cache import response_cache
+from typing import List, Optional, Literal, Union
+import hashing
+import importer
+import search
+import requests
+import os
+from bankcommon import metrics
+import asyncio
 
 app = FastAPI()
 
+# Logouts go to revoked_tokens so both services see them
+use_database_revocations(SessionLocal, RevokedToken)
+
 from fastapi.middleware.cors import CORSMiddleware
 
 app.add_middleware(
@@ -21,9 +31,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+CORE_BANKING_URL = os.getenv("CORE_BANKING_URL", "http://core-banking-service:8000")
+ACCOUNT_LOOKUP_TIMEOUT = float(os.getenv("ACCOUNT_LOOKUP_TIMEOUT", "2"))
 
 class UserCreate(BaseModel):
     username: str
@@ -78,30 +89,27 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+class UserSearchResult(UserResponse):
+    account_number: Optional[str] = None
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+class UserSearchPage(BaseModel):
+    items: List[UserSearchResult]
+    page: int
+    limit: int
+    has_more: bool
 
+# Tables and the default admin come from `python migrate.py`; startup only schedules the
+# DB warm-up so the process accepts traffic right away. /readyz reports when it is done.
 @app.on_event("startup")
-def startup_event():
-    db = SessionLocal()
-    try:
-        # Check if admin exists
-        admin = db.query(User).filter(User.username == "admin").first()
-        if not admin:
-            # Create default admin
-            hashed_pw = get_password_hash("admin")
-            admin_user = User(username="admin", hashed_password=hashed_pw, role="admin", cedula="00000000")
-            db.add(admin_user)
-            db.commit()
-            print("Default admin user created (admin/admin)")
-    finally:
-        db.close()
+async def start_warm_up():
+    app.state.warm_up_task = asyncio.create_task(warm_up())
 
-@app.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+@app.on_event("shutdown")
+def stop_warm_up():
+    # Ends a warm-up still waiting for the database, so the process can exit
+    readiness.stopping.set()
+
+def check_unique(db: Session, user: UserCreate):
     db_user = db.query(User).filter(User.username == user.username).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
@@ -116,8 +124,22 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         if db_phone:
             raise HTTPException(status_code=400, detail="Phone already registered")
 
+def save_user(db: Session, new_user: User):
+    db.add(new_user)
+    db.flush()
+    search.index_user(db, new_user)
+    db.commit()
+    db.refresh(new_user)
+    return new_user
+
+# register/create-staff/login are async: DB work goes to the threadpool, bcrypt to the hash pool,
+# so no shared thread is held for the ~250 ms of hashing.
+@app.post("/register", response_model=UserResponse)
+async def register(user: UserCreate, db: Session = Depends(get_db)):
+    await run_in_threadpool(check_unique, db, user)
+
     # Public registration forces client role
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hashing.hash_password(user.password)
     # Ensure cedula is passed
     new_user = User(
         username=user.username, 
@@ -127,45 +149,57 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         cedula=user.cedula,
         phone=user.phone
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    new_user = await run_in_threadpool(save_user, db, new_user)
+    response_cache.invalidate("user", new_user.id)
     return new_user
 
-@app.get("/users/search", response_model=UserResponse)
-def search_user(cedula: str, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-     # Verify Staff
-    from jose import jwt
-    SECRET_KEY = "mysecretkey"
-    ALGORITHM = "HS256"
+def account_numbers(user_ids, authorization: str):
+    # One batched call to core banking for the whole page; search still works if it is down
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        role = payload.get("role")
-        if role not in ["admin", "teller", "customer_service"]:
-             raise HTTPException(status_code=403, detail="Not authorized")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    user = db.query(User).filter(User.cedula == cedula).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+        r = requests.post(
+            f"{CORE_BANKING_URL}/accounts/lookup",
+            json={"user_ids": user_ids},
+            headers={"Authorization": authorization},
+            timeout=ACCOUNT_LOOKUP_TIMEOUT,
+        )
+        r.raise_for_status()
+        return {row["user_id"]: row["account_number"] for row in r.json()}
+    except requests.RequestException as e:
+        print(f"Account lookup failed: {e!r}")
+        return {}
 
-@app.post("/admin/create-staff", response_model=UserResponse)
-def create_staff(user: UserCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    # Verify Admin
-    from jose import jwt
-    SECRET_KEY = "mysecretkey"
-    ALGORITHM = "HS256"
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        role = payload.get("role")
-        if role != "admin":
-             raise HTTPException(status_code=403, detail="Not authorized")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token")
+@app.get("/users/search", response_model=Union[UserSearchPage, UserResponse])
+def search_users(
+    request: Request,
+    q: Optional[str] = Query(None, min_length=1, max_length=100),
+    cedula: Optional[str] = None,
+    fuzzy: bool = True,
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=50),
+    include_accounts: bool = False,
+    payload: dict = Depends(require_roles("admin", "teller", "customer_service")),
+    db: Session = Depends(get_read_db),
+):
+    # Prefix / typo-tolerant search over name, username, cedula and phone (see search.py), a page.
+    # ?cedula= without q is the old exact lookup: one user or 404, unchanged for existing callers.
+    if q is None:
+        if cedula is None:
+            raise HTTPException(status_code=400, detail="Either q or cedula is required")
+        user = db.query(User).filter(User.cedula == cedula).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return UserResponse.model_validate(user)
+    users, has_more = search.search_users(db, q, fuzzy, (page - 1) * limit, limit)
+    items = [UserSearchResult.model_validate(user) for user in users]
+    if include_accounts and items:
+        accounts = account_numbers([item.id for item in items], request.headers.get("Authorization", ""))
+        for item in items:
+            item.account_number = accounts.get(item.id)
+    return UserSearchPage(items=items, page=page, limit=limit, has_more=has_more)
 
-    db_user = db.query(User).filter(User.username == user.username).first()
+@app.post("/admin/create-staff", response_model=UserResponse)
+async def create_staff(user: UserCreate, payload: dict = Depends(require_roles("admin")), db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(lambda: db.query(User).filter(User.username == user.username).first())
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
@@ -173,60 +207,101 @@ def create_staff(user: UserCreate, token: str = Depends(oauth2_scheme), db: Sess
     if user.role not in ["teller", "customer_service"]:
         raise HTTPException(status_code=400, detail="Invalid staff role")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hashing.hash_password(user.password)
     new_user = User(username=user.username, hashed_password=hashed_password, role=user.role)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+    return await run_in_threadpool(save_user, db, new_user)
+
+@app.post("/admin/users/import")
+async def import_users(
+    request: Request,
+    format: Optional[Literal["csv", "jsonl"]] = None,
+    payload: dict = Depends(require_roles("admin", "teller")),
+):
+    # Partner onboarding: raw CSV / JSONL body, spooled then reported on as a stream (see importer.py).
+    # Tellers import clients; admins can also import staff.
+    if format is None:
+        format = "jsonl" if "json" in request.headers.get("content-type", "") else "csv"
+    allowed_roles = {"client", "teller", "customer_service"} if payload.get("role") == "admin" else {"client"}
+    upload = await importer.spool(request.stream())
+    report = importer.import_users(importer.read_chunks(upload), format, UserCreate, allowed_roles)
+    return StreamingResponse(report, media_type="application/x-ndjson")
+
+async def upgrade_password_hash(user_id: int, password: str):
+    # Background: re-hash with the current bcrypt cost. Skipped (retried next login) if the pool is busy.
+    try:
+        new_hash = await hashing.hash_password(password)
+    except HTTPException:
+        return
+
+    def save():
+        db = SessionLocal()
+        try:
+            db.query(User).filter(User.id == user_id).update({"hashed_password": new_hash})
+            db.commit()
+        finally:
+            db.close()
+    await run_in_threadpool(save)
 
 @app.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(background_tasks: BackgroundTasks, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.username == form_data.username).first())
+    if not user or not await hashing.verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    # Ideally implement JWT here. For simplicity in this step, returning user info + dummy token.
-    # In a real microservice, we should issue a JWT.
-    # Let's emit a fake token for now to satisfy OAuth2 flow, or implement simple JWT.
-    # I'll add simple JWT generation if needed, but for "money printer" purposes, maybe basic logic is enough.
-    # Let's stick to a simple dummy token or just return success?
-    # No, services need to verify user. JWT is best.
-    
-    # Minimal JWT implementation
-    from jose import jwt
-    import datetime
-    
-    SECRET_KEY = "mysecretkey"
-    ALGORITHM = "HS256"
-    
-    token_data = {
-        "sub": user.username,
-        "role": user.role,
-        "user_id": user.id
-    }
-    encoded_jwt = jwt.encode(token_data, SECRET_KEY, algorithm=ALGORITHM)
-    
+    if hashing.needs_rehash(user.hashed_password):
+        background_tasks.add_task(upgrade_password_hash, user.id, form_data.password)
+    encoded_jwt = create_access_token(user.username, user.role, user.id)
     return {"access_token": encoded_jwt, "token_type": "bearer"}
 
+@app.post("/logout")
+def logout(payload: dict = Depends(get_current_user_payload)):
+    revoke_token(payload)
+    return {"message": "Logged out"}
+
 @app.get("/users/me", response_model=UserResponse)
-def read_users_me(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    # Verify token
-    from jose import jwt
-    SECRET_KEY = "mysecretkey"
-    ALGORITHM = "HS256"
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token")
-        
-    user = db.query(User).filter(User.username == username).first()
+def read_users_me(request: Request, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_read_db)):
+    # Primary key lookup from the verified claims, behind the per-user response cache
+    user_id = payload.get("user_id")
+    version, cached = response_cache.lookup(request, "user", user_id)
+    if cached:
+        return cached
+    user = db.get(User, user_id)
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return user
+    return response_cache.store("user", user_id, version, UserResponse.model_validate(user))
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is serving, no dependency is checked
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz(response: Response):
+    # Readiness: database reachable and pools warmed
+    status = readiness.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Prometheus scrape target, counters of this worker process
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/internal/db-pool")
+def db_pool_status():
+    # Pool usage and checkout wait per engine, for capacity planning
+    return pool_status()
+
+@app.get("/internal/cache")
+def cache_status():
+    # Response cache hit / miss / 304 counters of this worker
+    return response_cache.stats()
+
+@app.get("/internal/hash-pool")
+def hash_pool_status():
+    # Queue depth, rejections and bcrypt latency; "bulk" is the pool imports use
+    return {**hashing.hash_pool.stats(), "bulk": hashing.bulk_hash_pool.stats()}
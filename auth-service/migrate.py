@@ -0,0 +1,52 @@
+"""
+Schema migration step. Run it once per deploy, before starting the API processes:
+    python migrate.py
+
+Creates missing tables and indexes, the default admin user and, the first time, the
+customer search terms. create_all never alters existing tables, so a changed column
+still needs a hand-written ALTER.
+"""
+from database import Base, engine, wait_for_db, SessionLocal
+from models import User, UserSearchTerm
+import hashing
+import search
+
+
+def create_default_admin():
+    db = SessionLocal()
+    try:
+        if not db.query(User).filter(User.username == "admin").first():
+            hashed_pw = hashing.pwd_context.hash("admin")
+            admin = User(username="admin", hashed_password=hashed_pw, role="admin", cedula="00000000")
+            db.add(admin)
+            db.flush()
+            search.index_user(db, admin)
+            db.commit()
+            print("Default admin user created (admin/admin)")
+    finally:
+        db.close()
+
+
+def build_search_index():
+    db = SessionLocal()
+    try:
+        search.ensure_indexes(db)
+        # Backfill once for users created before the search table existed
+        if db.query(UserSearchTerm.id).first() is None and db.query(User.id).first() is not None:
+            search.rebuild(db)
+            print("Customer search terms built")
+        db.commit()
+    finally:
+        db.close()
+
+
+def run():
+    wait_for_db(engine)
+    Base.metadata.create_all(bind=engine)
+    build_search_index()
+    create_default_admin()
+
+
+if __name__ == "__main__":
+    run()
+    print("Schema up to date")
@@ -11,3 +11,20 @@ class User(Base):
     role = Column(String, default="client")
     cedula = Column(String, unique=True, nullable=True)
     phone = Column(String, unique=True, nullable=True)
+
+class UserSearchTerm(Base):
+    __tablename__ = "user_search_terms"
+
+    # One row per normalized word of full_name, username, cedula and phone (see search.py)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True)
+    field = Column(String) # 'name', 'username', 'cedula', 'phone'
+    term = Column(String, index=True) # Prefix lookups are range scans on this index
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    # Logged-out tokens, checked by both services (bankcommon/tokens.py); rows can go once the token expired
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String, unique=True)
+    expires_at = Column(Integer, index=True) # Token exp, unix time
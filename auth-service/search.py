@@ -0,0 +1,196 @@
+from fastapi import HTTPException
+from sqlalchemy import select, insert, func, text, case, or_, union_all
+from sqlalchemy.orm import Session
+from difflib import SequenceMatcher
+from models import User, UserSearchTerm
+import os
+import unicodedata
+
+# Staff customer search. Every user gets a few normalized terms (words of the name,
+# username, cedula digits, phone in local format) in user_search_terms:
+#   - prefix matches are range scans on the term index, on any database
+#   - typo-tolerant matches use a pg_trgm GIN index on Postgres (created by migrate.py);
+#     on the SQLite stand-in a Python function scores terms sharing the first letter
+# A multi-word query must match every word; exact terms rank above prefixes, prefixes above fuzzy.
+
+SEARCH_CANDIDATE_LIMIT = int(os.getenv("SEARCH_CANDIDATE_LIMIT", "5000"))  # matching terms of the most selective word
+FUZZY_MIN_LENGTH = 3
+SQLITE_FUZZY_RATIO = 0.7
+
+
+def normalize(value: str) -> str:
+    value = unicodedata.normalize("NFKD", value or "")
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return "".join(c for c in value.lower() if c.isalnum() or c.isspace())
+
+
+def local_phone(digits: str) -> str:
+    # +58 412 1234567 and 0412 1234567 are the same number
+    if digits.startswith("58"):
+        return "0" + digits[2:]
+    return digits
+
+
+def digits_only(value: str) -> str:
+    return "".join(c for c in value or "" if c.isdigit())
+
+
+def terms_for(user: User):
+    terms = [("name", word) for word in normalize(user.full_name).split()]
+    if user.username:
+        terms.append(("username", normalize(user.username).replace(" ", "")))
+    if user.cedula and digits_only(user.cedula):
+        terms.append(("cedula", digits_only(user.cedula)))
+    if user.phone and digits_only(user.phone):
+        terms.append(("phone", local_phone(digits_only(user.phone))))
+    return [(field, term) for field, term in dict.fromkeys(terms) if term]
+
+
+def term_rows(users):
+    return [{"user_id": user.id, "field": field, "term": term} for user in users for field, term in terms_for(user)]
+
+
+def index_user(db: Session, user: User):
+    """Adds the search terms of a flushed user. Does not commit."""
+    rows = term_rows([user])
+    if rows:
+        db.execute(insert(UserSearchTerm), rows)
+
+
+def rebuild(db: Session, chunk_size: int = 5000):
+    """Recomputes every term from the users table (backfill). Does not commit."""
+    db.query(UserSearchTerm).delete(synchronize_session=False)
+    last_id = 0
+    while True:
+        users = db.query(User).filter(User.id > last_id).order_by(User.id).limit(chunk_size).all()
+        if not users:
+            return
+        rows = term_rows(users)
+        if rows:
+            db.execute(insert(UserSearchTerm), rows)
+        last_id = users[-1].id
+
+
+def query_words(q: str):
+    """Each query word with its variants: 'V-1234' also looks for the digits '1234'."""
+    digits = digits_only(q)
+    if len(digits) >= 3 and not any(c.isalpha() for c in q):
+        # '+58 412 123' is one number, not three words
+        return [{digits, local_phone(digits)}]
+    words = []
+    for word in normalize(q).split():
+        variants = {word}
+        digits = digits_only(word)
+        if len(digits) >= 3:
+            variants.update({digits, local_phone(digits)})
+        words.append(variants)
+    return words
+
+
+def prefix_upper(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def prefix_match(variant: str):
+    # Range scan on the term index
+    return (UserSearchTerm.term >= variant) & (UserSearchTerm.term < prefix_upper(variant))
+
+
+def sqlite_similarity(term, variant):
+    if term is None or variant is None:
+        return 0.0
+    return SequenceMatcher(None, variant, term[:len(variant) + 2]).ratio()
+
+
+def variant_selects(db: Session, variant: str, fuzzy: bool):
+    """(user_id, score) selects for one variant: exact term 3, prefix 2, fuzzy below 1."""
+    selects = [
+        select(
+            UserSearchTerm.user_id.label("user_id"),
+            case((UserSearchTerm.term == variant, 3.0), else_=2.0).label("score"),
+        ).where(prefix_match(variant))
+    ]
+    if not fuzzy or len(variant) < FUZZY_MIN_LENGTH or variant.isdigit():
+        return selects
+    if db.get_bind().dialect.name == "postgresql":
+        similarity = func.similarity(UserSearchTerm.term, variant)
+        # pg_trgm, uses the GIN index
+        selects.append(select(UserSearchTerm.user_id, similarity).where(UserSearchTerm.term.op("%")(variant)))
+    else:
+        # SQLite stand-in: terms sharing the first letter, scored by a Python function
+        db.connection().connection.driver_connection.create_function("search_similarity", 2, sqlite_similarity)
+        similarity = func.search_similarity(UserSearchTerm.term, variant)
+        selects.append(
+            select(UserSearchTerm.user_id, similarity)
+            .where(prefix_match(variant[0]), similarity >= SQLITE_FUZZY_RATIO)
+        )
+    return selects
+
+
+def prefix_match_count(db: Session, variants):
+    """Term rows matching any variant as a prefix, counted up to SEARCH_CANDIDATE_LIMIT + 1."""
+    matching = select(UserSearchTerm.id).where(or_(*(prefix_match(v) for v in variants)))
+    return db.execute(
+        select(func.count()).select_from(matching.limit(SEARCH_CANDIDATE_LIMIT + 1).subquery())
+    ).scalar()
+
+
+def search_users(db: Session, q: str, fuzzy: bool, offset: int, limit: int):
+    """Returns (users, has_more) for one page, best matches first.
+
+    Scoring, ranking and paging all happen in SQL, so nothing is cut before the best
+    matches are known. When even the most selective word matches more than
+    SEARCH_CANDIDATE_LIMIT terms the query is refused as too broad.
+    """
+    words = query_words(q)
+    if not words:
+        return [], False
+    counts = [prefix_match_count(db, variants) for variants in words]
+    if min(counts) > SEARCH_CANDIDATE_LIMIT:
+        raise HTTPException(status_code=400, detail="Too many matches, refine your query")
+
+    # The most selective word picks the candidates, the others only score them
+    words = [variants for _, variants in sorted(zip(counts, words), key=lambda item: item[0])]
+    scored = []
+    for variants in words:
+        selects = [part for variant in sorted(variants) for part in variant_selects(db, variant, fuzzy)]
+        if scored:
+            candidates = select(scored[0].c.user_id)
+            selects = [part.where(UserSearchTerm.user_id.in_(candidates)) for part in selects]
+        matches = union_all(*selects).subquery()
+        # Best variant per user and word; every word has to match
+        scored.append(
+            select(matches.c.user_id, func.max(matches.c.score).label("score"))
+            .group_by(matches.c.user_id)
+            .subquery()
+        )
+
+    first = scored[0]
+    total = sum_scores(scored).label("total")
+    ranking = select(first.c.user_id, total).select_from(first)
+    for word in scored[1:]:
+        ranking = ranking.join(word, word.c.user_id == first.c.user_id)
+    page_ids = db.execute(
+        ranking.order_by(total.desc(), first.c.user_id).offset(offset).limit(limit + 1)
+    ).scalars().all()
+    has_more = len(page_ids) > limit
+    page_ids = page_ids[:limit]
+    users = {user.id: user for user in db.query(User).filter(User.id.in_(page_ids))} if page_ids else {}
+    return [users[uid] for uid in page_ids if uid in users], has_more
+
+
+def sum_scores(scored):
+    total = scored[0].c.score
+    for word in scored[1:]:
+        total = total + word.c.score
+    return total
+
+
+def ensure_indexes(db: Session):
+    """Postgres only: trigram index for typo-tolerant matching. Called by migrate.py."""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    db.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    db.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_user_search_terms_trgm ON user_search_terms USING gin (term gin_trgm_ops)"
+    ))
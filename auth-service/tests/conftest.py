@@ -0,0 +1,85 @@
+"""
+Test setup for auth-service, as in core-banking-service/tests/conftest.py: settings before
+any import, TEST_POSTGRES_URL (emptied by the repo root conftest.py) or a new SQLite file,
+migrated once per run. Cheap bcrypt so registering users stays fast.
+"""
+import atexit
+import os
+import sys
+import tempfile
+
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ROOT = os.path.dirname(SERVICE_DIR)
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+if TEST_POSTGRES_URL:
+    os.environ["DATABASE_URL"] = TEST_POSTGRES_URL
+else:
+    fd, db_file = tempfile.mkstemp(prefix="auth_test_", suffix=".db")
+    os.close(fd)
+    atexit.register(os.remove, db_file)
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_file
+os.environ.update(APP_ENV="dev", CACHE_BACKEND="memory", BCRYPT_ROUNDS="4", CORE_BANKING_URL="http://127.0.0.1:9")
+
+# pytest from the repo root loads both services, whose modules share names (main, database,
+# models...): each conftest puts its own ones back before collecting or running its tests
+SERVICE_MODULES = {}
+
+
+def use_this_service():
+    for name, module in list(sys.modules.items()):
+        folder = os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or ""))
+        if folder.endswith("-service") and folder != SERVICE_DIR:
+            del sys.modules[name]
+    sys.modules.update(SERVICE_MODULES)
+    sys.path[:] = [SERVICE_DIR] + [p for p in sys.path if p != SERVICE_DIR]
+
+
+def pytest_collectstart(collector):
+    use_this_service()
+
+
+def pytest_runtest_setup(item):
+    use_this_service()
+
+
+sys.path.append(os.path.join(ROOT, "shared"))
+use_this_service()
+
+import pytest
+from fastapi.testclient import TestClient
+
+import migrate
+migrate.run()
+import main
+from bankcommon import tokens
+
+SERVICE_MODULES.update(
+    (name, module) for name, module in sys.modules.items()
+    if os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or "")) == SERVICE_DIR
+)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+def auth():
+    def headers(user_id: int, role: str = "client"):
+        return {"Authorization": "Bearer " + tokens.create_access_token(f"user{user_id}", role, user_id)}
+    return headers
+
+
+@pytest.fixture(scope="session")
+def register(client):
+    """Registers a client with a password equal to its username. Returns the response body."""
+    def register(username: str, full_name: str = None, cedula: str = None, phone: str = None):
+        body = {"username": username, "full_name": full_name or username, "password": username,
+                "cedula": cedula, "phone": phone}
+        r = client.post("/register", json=body)
+        assert r.status_code == 200, r.text
+        return r.json()
+    return register
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from fastapi import HTTPException
+
+import hashing
+from database import SessionLocal
+from models import User
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    pool = hashing.HashPool(1, 1)
+
+    async def burst():
+        # One running, one waiting, the third one is turned away
+        return await asyncio.gather(*(pool.run(time.sleep, 0.3) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(burst())
+    pool.executor.shutdown()
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503 and int(rejected[0].headers["Retry-After"]) >= 1
+    assert pool.stats()["rejected"] == 1 and pool.stats()["in_flight"] == 0
+
+
+def test_bulk_hashing_is_not_admission_checked():
+    pool = hashing.HashPool(2, 0)
+    hashed = asyncio.run(pool.map_hash(["a", "b", "c"]))
+    pool.executor.shutdown()
+    assert [hashing._verify(p, h) for p, h in zip("abc", hashed)] == [True, True, True]
+
+
+def test_login_upgrades_an_old_hash(client):
+    db = SessionLocal()
+    old_hash = hashing.pwd_context.hash("secret", rounds=hashing.BCRYPT_ROUNDS + 1)
+    user = User(username="rehash1", hashed_password=old_hash, role="client")
+    db.add(user)
+    db.commit()
+    assert hashing.needs_rehash(old_hash)
+
+    r = client.post("/login", data={"username": "rehash1", "password": "secret"})
+    assert r.status_code == 200
+    db.refresh(user)
+    assert user.hashed_password != old_hash and not hashing.needs_rehash(user.hashed_password)
+    assert client.post("/login", data={"username": "rehash1", "password": "secret"}).status_code == 200
+    db.close()
+
+
+def test_pool_stats_endpoint(client):
+    stats = client.get("/internal/hash-pool").json()
+    assert {"workers", "max_queue", "queue_depth", "rejected", "latency_p95_ms", "bulk"} <= set(stats)
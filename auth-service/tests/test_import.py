@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+import importer
+import main
+
+ADMIN = 91001
+TELLER = 91002
+
+# As Excel saves it, with a BOM
+CSV = "\ufeff" + """username,password,full_name,cedula,phone,role
+imp_ana,secret1,Ana Import,V24000001,04142400001,
+imp_bad,secret2,Bad Phone,V24000002,12345,
+imp_ana,secret3,Ana Again,V24000003,,
+imp_taken,secret4,Taken Cedula,V24000099,,
+imp_staff,secret5,Staff Member,,,teller
+imp_short,secret6
+imp_luis,secret7,Luis Import,,04142400007,
+"""
+
+
+def report(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_csv_import_reports_bad_rows_and_keeps_the_rest(client, auth, register):
+    register("imp_owner", "Owner", "V24000099")
+    r = client.post("/admin/users/import", content=CSV.encode(), headers=dict(auth(TELLER, "teller"), **{"Content-Type": "text/csv"}))
+    assert r.status_code == 200 and r.headers["content-type"] == "application/x-ndjson"
+    lines = report(r)
+    errors = {line["line"]: line["error"] for line in lines if "error" in line and "line" in line}
+    assert sorted(errors) == [3, 4, 5, 6, 7]
+    assert errors[4] == "Username repeated in the file"
+    assert errors[5] == "Cedula already registered"
+    assert errors[6] == "Role not allowed: teller"
+    assert errors[7] == "Expected 6 columns, got 2"
+    assert lines[-1] == {"done": True, "rows": 7, "imported": 2, "failed": 5}
+
+    assert client.post("/login", data={"username": "imp_luis", "password": "secret7"}).status_code == 200
+    found = client.get("/users/search", params={"q": "import", "fuzzy": False}, headers=auth(TELLER, "teller")).json()
+    assert sorted(item["full_name"] for item in found["items"]) == ["Ana Import", "Luis Import"]
+
+
+def test_jsonl_import_by_an_admin_in_chunks(client, auth):
+    rows = [{"username": f"imp_json{i}", "password": "pw", "role": "customer_service"} for i in range(3)]
+    body = "\n".join(json.dumps(row) for row in rows) + "\nnot json\n"
+    r = client.post("/admin/users/import", content=body.encode(), headers=dict(auth(ADMIN, "admin"), **{"Content-Type": "application/x-ndjson"}))
+    assert report(r)[-1] == {"done": True, "rows": 4, "imported": 3, "failed": 1}
+    assert client.post("/admin/users/import", content=body.encode(), headers=auth(1)).status_code == 403
+
+    async def run():
+        chunks = importer.read_chunks(await importer.spool(iter_bytes(b'{"username": "imp_chunk0", "password": "pw"}\n' * 3)))
+        return [line async for line in importer.import_users(chunks, "jsonl", main.UserCreate, {"client"}, chunk_size=2)]
+
+    # One report per chunk as it finishes; repeats are caught within a chunk and across chunks
+    lines = [json.loads(line) for out in asyncio.run(run()) for line in out.splitlines()]
+    assert [line.get("progress") for line in lines if "progress" in line] == [
+        {"rows": 2, "imported": 1, "failed": 1}, {"rows": 3, "imported": 1, "failed": 2},
+    ]
+    assert [line["error"] for line in lines if "error" in line and "line" in line] == [
+        "Username repeated in the file", "Username already registered",
+    ]
+
+
+async def iter_bytes(data):
+    yield data
@@ -0,0 +1,12 @@
+import time
+
+
+def test_live_at_once_ready_after_warm_up(client):
+    assert client.get("/healthz").json() == {"status": "ok"}
+    for _ in range(50):
+        r = client.get("/readyz")
+        if r.status_code == 200:
+            break
+        time.sleep(0.1)
+    assert r.status_code == 200 and r.json()["ready"]
+    assert 'route="/healthz"' in client.get("/metrics").text
@@ -0,0 +1,70 @@
+import pytest
+
+import search
+
+TELLER = 90001
+
+
+@pytest.fixture(scope="module", autouse=True)
+def customers(register):
+    return {
+        "maria": register("mquintero", "María Quintero", "V20000001", "04142000001"),
+        "mario": register("mquintana", "Mario Quintana", "V20000002", "04142000002"),
+        "marta": register("mquiroz", "Marta Quiroz", "V20000003", "04142000003"),
+    }
+
+
+def find(client, auth, **params):
+    r = client.get("/users/search", params=params, headers=auth(TELLER, "teller"))
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def names(page):
+    return [item["full_name"] for item in page["items"]]
+
+
+def test_prefix_and_accent_insensitive(client, auth):
+    assert sorted(names(find(client, auth, q="quint", fuzzy=False))) == ["Mario Quintana", "María Quintero"]
+    # Every word has to match, exact words first
+    assert names(find(client, auth, q="maria quintero"))[0] == "María Quintero"
+    assert names(find(client, auth, q="maria quintero", fuzzy=False)) == ["María Quintero"]
+    assert names(find(client, auth, q="mar qui"))[:1] in (["Mario Quintana"], ["María Quintero"], ["Marta Quiroz"])
+    assert len(names(find(client, auth, q="mar qui"))) == 3
+
+
+def test_typos_only_with_fuzzy(client, auth):
+    assert names(find(client, auth, q="quintro"))[0] == "María Quintero"
+    assert names(find(client, auth, q="quintro", fuzzy=False)) == []
+
+
+def test_cedula_and_phone_in_any_format(client, auth):
+    assert names(find(client, auth, q="V-20000002")) == ["Mario Quintana"]
+    assert names(find(client, auth, q="+58 414 2000003")) == ["Marta Quiroz"]
+
+
+def test_pages(client, auth):
+    first = find(client, auth, q="quint", fuzzy=False, limit=1)
+    second = find(client, auth, q="quint", fuzzy=False, limit=1, page=2)
+    assert first["has_more"] and not second["has_more"]
+    assert {names(first)[0], names(second)[0]} == {"Mario Quintana", "María Quintero"}
+
+
+def test_exact_cedula_lookup_is_unchanged(client, auth, customers):
+    teller = auth(TELLER, "teller")
+    r = client.get("/users/search", params={"cedula": "V20000003"}, headers=teller)
+    assert r.json()["id"] == customers["marta"]["id"] and "items" not in r.json()
+    assert client.get("/users/search", params={"cedula": "V0"}, headers=teller).status_code == 404
+    assert client.get("/users/search", headers=teller).status_code == 400
+
+
+def test_staff_only_and_too_broad(client, auth, monkeypatch):
+    assert client.get("/users/search", params={"q": "quint"}, headers=auth(TELLER)).status_code == 403
+    monkeypatch.setattr(search, "SEARCH_CANDIDATE_LIMIT", 1)
+    r = client.get("/users/search", params={"q": "quint"}, headers=auth(TELLER, "teller"))
+    assert (r.status_code, r.json()["detail"]) == (400, "Too many matches, refine your query")
+
+
+def test_accounts_are_optional_when_core_is_down(client, auth):
+    page = find(client, auth, q="quiroz", fuzzy=False, include_accounts=True)
+    assert [item["account_number"] for item in page["items"]] == [None]
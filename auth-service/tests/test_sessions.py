@@ -0,0 +1,25 @@
+def login(client, username, password):
+    return client.post("/login", data={"username": username, "password": password})
+
+
+def test_register_login_logout(client, register):
+    user = register("sessions1", "Ana Perez", "V10000001", "04121000001")
+    r = login(client, "sessions1", "sessions1")
+    assert r.status_code == 200
+    bearer = {"Authorization": "Bearer " + r.json()["access_token"]}
+    assert client.get("/users/me", headers=bearer).json()["id"] == user["id"]
+
+    assert client.post("/logout", headers=bearer).status_code == 200
+    r = client.get("/users/me", headers=bearer)
+    assert (r.status_code, r.json()["detail"]) == (401, "Token revoked")
+    # Other sessions of the same user are unaffected
+    again = {"Authorization": "Bearer " + login(client, "sessions1", "sessions1").json()["access_token"]}
+    assert client.get("/users/me", headers=again).status_code == 200
+
+
+def test_wrong_password_and_duplicates(client, register):
+    register("sessions2", cedula="V10000002")
+    assert login(client, "sessions2", "nope").status_code == 401
+    assert login(client, "nobody", "nope").status_code == 401
+    r = client.post("/register", json={"username": "sessions3", "password": "x", "cedula": "V10000002"})
+    assert (r.status_code, r.json()["detail"]) == (400, "Cedula already registered")
@@ -0,0 +1,17 @@
+"""
+Loaded before each service's tests/conftest.py. With TEST_POSTGRES_URL both services use
+that database, as they share one in docker-compose; it is a scratch database and its
+public schema is emptied once per run, here.
+"""
+import os
+
+from sqlalchemy import create_engine, text
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+if TEST_POSTGRES_URL:
+    engine = create_engine(TEST_POSTGRES_URL)
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    engine.dispose()
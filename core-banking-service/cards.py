@@ -0,0 +1,317 @@
+"""
+Card purchases: authorize places a hold, capture or void settles it.
+
+authorize takes the hold straight off accounts.balance with one conditional UPDATE, so the
+available balance is always current and two authorizations cannot overspend. capture
+books the purchase (a 'purchase' transaction and a ledger journal to SYS-CARD-SETTLEMENT)
+and gives back whatever was held but not captured; void gives the whole hold back.
+Holds not settled within CARD_HOLD_TTL_HOURS are given back by the sweep:
+    python cards.py expire [--every 300]
+
+Card number -> (account, expiry, CVV digest) comes from CardIndex, a dict in this process
+warmed at startup and updated when this process issues cards. A miss (a card issued by
+another worker) reads through to the database once. Numbers are matched on their digits, so
+"5286 9714 8209 1317" and "5286971482091317" are the same card. After CARD_CVV_MAX_FAILURES
+wrong CVVs or expiries a card is declined for CARD_CVV_LOCK_MINUTES (counted per worker).
+"""
+from fastapi import HTTPException
+from sqlalchemy import select, insert
+from sqlalchemy.orm import Session
+from collections import namedtuple
+from database import engine, wait_for_db, SessionLocal
+from models import Account, Card, CardHold, Transaction
+from bankcommon.cache import response_cache
+from transfers import debit, credit, check_amount
+from rollups import apply_rollups
+import ledger
+import argparse
+import datetime
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+CARD_HOLD_TTL_HOURS = float(os.getenv("CARD_HOLD_TTL_HOURS", "168"))
+CARD_INDEX_MAX_ENTRIES = int(os.getenv("CARD_INDEX_MAX_ENTRIES", "2000000"))
+CARD_INDEX_CHUNK_SIZE = 10000
+CARD_CVV_MAX_FAILURES = int(os.getenv("CARD_CVV_MAX_FAILURES", "5"))
+CARD_CVV_LOCK_MINUTES = float(os.getenv("CARD_CVV_LOCK_MINUTES", "30"))
+
+CardEntry = namedtuple("CardEntry", "card_id user_id account_id expires cvv_digest")
+
+
+def card_digits(card_number) -> str:
+    return "".join(ch for ch in str(card_number or "") if ch.isdigit())
+
+
+def stored_forms(digits: str):
+    # Issued cards are stored in groups of four (numbering.format_card_number), older rows may not be
+    return [digits, " ".join(digits[i:i + 4] for i in range(0, len(digits), 4))]
+
+
+def cvv_digest(card_number: str, cvv: str) -> bytes:
+    # The index never holds CVVs in clear
+    return hashlib.sha256(f"{card_number}:{cvv}".encode()).digest()
+
+
+def expiry_end(expiry: str):
+    """'MM/YY' -> first instant after the card's last valid month, None if malformed."""
+    try:
+        month, year = (int(part) for part in expiry.split("/"))
+    except (AttributeError, ValueError):
+        return None
+    if not 1 <= month <= 12:
+        return None
+    year += 2000 if year < 100 else 0
+    return datetime.datetime(year + month // 12, month % 12 + 1, 1)
+
+
+def card_stmt():
+    return select(Card.card_number, Card.id, Card.user_id, Account.id, Card.expiry, Card.cvv).outerjoin(
+        Account, Account.user_id == Card.user_id
+    )
+
+
+class CardIndex:
+    def __init__(self, max_entries: int = CARD_INDEX_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {}  # card digits -> CardEntry
+        self._failures = {}  # card digits -> [wrong CVV/expiry count, monotonic time of the first]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loaded = False
+
+    def add(self, card_number, card_id, user_id, account_id, expiry, cvv) -> CardEntry:
+        key = card_digits(card_number)
+        entry = CardEntry(card_id, user_id, account_id, expiry_end(expiry), cvv_digest(key, cvv))
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                # Oldest out; it reads through again if used
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = entry
+        return entry
+
+    def get(self, db: Session, card_number: str):
+        key = card_digits(card_number)
+        if not key:
+            return None
+        entry = self._entries.get(key)
+        # A card issued before its account has no account_id yet, look again
+        if entry is not None and entry.account_id is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        row = db.execute(card_stmt().where(Card.card_number.in_(stored_forms(key)))).first()
+        return self.add(*row) if row else None
+
+    def refresh(self, db: Session, card_numbers):
+        """Cards this process just issued."""
+        card_numbers = list(card_numbers)
+        for i in range(0, len(card_numbers), CARD_INDEX_CHUNK_SIZE):
+            for row in db.execute(card_stmt().where(Card.card_number.in_(card_numbers[i:i + CARD_INDEX_CHUNK_SIZE]))):
+                self.add(*row)
+
+    def locked(self, card_number: str) -> bool:
+        with self._lock:
+            failure = self._failures.get(card_digits(card_number))
+            if failure is None or failure[0] < CARD_CVV_MAX_FAILURES:
+                return False
+            if time.monotonic() - failure[1] < CARD_CVV_LOCK_MINUTES * 60:
+                return True
+            del self._failures[card_digits(card_number)]
+            return False
+
+    def record_failure(self, card_number: str):
+        key = card_digits(card_number)
+        with self._lock:
+            failure = self._failures.get(key)
+            if failure is None or time.monotonic() - failure[1] >= CARD_CVV_LOCK_MINUTES * 60:
+                self._failures[key] = [1, time.monotonic()]
+            else:
+                failure[0] += 1
+
+    def clear_failures(self, card_number: str):
+        if not self._failures:
+            return
+        with self._lock:
+            self._failures.pop(card_digits(card_number), None)
+
+    def load(self):
+        """Warm-up: every card (up to max_entries), in keyset chunks."""
+        db = SessionLocal()
+        try:
+            last_id = 0
+            while len(self._entries) < self.max_entries:
+                rows = db.execute(card_stmt().where(Card.id > last_id).order_by(Card.id).limit(CARD_INDEX_CHUNK_SIZE)).all()
+                if not rows:
+                    break
+                for row in rows:
+                    self.add(*row)
+                last_id = rows[-1][1]
+            self.loaded = True
+        finally:
+            db.close()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "loaded": self.loaded,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
+
+
+card_index = CardIndex()
+
+
+def hold_response(hold: CardHold) -> dict:
+    return {
+        "hold_id": hold.id,
+        "status": hold.status,
+        "merchant": hold.merchant,
+        "amount": hold.amount,
+        "captured_amount": hold.captured_amount,
+        "created_at": hold.created_at,
+        "expires_at": hold.expires_at,
+        "settled_at": hold.settled_at,
+    }
+
+
+def authorize(db: Session, card_number: str, expiry: str, cvv: str, amount: float, merchant: str, merchant_user_id: int) -> dict:
+    check_amount(amount)
+    entry = card_index.get(db, card_number)
+    # Same answer for an unknown card, a wrong CVV or expiry and a locked card
+    if entry is None or entry.account_id is None or card_index.locked(card_number):
+        raise HTTPException(status_code=402, detail="Card declined")
+    if (
+        not hmac.compare_digest(entry.cvv_digest, cvv_digest(card_digits(card_number), cvv))
+        or expiry_end(expiry) != entry.expires
+    ):
+        card_index.record_failure(card_number)
+        raise HTTPException(status_code=402, detail="Card declined")
+    card_index.clear_failures(card_number)
+    now = datetime.datetime.utcnow()
+    if entry.expires is None or now >= entry.expires:
+        raise HTTPException(status_code=402, detail="Card expired")
+
+    # The one balance update: conditional, so concurrent authorizations never overspend
+    if debit(db, entry.account_id, amount) is None:
+        db.rollback()
+        raise HTTPException(status_code=402, detail="Insufficient funds")
+    hold = dict(
+        card_id=entry.card_id, account_id=entry.account_id, user_id=entry.user_id,
+        merchant_user_id=merchant_user_id, merchant=merchant, amount=amount, status="authorized",
+        created_at=now, expires_at=now + datetime.timedelta(hours=CARD_HOLD_TTL_HOURS),
+    )
+    hold_id = db.execute(insert(CardHold).values(**hold).returning(CardHold.id)).scalar()
+    db.commit()
+    response_cache.invalidate("account", entry.user_id)
+    return {"hold_id": hold_id, "status": "authorized", "amount": amount, "expires_at": hold["expires_at"]}
+
+
+def load_open_hold(db: Session, hold_id: int, caller_id: int, is_admin: bool) -> CardHold:
+    hold = db.scalars(select(CardHold).where(CardHold.id == hold_id).with_for_update()).first()
+    if hold is None or (hold.merchant_user_id != caller_id and not is_admin):
+        raise HTTPException(status_code=404, detail="Hold not found")
+    if hold.status != "authorized":
+        raise HTTPException(status_code=409, detail=f"Hold already {hold.status}")
+    return hold
+
+
+def capture(db: Session, hold_id: int, amount, caller_id: int, is_admin: bool = False) -> dict:
+    """Books amount (default: the whole hold) as a purchase and releases the rest."""
+    try:
+        hold = load_open_hold(db, hold_id, caller_id, is_admin)
+        amount = hold.amount if amount is None else amount
+        check_amount(amount)
+        if amount > hold.amount:
+            raise HTTPException(status_code=400, detail="Capture exceeds the authorized amount")
+    except HTTPException:
+        db.rollback()
+        raise
+
+    now = datetime.datetime.utcnow()
+    money = ledger.to_money(amount)
+    release = float(ledger.to_money(hold.amount) - money)
+    if release > 0:
+        credit(db, hold.account_id, release)
+    settlement_id = ledger.system_account_id(db, "card_settlement")
+    ledger.post(db, "card_purchase", hold.merchant, [(hold.account_id, -money), (settlement_id, money)], now)
+    tx_purchase = dict(
+        user_id=hold.user_id,
+        amount=-amount,
+        transaction_type="purchase",
+        description=f"Card purchase - {hold.merchant}",
+        timestamp=now,
+    )
+    db.add(Transaction(**tx_purchase))
+    apply_rollups(db, [tx_purchase])
+    hold.status = "captured"
+    hold.captured_amount = amount
+    hold.settled_at = now
+    db.commit()
+    response_cache.invalidate("account", hold.user_id)
+    return hold_response(hold)
+
+
+def void(db: Session, hold_id: int, caller_id: int, is_admin: bool = False) -> dict:
+    try:
+        hold = load_open_hold(db, hold_id, caller_id, is_admin)
+    except HTTPException:
+        db.rollback()
+        raise
+    credit(db, hold.account_id, hold.amount)
+    hold.status = "voided"
+    hold.settled_at = datetime.datetime.utcnow()
+    db.commit()
+    response_cache.invalidate("account", hold.user_id)
+    return hold_response(hold)
+
+
+def expire_holds(db: Session, limit: int = 500) -> int:
+    """Gives back holds past expires_at, one batch. Returns how many."""
+    now = datetime.datetime.utcnow()
+    holds = db.scalars(
+        select(CardHold)
+        .where(CardHold.status == "authorized", CardHold.expires_at <= now)
+        .order_by(CardHold.expires_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    for hold in holds:
+        credit(db, hold.account_id, hold.amount)
+        hold.status = "expired"
+        hold.settled_at = now
+    db.commit()
+    if holds:
+        response_cache.invalidate("account", *{hold.user_id for hold in holds})
+    return len(holds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    expire = sub.add_parser("expire", help="give back holds that were never captured")
+    expire.add_argument("--every", type=float, default=0, help="keep running, one sweep every N seconds")
+    args = parser.parse_args()
+
+    wait_for_db(engine)  # the schema comes from migrate.py
+    while True:
+        db = SessionLocal()
+        try:
+            expired = 0
+            while True:
+                n = expire_holds(db)
+                expired += n
+                if n == 0:
+                    break
+        finally:
+            db.close()
+        print(f"Expired {expired} card holds")
+        if not args.every:
+            break
+        time.sleep(args.every)
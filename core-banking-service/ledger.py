@@ -0,0 +1,290 @@
+"""
+Double-entry ledger. Every money movement is a journal whose entries sum to zero: a
+transfer debits the sender and credits the receiver, a branch deposit credits the
+customer and debits the SYS-MINT system account. Entries are exact decimals (cents)
+and are never updated.
+
+accounts.balance stays the O(1) balance of customer accounts and changes in the same DB
+transaction as the entries. It is the available balance: open card holds (cards.py) are
+already taken off it. System accounts keep no balance in their row, which would be a hot
+row for every deposit and card purchase; theirs is the sum of their entries.
+
+A balance at a past time is the account's last snapshot plus the entries after it, so
+no read scans the whole history:
+    python ledger.py snapshot [--every 3600]
+    python ledger.py verify
+
+Snapshots only cover entries older than LEDGER_SNAPSHOT_LAG seconds, so a transaction
+still in flight when a snapshot is taken cannot be missed by it.
+"""
+from sqlalchemy import select, insert, func, and_, or_
+from sqlalchemy.orm import Session
+from decimal import Decimal
+from database import engine, wait_for_db, SessionLocal
+from models import Account, LedgerJournal, LedgerEntry, BalanceSnapshot, CardHold
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+LEDGER_SNAPSHOT_LAG = float(os.getenv("LEDGER_SNAPSHOT_LAG", "60"))
+LEDGER_CHUNK_SIZE = int(os.getenv("LEDGER_CHUNK_SIZE", "1000"))
+
+CENT = Decimal("0.01")
+
+# Counterparts for money entering or leaving the bank; user_id NULL, never a transfer target
+SYSTEM_ACCOUNTS = {
+    "mint": "SYS-MINT",  # branch deposits
+    "opening": "SYS-OPENING",  # balances that predate the ledger
+    "card_settlement": "SYS-CARD-SETTLEMENT",  # captured card purchases, paid out to merchants
+}
+
+_system_account_ids = {}
+
+
+def to_money(amount) -> Decimal:
+    return Decimal(str(amount)).quantize(CENT)
+
+
+def is_money(amount) -> bool:
+    """True if amount has no fraction of a cent, so entries and balance change by the same value."""
+    return Decimal(str(amount)) == to_money(amount)
+
+
+def ensure_system_accounts(db: Session):
+    """Called by migrate.py. Does not commit."""
+    existing = set(db.scalars(select(Account.account_number).where(Account.account_number.in_(SYSTEM_ACCOUNTS.values()))))
+    for number in SYSTEM_ACCOUNTS.values():
+        if number not in existing:
+            db.add(Account(user_id=None, account_number=number, balance=0.0))
+    db.flush()
+
+
+def system_account_id(db: Session, name: str) -> int:
+    if name not in _system_account_ids:
+        account_id = db.scalar(select(Account.id).where(Account.account_number == SYSTEM_ACCOUNTS[name]))
+        if account_id is None:
+            raise RuntimeError(f"System account {SYSTEM_ACCOUNTS[name]} missing, run migrate.py")
+        _system_account_ids[name] = account_id
+    return _system_account_ids[name]
+
+
+def entry_rows(journal_id: int, legs, now: datetime.datetime):
+    if sum(amount for _, amount in legs) != 0:
+        raise ValueError(f"Unbalanced journal: {legs}")
+    return [dict(journal_id=journal_id, account_id=account_id, amount=amount, created_at=now) for account_id, amount in legs]
+
+
+def post(db: Session, kind: str, description: str, legs, now: datetime.datetime = None) -> int:
+    """One journal. legs are (account_id, Decimal amount) summing to zero. Does not commit."""
+    now = now or datetime.datetime.utcnow()
+    journal_id = db.execute(
+        insert(LedgerJournal).values(kind=kind, description=description, created_at=now).returning(LedgerJournal.id)
+    ).scalar()
+    db.execute(insert(LedgerEntry), entry_rows(journal_id, legs, now))
+    return journal_id
+
+
+def post_many(db: Session, kind: str, postings, now: datetime.datetime = None, chunk_size: int = LEDGER_CHUNK_SIZE):
+    """Bulk version of post() for batch writers. postings are (description, legs). Does not commit."""
+    now = now or datetime.datetime.utcnow()
+    postings = list(postings)
+    for i in range(0, len(postings), chunk_size):
+        chunk = postings[i:i + chunk_size]
+        journal_ids = db.scalars(
+            insert(LedgerJournal).returning(LedgerJournal.id, sort_by_parameter_order=True),
+            [dict(kind=kind, description=description, created_at=now) for description, _ in chunk],
+        ).all()
+        rows = []
+        for journal_id, (_, legs) in zip(journal_ids, chunk):
+            rows.extend(entry_rows(journal_id, legs, now))
+        db.execute(insert(LedgerEntry), rows)
+
+
+def open_balances(db: Session, chunk_size: int = LEDGER_CHUNK_SIZE) -> int:
+    """Opening journals for accounts that had a balance before the ledger existed.
+
+    Run from migrate.py, before traffic. Accounts that already have entries are left alone,
+    so running it again is a no-op. Does not commit.
+    """
+    opening_id = system_account_id(db, "opening")
+    has_entries = select(LedgerEntry.id).where(LedgerEntry.account_id == Account.id).exists()
+    opened = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(Account.id, Account.balance)
+            .where(Account.id > last_id, Account.user_id.isnot(None), ~has_entries)
+            .order_by(Account.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return opened
+        last_id = rows[-1].id
+        postings = [
+            ("Opening balance", [(row.id, to_money(row.balance)), (opening_id, -to_money(row.balance))])
+            for row in rows if to_money(row.balance) != 0
+        ]
+        if postings:
+            post_many(db, "opening", postings, chunk_size=chunk_size)
+            opened += len(postings)
+
+
+# ---- Snapshots ----
+
+def latest_snapshots(db: Session, account_ids, at: datetime.datetime = None):
+    """account_id -> (as_of, balance) of the newest snapshot, optionally not after at."""
+    newest = select(BalanceSnapshot.account_id, func.max(BalanceSnapshot.as_of).label("as_of")).where(
+        BalanceSnapshot.account_id.in_(account_ids)
+    )
+    if at is not None:
+        newest = newest.where(BalanceSnapshot.as_of <= at)
+    newest = newest.group_by(BalanceSnapshot.account_id).subquery()
+    rows = db.execute(
+        select(BalanceSnapshot.account_id, BalanceSnapshot.as_of, BalanceSnapshot.balance).join(
+            newest, and_(BalanceSnapshot.account_id == newest.c.account_id, BalanceSnapshot.as_of == newest.c.as_of)
+        )
+    )
+    return {row.account_id: (row.as_of, row.balance) for row in rows}
+
+
+def take_snapshots(db: Session, as_of: datetime.datetime, chunk_size: int = LEDGER_CHUNK_SIZE) -> int:
+    """Snapshots every account with entries since the previous run, as of as_of.
+
+    One DB transaction for the whole run: either every active account gets its row or none does.
+    """
+    previous = db.scalar(select(func.max(BalanceSnapshot.as_of)))
+    if previous is not None and previous >= as_of:
+        return 0
+    window = select(LedgerEntry.account_id, func.sum(LedgerEntry.amount)).where(LedgerEntry.created_at <= as_of)
+    if previous is not None:
+        window = window.where(LedgerEntry.created_at > previous)
+    changes = db.execute(window.group_by(LedgerEntry.account_id).order_by(LedgerEntry.account_id)).all()
+    for i in range(0, len(changes), chunk_size):
+        chunk = changes[i:i + chunk_size]
+        before = latest_snapshots(db, [account_id for account_id, _ in chunk])
+        db.execute(insert(BalanceSnapshot), [
+            dict(
+                account_id=account_id,
+                as_of=as_of,
+                balance=to_money(Decimal(before.get(account_id, (None, 0))[1]) + Decimal(change)),
+            )
+            for account_id, change in chunk
+        ])
+    db.commit()
+    return len(changes)
+
+
+def balance_at(db: Session, account_id: int, at: datetime.datetime) -> Decimal:
+    """Ledger balance of the account including every entry created up to at; card holds are not entries."""
+    as_of, balance = latest_snapshots(db, [account_id], at).get(account_id, (None, 0))
+    tail = select(func.coalesce(func.sum(LedgerEntry.amount), 0)).where(
+        LedgerEntry.account_id == account_id, LedgerEntry.created_at <= at
+    )
+    if as_of is not None:
+        tail = tail.where(LedgerEntry.created_at > as_of)
+    return to_money(Decimal(balance) + Decimal(db.scalar(tail)))
+
+
+def held_at(db: Session, account_id: int, at: datetime.datetime = None) -> Decimal:
+    """Card holds open on the account at that time (now if None)."""
+    stmt = select(func.coalesce(func.sum(CardHold.amount), 0)).where(CardHold.account_id == account_id)
+    if at is None:
+        stmt = stmt.where(CardHold.status == "authorized")
+    else:
+        stmt = stmt.where(
+            CardHold.created_at <= at, or_(CardHold.settled_at.is_(None), CardHold.settled_at > at)
+        )
+    return to_money(db.scalar(stmt))
+
+
+# ---- Audit ----
+
+def verify(db: Session, chunk_size: int = LEDGER_CHUNK_SIZE, limit: int = 20) -> dict:
+    """Journals that do not sum to zero, and customer accounts whose balance differs from the ledger."""
+    if db.get_bind().dialect.name == "postgresql":
+        # Balances and entries from one consistent view while transfers keep running
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    unbalanced = db.execute(
+        select(LedgerEntry.journal_id, func.sum(LedgerEntry.amount))
+        .group_by(LedgerEntry.journal_id)
+        .having(func.abs(func.sum(LedgerEntry.amount)) >= CENT / 2)
+        .limit(limit)
+    ).all()
+
+    # Every account with entries up to the last snapshot run has a snapshot from it
+    last_run = db.scalar(select(func.max(BalanceSnapshot.as_of)))
+    tail = select(LedgerEntry.account_id, func.sum(LedgerEntry.amount)).group_by(LedgerEntry.account_id)
+    if last_run is not None:
+        tail = tail.where(LedgerEntry.created_at > last_run)
+    tails = dict(db.execute(tail).all())
+
+    mismatched = []
+    checked = 0
+    last_id = 0
+    while True:
+        accounts = db.execute(
+            select(Account.id, Account.account_number, Account.balance)
+            .where(Account.id > last_id, Account.user_id.isnot(None)).order_by(Account.id).limit(chunk_size)
+        ).all()
+        if not accounts:
+            break
+        last_id = accounts[-1].id
+        ids = [a.id for a in accounts]
+        snapshots = latest_snapshots(db, ids) if last_run is not None else {}
+        held = dict(db.execute(
+            select(CardHold.account_id, func.sum(CardHold.amount))
+            .where(CardHold.account_id.in_(ids), CardHold.status == "authorized")
+            .group_by(CardHold.account_id)
+        ).all())
+        for account in accounts:
+            checked += 1
+            ledger_balance = (
+                Decimal(snapshots.get(account.id, (None, 0))[1]) + Decimal(tails.get(account.id, 0))
+                - to_money(held.get(account.id, 0))
+            )
+            if abs(to_money(ledger_balance) - to_money(account.balance)) >= CENT and len(mismatched) < limit:
+                mismatched.append({
+                    "account_number": account.account_number,
+                    "balance": account.balance,
+                    "ledger_balance": float(to_money(ledger_balance)),
+                })
+    db.rollback()
+    return {
+        "accounts_checked": checked,
+        "unbalanced_journals": [{"journal_id": j, "sum": float(s)} for j, s in unbalanced],
+        "mismatched_accounts": mismatched,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    snap = sub.add_parser("snapshot", help="snapshot the balances of accounts that moved since the last run")
+    snap.add_argument("--every", type=float, default=0, help="keep running, one snapshot every N seconds")
+    sub.add_parser("verify", help="check journals and balances against the ledger")
+    args = parser.parse_args()
+
+    wait_for_db(engine)  # the schema comes from migrate.py
+    if args.command == "snapshot":
+        while True:
+            db = SessionLocal()
+            try:
+                as_of = datetime.datetime.utcnow() - datetime.timedelta(seconds=LEDGER_SNAPSHOT_LAG)
+                print(f"Snapshotted {take_snapshots(db, as_of)} accounts as of {as_of.isoformat()}")
+            finally:
+                db.close()
+            if not args.every:
+                break
+            time.sleep(args.every)
+    else:
+        db = SessionLocal()
+        try:
+            report = verify(db)
+        finally:
+            db.close()
+        print(json.dumps(report, indent=2))
+        if report["unbalanced_journals"] or report["mismatched_accounts"]:
+            sys.exit(1)
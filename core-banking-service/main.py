@@ -1,18 +1,39 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Header, Query, Response, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from database import Base, engine, get_db
-from models import Account, Card, Transaction, Beneficiary, Notification
-from pydantic import BaseModel
-import jwt
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, tuple_, func
+from sqlalchemy.exc import IntegrityError
+from database import get_db, get_read_db, SessionLocal, ReadSessionLocal, get_async_db, get_async_read_db, pool_status, readiness, warm_up, DB_MODE
+from models import Account, Card, Transaction, Beneficiary, Notification, TransactionRollup, ScheduledTransfer, RevokedToken
+from notifier import hub
+from bankcommon.cache import response_cache
+from transfers import post_transfer, post_transfer_async, post_batch_transfer, apply_deposit, check_amount
+from bankcommon.tokens import get_current_user_payload, require_roles, use_database_revocations
+import numbering
+import outbox
+import ledger
+import reconcile
+import cards
+import scheduler
+from bankcommon import metrics
+from pydantic import BaseModel, Field
+import asyncio
 import random
 import datetime
-from typing import Optional, List
-
-# Create tables
-Base.metadata.create_all(bind=engine)
+import base64
+import csv
+import io
+import json
+import os
+from typing import Optional, List, Literal
 
 app = FastAPI()
 
+# Logouts made through auth-service, read from revoked_tokens
+use_database_revocations(SessionLocal, RevokedToken)
+
 from fastapi.middleware.cors import CORSMiddleware
 
 app.add_middleware(
@@ -21,7 +42,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-DB-Queries", "X-DB-Time-Ms"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Tables come from `python migrate.py`; startup only schedules background work so the
+# process accepts traffic right away. /readyz reports when the DB pools are warm.
+async def warm_up_and_start_worker():
+    await warm_up()
+    if readiness.ready:
+        # Card index for /cards/authorize; until it is loaded lookups read through to the DB
+        await asyncio.get_running_loop().run_in_executor(None, cards.card_index.load)
+    # OUTBOX_WORKER=external when `python outbox.py worker` runs as its own process
+    if outbox.OUTBOX_WORKER == "embedded":
+        outbox.worker.start()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.warm_up_task = asyncio.create_task(warm_up_and_start_worker())
+
+@app.on_event("shutdown")
+def stop_background_tasks():
+    # Also ends a warm-up still waiting for the database, so the process can exit
+    readiness.stopping.set()
+    outbox.worker.stop()
+
+# Read endpoints and /transfer exist in a sync (threadpool) and an async flavour.
+# DB_MODE picks which one serves the normal path, the other is mounted under a prefix.
+sync_router = APIRouter()
+async_router = APIRouter()
 
 class TransferRequest(BaseModel):
     to_account_number: str
@@ -31,6 +80,15 @@ class TransferRequest(BaseModel):
     description: Optional[str] = "Transferencia"
     beneficiary_name: Optional[str] = None
 
+class BatchTransferItem(BaseModel):
+    to_account_number: str
+    amount: float
+
+class BatchTransferRequest(BaseModel):
+    items: List[BatchTransferItem] = Field(..., min_length=1, max_length=10000)
+    description: Optional[str] = "Pago"
+    mode: Literal["all_or_nothing", "best_effort"] = "all_or_nothing"
+
 class BeneficiaryCreate(BaseModel):
     name: str
     account_number: str
@@ -70,10 +128,71 @@ class TransactionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CardAuthorizeRequest(BaseModel):
+    card_number: str
+    expiry: str # MM/YY
+    cvv: str
+    amount: float
+    merchant: str = Field(..., min_length=1, max_length=100)
+
+class CardCaptureRequest(BaseModel):
+    hold_id: int
+    amount: Optional[float] = None # Default: the whole hold
+
+class CardVoidRequest(BaseModel):
+    hold_id: int
+
+class ScheduledTransferCreate(BaseModel):
+    to_account_number: Optional[str] = None
+    beneficiary_id: Optional[int] = None # Saved beneficiary instead of an account number
+    amount: float
+    description: Optional[str] = Field(None, max_length=200)
+    frequency: Literal["once", "daily", "weekly", "monthly"]
+    starts_at: datetime.datetime # First run; later runs keep its time and day of month
+    ends_at: Optional[datetime.datetime] = None
+
+class ScheduledTransferUpdate(BaseModel):
+    amount: Optional[float] = None
+    description: Optional[str] = Field(None, max_length=200)
+    ends_at: Optional[datetime.datetime] = None
+    status: Optional[Literal["active", "paused"]] = None
+
+class ScheduledTransferResponse(BaseModel):
+    id: int
+    to_account_number: str
+    beneficiary_id: Optional[int] = None
+    amount: float
+    description: str
+    frequency: str
+    starts_at: datetime.datetime
+    ends_at: Optional[datetime.datetime] = None
+    status: str
+    next_run_at: Optional[datetime.datetime] = None
+    occurrences_done: int
+    last_run_at: Optional[datetime.datetime] = None
+    last_status: Optional[str] = None
+    last_error: Optional[str] = None
+
 class MintRequest(BaseModel):
     account_number: str
     amount: float
 
+class OnboardingRequest(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1, max_length=5000)
+    issue_cards: bool = True
+
+class OnboardingIssued(BaseModel):
+    user_id: int
+    account_number: str
+    card_number: Optional[str] = None
+
+class AccountLookupRequest(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1, max_length=200)
+
+class AccountLookupItem(BaseModel):
+    user_id: int
+    account_number: str
+
 class AccountResponse(BaseModel):
     id: int
     user_id: int
@@ -83,6 +202,14 @@ class AccountResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class BalanceResponse(BaseModel):
+    account_number: str
+    # Available balance, what /accounts/me shows: the ledger balance less the card holds open at that time
+    balance: float
+    ledger_balance: float # Booked entries only, holds are not in the ledger
+    held: float
+    as_of: Optional[datetime.datetime] = None # None: now
+
 class CardResponse(BaseModel):
     card_number: str
     expiry: str
@@ -91,18 +218,45 @@ class CardResponse(BaseModel):
     class Config:
         from_attributes = True
 
-SECRET_KEY = "mysecretkey"
-ALGORITHM = "HS256"
+class DashboardResponse(BaseModel):
+    account: Optional[AccountResponse] = None
+    cards: List[CardResponse]
+    unread_notifications: int # Within the last notification_window_days
+    notification_window_days: int
+    month_income: float
+    month_expense: float
+    recent_transactions: List[TransactionResponse]
+    top_beneficiaries: List[BeneficiaryResponse]
 
-def get_current_user_payload(authorization: str = Header(None)):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing Authorization Header")
-    try:
-        token = authorization.split(" ")[1]
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid Token")
+def save_with_unique_number(db: Session, make_row, next_number):
+    # Allocated numbers never repeat; a clash is only possible with a legacy random number
+    for _ in range(5):
+        row = make_row(next_number())
+        db.add(row)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            continue
+        db.refresh(row)
+        return row
+    raise HTTPException(status_code=500, detail="Could not allocate a unique number")
+
+def allocate_free_numbers(db: Session, column, allocate, count: int):
+    """Allocates count numbers, skipping legacy clashes with one IN query per round."""
+    numbers = []
+    while len(numbers) < count:
+        batch = allocate(count - len(numbers))
+        taken = {row[0] for row in db.query(column).filter(column.in_(batch))}
+        numbers.extend(n for n in batch if n not in taken)
+    return numbers
+
+def new_card_fields():
+    month = f"{random.randint(1,12):02d}"
+    year = (datetime.datetime.now().year + 5) % 100
+    expiry = f"{month}/{year}"
+    cvv = f"{random.randint(100,999)}"
+    return expiry, cvv
 
 @app.post("/accounts", response_model=AccountResponse)
 def create_account(payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
@@ -112,81 +266,371 @@ def create_account(payload: dict = Depends(get_current_user_payload), db: Sessio
     if db_account:
         return db_account
     
-    # Generate Unique Account Number (10 digits)
-    while True:
-        acc_num = str(random.randint(1000000000, 9999999999))
-        if not db.query(Account).filter(Account.account_number == acc_num).first():
-            break
-
-    new_account = Account(user_id=user_id, account_number=acc_num, balance=0.0)
-    db.add(new_account)
-    
-    db.commit()
-    db.refresh(new_account)
-    return new_account
+    # Unique Account Number (10 digits) from the allocator
+    account = save_with_unique_number(
+        db,
+        lambda acc_num: Account(user_id=user_id, account_number=acc_num, balance=0.0),
+        lambda: numbering.account_numbers(1)[0],
+    )
+    response_cache.invalidate("account", user_id)
+    return account
 
 @app.post("/cards", response_model=CardResponse)
 def create_card(payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
     user_id = payload.get("user_id")
+    expiry, cvv = new_card_fields()
     
-    # Generate Unique Mastercard
-    while True:
-        # Debit Mastercard range
-        part1 = 5200 + random.randint(0, 99) 
-        part2 = random.randint(1000, 9999)
-        part3 = random.randint(1000, 9999)
-        part4 = random.randint(1000, 9999)
-        card_num = f"{part1} {part2} {part3} {part4}"
-        
-        if not db.query(Card).filter(Card.card_number == card_num).first():
-             break
-    
-    month = f"{random.randint(1,12):02d}"
-    year = (datetime.datetime.now().year + 5) % 100
-    expiry = f"{month}/{year}"
-    cvv = f"{random.randint(100,999)}"
+    # Unique, Luhn-valid Mastercard from the allocator
+    card = save_with_unique_number(
+        db,
+        lambda card_num: Card(user_id=user_id, card_number=card_num, expiry=expiry, cvv=cvv),
+        lambda: numbering.card_numbers(1)[0],
+    )
+    cards.card_index.refresh(db, [card.card_number])
+    response_cache.invalidate("cards", user_id)
+    return card
+
+@app.post("/admin/onboarding/issue", response_model=List[OnboardingIssued])
+def bulk_issue(req: OnboardingRequest, payload: dict = Depends(require_roles("teller", "admin")), db: Session = Depends(get_db)):
+    # Accounts (and cards) for a whole onboarding batch, in one transaction
+    user_ids = list(dict.fromkeys(req.user_ids))
+    accounts = {
+        row.user_id: row.account_number
+        for row in db.query(Account.user_id, Account.account_number).filter(Account.user_id.in_(user_ids))
+    }
+    new_users = [uid for uid in user_ids if uid not in accounts]
+    # Allocate everything before writing, the allocator commits on its own connection
+    acc_numbers = allocate_free_numbers(db, Account.account_number, numbering.account_numbers, len(new_users))
+    card_nums = allocate_free_numbers(db, Card.card_number, numbering.card_numbers, len(user_ids)) if req.issue_cards else []
+
+    if new_users:
+        db.execute(insert(Account), [
+            {"user_id": uid, "account_number": acc_num, "balance": 0.0}
+            for uid, acc_num in zip(new_users, acc_numbers)
+        ])
+        accounts.update(zip(new_users, acc_numbers))
+
+    issued_cards = {}
+    if req.issue_cards:
+        rows = []
+        for uid, card_num in zip(user_ids, card_nums):
+            expiry, cvv = new_card_fields()
+            rows.append({"user_id": uid, "card_number": card_num, "expiry": expiry, "cvv": cvv})
+            issued_cards[uid] = card_num
+        db.execute(insert(Card), rows)
 
-    new_card = Card(user_id=user_id, card_number=card_num, expiry=expiry, cvv=cvv)
-    db.add(new_card)
     db.commit()
-    db.refresh(new_card)
-    return new_card
+    response_cache.invalidate("account", *new_users)
+    if req.issue_cards:
+        cards.card_index.refresh(db, card_nums)
+        response_cache.invalidate("cards", *user_ids)
+    return [
+        OnboardingIssued(user_id=uid, account_number=accounts[uid], card_number=issued_cards.get(uid))
+        for uid in user_ids
+    ]
+
+@app.get("/accounts/me/balance", response_model=BalanceResponse)
+def get_my_balance(
+    as_of: Optional[datetime.datetime] = None,
+    payload: dict = Depends(get_current_user_payload),
+    db: Session = Depends(get_read_db),
+):
+    # Current balance is the account row; a past one is a ledger snapshot plus the entries after it.
+    # Either way balance is net of the holds open then, and ledger_balance is before them.
+    account = db.query(Account).filter(Account.user_id == payload.get("user_id")).first()
+    if not account:
+        raise HTTPException(status_code=404, detail="Account not found")
+    if as_of is None:
+        held = ledger.held_at(db, account.id)
+        return BalanceResponse(
+            account_number=account.account_number, balance=account.balance,
+            ledger_balance=float(ledger.to_money(account.balance) + held), held=float(held),
+        )
+    if as_of.tzinfo is not None:
+        as_of = as_of.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    booked = ledger.balance_at(db, account.id, as_of)
+    held = ledger.held_at(db, account.id, as_of)
+    return BalanceResponse(
+        account_number=account.account_number, balance=float(booked - held),
+        ledger_balance=float(booked), held=float(held), as_of=as_of,
+    )
+
+@app.post("/accounts/lookup", response_model=List[AccountLookupItem])
+def lookup_accounts(req: AccountLookupRequest, payload: dict = Depends(require_roles("teller", "admin", "customer_service")), db: Session = Depends(get_read_db)):
+    # Account numbers for a page of staff search results, one query; users without an account are left out
+    rows = db.query(Account.user_id, Account.account_number).filter(Account.user_id.in_(set(req.user_ids)))
+    return [AccountLookupItem(user_id=row.user_id, account_number=row.account_number) for row in rows]
 
-@app.get("/cards/me", response_model=list[CardResponse])
-def get_my_cards(payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+# /cards/me, /accounts/me and /beneficiaries go through the per-user response cache:
+# a hit or a matching If-None-Match never opens a DB connection.
+@sync_router.get("/cards/me", response_model=list[CardResponse])
+def get_my_cards(request: Request, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
     user_id = payload.get("user_id")
+    version, cached = response_cache.lookup(request, "cards", user_id)
+    if cached:
+        return cached
     cards = db.query(Card).filter(Card.user_id == user_id).all()
-    return cards
+    return response_cache.store("cards", user_id, version, [CardResponse.model_validate(c) for c in cards])
 
-@app.get("/accounts/me", response_model=AccountResponse)
-def get_my_account(payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+@sync_router.get("/accounts/me", response_model=AccountResponse)
+def get_my_account(request: Request, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
     user_id = payload.get("user_id")
+    version, cached = response_cache.lookup(request, "account", user_id)
+    if cached:
+        return cached
     account = db.query(Account).filter(Account.user_id == user_id).first()
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    return account
+    return response_cache.store("account", user_id, version, AccountResponse.model_validate(account))
 
-@app.get("/movements", response_model=List[TransactionResponse])
-def get_movements(payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
-    user_id = payload.get("user_id")
-    # Get all transactions where user_id is the owner
-    txs = db.query(Transaction).filter(Transaction.user_id == user_id).order_by(Transaction.timestamp.desc()).all()
+def encode_cursor(timestamp: datetime.datetime, tx_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{tx_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        ts, tx_id = raw.split("|")
+        return datetime.datetime.fromisoformat(ts), int(tx_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def movements_stmt(user_id, limit, cursor, date_from, date_to, transaction_type, min_amount, max_amount):
+    stmt = select(Transaction).where(Transaction.user_id == user_id)
+
+    if date_from:
+        stmt = stmt.where(Transaction.timestamp >= date_from)
+    if date_to:
+        stmt = stmt.where(Transaction.timestamp < date_to)
+    if transaction_type:
+        stmt = stmt.where(Transaction.transaction_type == transaction_type)
+    if min_amount is not None:
+        stmt = stmt.where(Transaction.amount >= min_amount)
+    if max_amount is not None:
+        stmt = stmt.where(Transaction.amount <= max_amount)
+
+    # Keyset pagination: continue strictly after the last (timestamp, id) of the previous page
+    if cursor:
+        last_ts, last_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Transaction.timestamp, Transaction.id) < tuple_(last_ts, last_id))
+        # Same bound spelled so the planner can skip newer monthly partitions
+        stmt = stmt.where(Transaction.timestamp <= last_ts)
+
+    # Fetch one extra row to know if there is a next page
+    return stmt.order_by(Transaction.timestamp.desc(), Transaction.id.desc()).limit(limit + 1)
+
+def paginate_movements(response: Response, txs, limit):
+    if len(txs) > limit:
+        txs = txs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(txs[-1].timestamp, txs[-1].id)
     return txs
 
-@app.get("/beneficiaries", response_model=List[BeneficiaryResponse])
-def get_beneficiaries(payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+@sync_router.get("/movements", response_model=List[TransactionResponse])
+@sync_router.get("/transactions", response_model=List[TransactionResponse])
+def get_movements(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    date_from: Optional[datetime.datetime] = None,
+    date_to: Optional[datetime.datetime] = None,
+    transaction_type: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    payload: dict = Depends(get_current_user_payload),
+    db: Session = Depends(get_read_db),
+):
+    user_id = payload.get("user_id")
+    stmt = movements_stmt(user_id, limit, cursor, date_from, date_to, transaction_type, min_amount, max_amount)
+    txs = db.execute(stmt).scalars().all()
+    return paginate_movements(response, txs, limit)
+
+EXPORT_CHUNK_ROWS = 1000
+
+def export_rows(user_id: int, date_from, date_to):
+    """Yields (id, timestamp, type, description, amount, running_balance), oldest first."""
+    # Own session: the response body is produced after the handler has returned
+    db = ReadSessionLocal()
+    try:
+        opening = 0.0
+        if date_from:
+            opening = db.query(func.coalesce(func.sum(Transaction.amount), 0.0)).filter(
+                Transaction.user_id == user_id, Transaction.timestamp < date_from
+            ).scalar()
+        stmt = select(
+            Transaction.id, Transaction.timestamp, Transaction.transaction_type,
+            Transaction.description, Transaction.amount,
+        ).where(Transaction.user_id == user_id)
+        if date_from:
+            stmt = stmt.where(Transaction.timestamp >= date_from)
+        if date_to:
+            stmt = stmt.where(Transaction.timestamp < date_to)
+        stmt = stmt.order_by(Transaction.timestamp.asc(), Transaction.id.asc())
+
+        # yield_per streams through a server-side cursor, memory stays flat at any history size
+        balance = opening
+        for row in db.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_ROWS)):
+            balance += row.amount
+            yield row.id, row.timestamp, row.transaction_type, row.description, row.amount, balance
+    finally:
+        db.close()
+
+def export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["id", "timestamp", "transaction_type", "description", "amount", "balance"])
+    for i, (tx_id, ts, tx_type, description, amount, balance) in enumerate(rows, 1):
+        writer.writerow([tx_id, ts.isoformat(), tx_type, description, f"{amount:.2f}", f"{balance:.2f}"])
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_jsonl(rows):
+    lines = []
+    for tx_id, ts, tx_type, description, amount, balance in rows:
+        lines.append(json.dumps({
+            "id": tx_id, "timestamp": ts.isoformat(), "transaction_type": tx_type,
+            "description": description, "amount": amount, "balance": round(balance, 2),
+        }))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+@app.get("/movements/export")
+def export_movements(
+    format: Literal["csv", "jsonl"] = "csv",
+    date_from: Optional[datetime.datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime.datetime] = Query(None, alias="to"),
+    payload: dict = Depends(get_current_user_payload),
+):
+    # Full-history statement with running balance, streamed row by row
+    user_id = payload.get("user_id")
+    rows = export_rows(user_id, date_from, date_to)
+    if format == "csv":
+        body, media_type = export_csv(rows), "text/csv"
+    else:
+        body, media_type = export_jsonl(rows), "application/x-ndjson"
+    filename = f"statement-{datetime.date.today().isoformat()}.{format}"
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@sync_router.get("/beneficiaries", response_model=List[BeneficiaryResponse])
+def get_beneficiaries(request: Request, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
     user_id = payload.get("user_id")
-    return db.query(Beneficiary).filter(Beneficiary.user_id == user_id).all()
+    version, cached = response_cache.lookup(request, "beneficiaries", user_id)
+    if cached:
+        return cached
+    beneficiaries = db.query(Beneficiary).filter(Beneficiary.user_id == user_id).all()
+    return response_cache.store("beneficiaries", user_id, version, [BeneficiaryResponse.model_validate(b) for b in beneficiaries])
 
-@app.get("/notifications", response_model=List[NotificationResponse])
-def get_notifications(payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+# The inbox covers the last NOTIFICATION_WINDOW_DAYS: with a timestamp bound on these reads,
+# Postgres only scans the latest monthly partitions (see partitions.py). Responses say
+# which window they cover; read-all still reaches every partition.
+NOTIFICATION_WINDOW_DAYS = int(os.getenv("NOTIFICATION_WINDOW_DAYS", "90"))
+
+def in_notification_window():
+    return Notification.timestamp >= datetime.datetime.utcnow() - datetime.timedelta(days=NOTIFICATION_WINDOW_DAYS)
+
+def notifications_stmt(user_id, since_id, limit):
+    stmt = select(Notification).where(Notification.user_id == user_id, in_notification_window())
+    if since_id is not None:
+        stmt = stmt.where(Notification.id > since_id)
+    return stmt.order_by(Notification.timestamp.desc(), Notification.id.desc()).limit(limit)
+
+@sync_router.get("/notifications", response_model=List[NotificationResponse])
+def get_notifications(
+    response: Response,
+    since_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    payload: dict = Depends(get_current_user_payload),
+    db: Session = Depends(get_read_db),
+):
     user_id = payload.get("user_id")
-    notifs = db.query(Notification).filter(Notification.user_id == user_id).order_by(Notification.timestamp.desc()).all()
+    response.headers["X-Notification-Window-Days"] = str(NOTIFICATION_WINDOW_DAYS)
+    return db.execute(notifications_stmt(user_id, since_id, limit)).scalars().all()
+
+@app.get("/notifications/unread-count")
+def get_unread_count(payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_read_db)):
+    user_id = payload.get("user_id")
+    unread = (
+        db.query(func.count(Notification.id))
+        .filter(Notification.user_id == user_id, Notification.is_read == 0, in_notification_window())
+        .scalar()
+    )
+    return {"unread": unread, "window_days": NOTIFICATION_WINDOW_DAYS}
+
+def load_notifications_since(user_id: int, since_id: int, limit: int = 50):
+    # Short-lived session: waiting clients must not pin a pooled connection.
+    # Primary on purpose: a replica may not have the row yet when the hub wakes us up.
+    db = SessionLocal()
+    try:
+        notifs = (
+            db.query(Notification)
+            .filter(Notification.user_id == user_id, Notification.id > since_id, in_notification_window())
+            .order_by(Notification.id.asc())
+            .limit(limit)
+            .all()
+        )
+        return [NotificationResponse.model_validate(n) for n in notifs]
+    finally:
+        db.close()
+
+@app.get("/notifications/poll", response_model=List[NotificationResponse])
+async def poll_notifications(
+    since_id: int = 0,
+    timeout: int = Query(25, ge=0, le=55),
+    payload: dict = Depends(get_current_user_payload),
+):
+    # Long-poll: answers right away if there is something new, otherwise waits for a writer
+    user_id = payload.get("user_id")
+    waiter = hub.subscribe(user_id)
+    try:
+        notifs = await run_in_threadpool(load_notifications_since, user_id, since_id)
+        if not notifs and await hub.wait(waiter, timeout):
+            notifs = await run_in_threadpool(load_notifications_since, user_id, since_id)
+    finally:
+        hub.unsubscribe(user_id, waiter)
     return notifs
 
+@app.get("/notifications/stream")
+async def stream_notifications(
+    request: Request,
+    since_id: int = 0,
+    last_event_id: Optional[str] = Header(None),
+    payload: dict = Depends(get_current_user_payload),
+):
+    # Server-Sent Events; reconnecting clients resume from Last-Event-ID
+    user_id = payload.get("user_id")
+    cursor = int(last_event_id) if last_event_id and last_event_id.isdigit() else since_id
+
+    async def events():
+        nonlocal cursor
+        while not await request.is_disconnected():
+            waiter = hub.subscribe(user_id)
+            try:
+                notifs = await run_in_threadpool(load_notifications_since, user_id, cursor)
+                if not notifs:
+                    if not await hub.wait(waiter, 15):
+                        yield ": keepalive\n\n"
+                    continue
+            finally:
+                hub.unsubscribe(user_id, waiter)
+            for n in notifs:
+                cursor = n.id
+                yield f"id: {n.id}\nevent: notification\ndata: {n.model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.put("/notifications/read-all")
 def mark_all_read(payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
     user_id = payload.get("user_id")
+    # No window here: rare and user-triggered, so older unread rows get cleared too
     db.query(Notification).filter(Notification.user_id == user_id, Notification.is_read == 0).update({"is_read": 1})
     db.commit()
     return {"message": "Marked all as read"}
@@ -211,89 +655,367 @@ def add_beneficiary(req: BeneficiaryCreate, payload: dict = Depends(get_current_
     )
     db.add(new_ben)
     db.commit()
+    response_cache.invalidate("beneficiaries", user_id)
     db.refresh(new_ben)
     return new_ben
 
-@app.post("/transfer")
-def transfer(req: TransferRequest, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+@sync_router.post("/transfer")
+def transfer(
+    req: TransferRequest,
+    idempotency_key: Optional[str] = Header(None),
+    payload: dict = Depends(get_current_user_payload),
+    db: Session = Depends(get_db),
+):
     from_user_id = payload.get("user_id")
-    
-    # 1. Get Sender Account
-    from_account = db.query(Account).filter(Account.user_id == from_user_id).first()
-    if not from_account:
-         raise HTTPException(status_code=404, detail="Origin account not found")
-    
-    # 2. Get Receiver Account
-    to_account = db.query(Account).filter(Account.account_number == req.to_account_number).first()
-    if not to_account:
-        raise HTTPException(status_code=404, detail="Destination account not found")
-        
-    # 3. Check Funds
-    if from_account.balance < req.amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
-        
-    # 4. Execute Transfer
-    from_account.balance -= req.amount
-    to_account.balance += req.amount
-    
-    # 5. Log Transactions (One for Sender, One for Receiver)
-    # Sender Log
-    tx_out = Transaction(
-        user_id=from_user_id,
-        amount=-req.amount,
-        transaction_type="transfer_out",
-        description=f"Transfer to {req.to_account_number} - {req.description}",
-        related_account_id=to_account.id # Internal ID tracking
-    )
-    
-    # Receiver Log
-    tx_in = Transaction(
-        user_id=to_account.user_id,
-        amount=req.amount,
-        transaction_type="transfer_in",
-        description=f"Received from {from_account.account_number} - {req.description}",
-        related_account_id=from_account.id
-    )
-    
-    db.add(tx_out)
-    db.add(tx_in)
-    
-    # Create Notification for Receiver
-    notif = Notification(
-        user_id=to_account.user_id,
-        title="Transferencia Recibida",
-        message=f"Has recibido ${req.amount} de la cuenta {from_account.account_number}.",
-        is_read=0
+    return post_transfer(db, from_user_id, req.to_account_number, req.amount, req.description, idempotency_key)
+
+@app.post("/transfers/batch")
+def batch_transfer(req: BatchTransferRequest, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+    # Payroll / mass disbursement: one debit, bulk credits, per-item report
+    from_user_id = payload.get("user_id")
+    items = [(item.to_account_number, item.amount) for item in req.items]
+    return post_batch_transfer(db, from_user_id, items, req.description, all_or_nothing=req.mode == "all_or_nothing")
+
+# Standing orders (scheduler.py): executed by `python scheduler.py run`, not by the API
+@app.post("/scheduled-transfers", response_model=ScheduledTransferResponse, status_code=201)
+def create_scheduled_transfer(req: ScheduledTransferCreate, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+    return scheduler.create_order(
+        db, payload.get("user_id"), req.amount, req.frequency, req.starts_at,
+        req.to_account_number, req.beneficiary_id, req.description, req.ends_at,
     )
-    db.add(notif)
-    
-    db.commit()
-    return {"message": "Transfer successful", "new_balance": from_account.balance}
+
+@app.get("/scheduled-transfers", response_model=List[ScheduledTransferResponse])
+def list_scheduled_transfers(
+    include_finished: bool = False,
+    payload: dict = Depends(get_current_user_payload),
+    db: Session = Depends(get_read_db),
+):
+    query = db.query(ScheduledTransfer).filter(ScheduledTransfer.user_id == payload.get("user_id"))
+    if not include_finished:
+        query = query.filter(ScheduledTransfer.status.in_(["active", "paused"]))
+    return [scheduler.order_response(order) for order in query.order_by(ScheduledTransfer.id)]
+
+@app.get("/scheduled-transfers/{order_id}", response_model=ScheduledTransferResponse)
+def get_scheduled_transfer(order_id: int, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_read_db)):
+    order = db.query(ScheduledTransfer).filter(ScheduledTransfer.id == order_id, ScheduledTransfer.user_id == payload.get("user_id")).first()
+    if not order:
+        raise HTTPException(status_code=404, detail="Scheduled transfer not found")
+    return scheduler.order_response(order)
+
+@app.patch("/scheduled-transfers/{order_id}", response_model=ScheduledTransferResponse)
+def update_scheduled_transfer(order_id: int, req: ScheduledTransferUpdate, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+    return scheduler.update_order(db, payload.get("user_id"), order_id, req.model_dump(exclude_unset=True))
+
+@app.delete("/scheduled-transfers/{order_id}", response_model=ScheduledTransferResponse)
+def cancel_scheduled_transfer(order_id: int, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+    return scheduler.cancel_order(db, payload.get("user_id"), order_id)
+
+@app.get("/admin/scheduler/runs")
+def scheduler_runs(limit: int = Query(20, ge=1, le=200), payload: dict = Depends(require_roles("admin")), db: Session = Depends(get_db)):
+    # Throughput and lag of the last scheduler passes
+    return scheduler.recent_runs(db, limit)
+
+# Card purchases (cards.py): the caller is the merchant; the card details authorize the charge
+@sync_router.post("/cards/authorize")
+def authorize_card(req: CardAuthorizeRequest, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+    return cards.authorize(db, req.card_number, req.expiry, req.cvv, req.amount, req.merchant, payload.get("user_id"))
+
+@app.post("/cards/capture")
+def capture_card_hold(req: CardCaptureRequest, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+    return cards.capture(db, req.hold_id, req.amount, payload.get("user_id"), payload.get("role") == "admin")
+
+@app.post("/cards/void")
+def void_card_hold(req: CardVoidRequest, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
+    return cards.void(db, req.hold_id, payload.get("user_id"), payload.get("role") == "admin")
 
 # CRITICAL ENDPOINT: MONEY PRINTER
+# For testing: Allow 'client' to mint money too
 @app.post("/admin/mint-money")
-def mint_money(req: MintRequest, payload: dict = Depends(get_current_user_payload), db: Session = Depends(get_db)):
-    role = payload.get("role")
-    # For testing: Allow 'client' to mint money too
-    if role not in ["teller", "admin", "client"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-        
+def mint_money(req: MintRequest, payload: dict = Depends(require_roles("teller", "admin", "client")), db: Session = Depends(get_db)):
     account = db.query(Account).filter(Account.account_number == req.account_number).first()
     
-    if not account:
+    if not account or account.user_id is None:
         raise HTTPException(status_code=404, detail="Account not found")
+    check_amount(req.amount)
     
-    account.balance += req.amount
-    
-    # Log Minting
-    tx_mint = Transaction(
-        user_id=account.user_id,
-        amount=req.amount,
-        transaction_type="deposit",
-        description="Deposit at Branch (Mint)",
-    )
-    db.add(tx_mint)
-    
+    # Atomic credit against the SYS-MINT ledger account, logged as a deposit
+    new_balance = apply_deposit(db, account, req.amount, "Deposit at Branch (Mint)")
     db.commit()
-    db.refresh(account)
-    return {"message": "Money printed successfully", "new_balance": account.balance}
+    response_cache.invalidate("account", account.user_id)
+    return {"message": "Money printed successfully", "new_balance": new_balance}
+
+def load_dashboard(db: Session, user_id: int, recent: int, top: int):
+    """Everything the dashboard needs, on a single connection."""
+    now = datetime.datetime.utcnow()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    def month_sum(sign_filter):
+        return (
+            select(func.coalesce(func.sum(Transaction.amount), 0.0))
+            .where(Transaction.user_id == user_id, Transaction.timestamp >= month_start, sign_filter)
+            .scalar_subquery()
+        )
+    unread = (
+        select(func.count(Notification.id))
+        .where(Notification.user_id == user_id, Notification.is_read == 0, in_notification_window())
+        .scalar_subquery()
+    )
+    # Account and the counters in one round-trip
+    row = db.execute(
+        select(unread, month_sum(Transaction.amount > 0), month_sum(Transaction.amount < 0))
+        .add_columns(select(Account.id).where(Account.user_id == user_id).limit(1).scalar_subquery())
+    ).one()
+    unread_count, income, expense, account_id = row
+    account = db.get(Account, account_id) if account_id else None
+
+    cards = db.execute(select(Card).where(Card.user_id == user_id)).scalars().all()
+    recent_txs = db.execute(
+        select(Transaction).where(Transaction.user_id == user_id)
+        .order_by(Transaction.timestamp.desc(), Transaction.id.desc()).limit(recent)
+    ).scalars().all()
+
+    # Top beneficiaries = most paid in the last 90 days, newest first on ties
+    paid = (
+        select(Transaction.related_account_id.label("account_id"), func.count(Transaction.id).label("times"))
+        .where(
+            Transaction.user_id == user_id,
+            Transaction.transaction_type == "transfer_out",
+            Transaction.timestamp >= now - datetime.timedelta(days=90),
+        )
+        .group_by(Transaction.related_account_id)
+        .subquery()
+    )
+    beneficiaries = db.execute(
+        select(Beneficiary)
+        .outerjoin(Account, Account.account_number == Beneficiary.account_number)
+        .outerjoin(paid, paid.c.account_id == Account.id)
+        .where(Beneficiary.user_id == user_id)
+        .order_by(func.coalesce(paid.c.times, 0).desc(), Beneficiary.id.desc())
+        .limit(top)
+    ).scalars().all()
+
+    return DashboardResponse(
+        account=AccountResponse.model_validate(account) if account else None,
+        cards=[CardResponse.model_validate(c) for c in cards],
+        unread_notifications=unread_count,
+        notification_window_days=NOTIFICATION_WINDOW_DAYS,
+        month_income=income,
+        month_expense=abs(expense),
+        recent_transactions=[TransactionResponse.model_validate(t) for t in recent_txs],
+        top_beneficiaries=[BeneficiaryResponse.model_validate(b) for b in beneficiaries],
+    )
+
+@sync_router.get("/dashboard", response_model=DashboardResponse)
+def get_dashboard(
+    recent: int = Query(10, ge=1, le=50),
+    top: int = Query(5, ge=1, le=20),
+    payload: dict = Depends(get_current_user_payload),
+    db: Session = Depends(get_db),
+):
+    return load_dashboard(db, payload.get("user_id"), recent, top)
+
+@app.post("/admin/reconciliations", status_code=202)
+def start_reconciliation(
+    range_size: int = Query(reconcile.RECONCILE_RANGE_SIZE, ge=100, le=1_000_000),
+    workers: int = Query(reconcile.RECONCILE_WORKERS, ge=1, le=16),
+    payload: dict = Depends(require_roles("admin")),
+    db: Session = Depends(get_db),
+):
+    # Runs in a background thread of this process; follow it with GET /admin/reconciliations/{id}
+    if reconcile.busy():
+        raise HTTPException(status_code=409, detail="A reconciliation is already running here")
+    run_id = reconcile.create_run(db, range_size)
+    reconcile.start_in_background(run_id, workers)
+    return reconcile.run_status(db, run_id, limit=0)
+
+@app.post("/admin/reconciliations/{run_id}/resume", status_code=202)
+def resume_reconciliation(
+    run_id: int,
+    workers: int = Query(reconcile.RECONCILE_WORKERS, ge=1, le=16),
+    payload: dict = Depends(require_roles("admin")),
+    db: Session = Depends(get_db),
+):
+    status = reconcile.run_status(db, run_id, limit=0)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Reconciliation not found")
+    if not reconcile.start_in_background(run_id, workers):
+        raise HTTPException(status_code=409, detail="A reconciliation is already running here")
+    return status
+
+@app.get("/admin/reconciliations/{run_id}")
+def get_reconciliation(
+    run_id: int,
+    limit: int = Query(100, ge=0, le=1000),
+    offset: int = Query(0, ge=0),
+    payload: dict = Depends(require_roles("admin")),
+    db: Session = Depends(get_db),
+):
+    # Progress and a page of the discrepancies found so far
+    status = reconcile.run_status(db, run_id, limit, offset)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Reconciliation not found")
+    return status
+
+@app.get("/analytics/summary")
+def analytics_summary(
+    period: Literal["day", "month"] = "month",
+    date_from: Optional[datetime.date] = Query(None, alias="from"),
+    date_to: Optional[datetime.date] = Query(None, alias="to"),
+    payload: dict = Depends(get_current_user_payload),
+    db: Session = Depends(get_read_db),
+):
+    # Served from transaction_rollups: cost grows with the number of periods, not transactions
+    user_id = payload.get("user_id")
+    query = db.query(TransactionRollup).filter(TransactionRollup.user_id == user_id, TransactionRollup.period == period)
+    if date_from:
+        query = query.filter(TransactionRollup.period_start >= date_from)
+    if date_to:
+        query = query.filter(TransactionRollup.period_start < date_to)
+
+    periods = {}
+    for r in query.order_by(TransactionRollup.period_start.asc()):
+        p = periods.setdefault(r.period_start, {
+            "period_start": r.period_start, "count": 0, "inflow": 0.0, "outflow": 0.0, "net": 0.0, "by_type": {},
+        })
+        p["count"] += r.count
+        p["inflow"] += r.inflow
+        p["outflow"] += r.outflow
+        p["net"] += r.total
+        p["by_type"][r.transaction_type] = {"count": r.count, "total": r.total}
+    return {"period": period, "periods": list(periods.values())}
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is serving, no dependency is checked
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz(response: Response):
+    # Readiness: database reachable and pools warmed
+    status = readiness.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Prometheus scrape target, counters of this worker process
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/internal/db-pool")
+def db_pool_status():
+    # Pool usage and checkout wait per engine, for capacity planning
+    return pool_status()
+
+@app.get("/internal/outbox")
+def outbox_status(db: Session = Depends(get_db)):
+    # Backlog and age of the oldest pending event; worker counters when it runs in this process
+    status = outbox.backlog_stats(db)
+    if outbox.OUTBOX_WORKER == "embedded":
+        status["worker"] = outbox.worker.stats()
+    return status
+
+@app.get("/internal/cache")
+def cache_status():
+    # Response cache hit / miss / 304 counters of this worker
+    return response_cache.stats()
+
+@app.get("/internal/card-index")
+def card_index_status():
+    # Size and hit ratio of this worker's card index
+    return cards.card_index.stats()
+
+# ---- Async flavour (AsyncSession, no threadpool hop per request) ----
+
+@async_router.get("/cards/me", response_model=list[CardResponse])
+async def get_my_cards_async(request: Request, payload: dict = Depends(get_current_user_payload), db: AsyncSession = Depends(get_async_db)):
+    user_id = payload.get("user_id")
+    version, cached = response_cache.lookup(request, "cards", user_id)
+    if cached:
+        return cached
+    result = await db.execute(select(Card).where(Card.user_id == user_id))
+    return response_cache.store("cards", user_id, version, [CardResponse.model_validate(c) for c in result.scalars()])
+
+@async_router.get("/accounts/me", response_model=AccountResponse)
+async def get_my_account_async(request: Request, payload: dict = Depends(get_current_user_payload), db: AsyncSession = Depends(get_async_db)):
+    user_id = payload.get("user_id")
+    version, cached = response_cache.lookup(request, "account", user_id)
+    if cached:
+        return cached
+    result = await db.execute(select(Account).where(Account.user_id == user_id).limit(1))
+    account = result.scalars().first()
+    if not account:
+        raise HTTPException(status_code=404, detail="Account not found")
+    return response_cache.store("account", user_id, version, AccountResponse.model_validate(account))
+
+@async_router.get("/movements", response_model=List[TransactionResponse])
+@async_router.get("/transactions", response_model=List[TransactionResponse])
+async def get_movements_async(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    date_from: Optional[datetime.datetime] = None,
+    date_to: Optional[datetime.datetime] = None,
+    transaction_type: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    payload: dict = Depends(get_current_user_payload),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    user_id = payload.get("user_id")
+    stmt = movements_stmt(user_id, limit, cursor, date_from, date_to, transaction_type, min_amount, max_amount)
+    txs = (await db.execute(stmt)).scalars().all()
+    return paginate_movements(response, txs, limit)
+
+@async_router.get("/beneficiaries", response_model=List[BeneficiaryResponse])
+async def get_beneficiaries_async(request: Request, payload: dict = Depends(get_current_user_payload), db: AsyncSession = Depends(get_async_db)):
+    user_id = payload.get("user_id")
+    version, cached = response_cache.lookup(request, "beneficiaries", user_id)
+    if cached:
+        return cached
+    result = await db.execute(select(Beneficiary).where(Beneficiary.user_id == user_id))
+    return response_cache.store("beneficiaries", user_id, version, [BeneficiaryResponse.model_validate(b) for b in result.scalars()])
+
+@async_router.get("/notifications", response_model=List[NotificationResponse])
+async def get_notifications_async(
+    response: Response,
+    since_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    payload: dict = Depends(get_current_user_payload),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    user_id = payload.get("user_id")
+    response.headers["X-Notification-Window-Days"] = str(NOTIFICATION_WINDOW_DAYS)
+    result = await db.execute(notifications_stmt(user_id, since_id, limit))
+    return result.scalars().all()
+
+@async_router.get("/dashboard", response_model=DashboardResponse)
+async def get_dashboard_async(
+    recent: int = Query(10, ge=1, le=50),
+    top: int = Query(5, ge=1, le=20),
+    payload: dict = Depends(get_current_user_payload),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await db.run_sync(load_dashboard, payload.get("user_id"), recent, top)
+
+@async_router.post("/transfer")
+async def transfer_async(
+    req: TransferRequest,
+    idempotency_key: Optional[str] = Header(None),
+    payload: dict = Depends(get_current_user_payload),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Same engine as the sync path, driven through the async connection
+    from_user_id = payload.get("user_id")
+    return await post_transfer_async(db, from_user_id, req.to_account_number, req.amount, req.description, idempotency_key)
+
+@async_router.post("/cards/authorize")
+async def authorize_card_async(req: CardAuthorizeRequest, payload: dict = Depends(get_current_user_payload), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(cards.authorize, req.card_number, req.expiry, req.cvv, req.amount, req.merchant, payload.get("user_id"))
+
+if DB_MODE == "sync":
+    app.include_router(sync_router)
+    app.include_router(async_router, prefix="/async")
+else:
+    app.include_router(async_router)
+    app.include_router(sync_router, prefix="/sync")
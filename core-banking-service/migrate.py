@@ -0,0 +1,108 @@
+"""
+Schema migration step. Run it once per deploy, before starting the API processes:
+    python migrate.py
+
+Creates missing tables and indexes (also new indexes on existing tables, on Postgres with
+CREATE INDEX CONCURRENTLY so a large table keeps taking writes meanwhile), the ledger's
+system accounts and opening entries for balances that predate the ledger. create_all
+never alters existing tables, so a changed column still needs a hand-written ALTER.
+On Postgres, transactions and notifications are partitioned by month first (see
+partitions.py); converting existing plain tables locks them while their rows are checked.
+"""
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+from database import Base, engine, wait_for_db, SessionLocal
+import models  # registers every table on Base.metadata
+import ledger
+import partitions
+
+
+def create_missing_indexes():
+    # create_all skips tables that exist, including indexes added to them later
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    create_index_online(conn, index)
+        return
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def index_valid(conn, name: str):
+    # True / False (a CONCURRENTLY build that was interrupted), None if missing
+    return conn.execute(
+        text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}
+    ).scalar()
+
+
+def index_ddl(index, name: str, table: str, only: bool = False) -> str:
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+    ddl = ddl.replace(f" {index.name} ON {index.table.name} ", f" {name} ON {'ONLY ' if only else ''}{table} ", 1)
+    return ddl if only else ddl.replace(" INDEX IF NOT EXISTS ", " INDEX CONCURRENTLY IF NOT EXISTS ", 1)
+
+
+def build_concurrently(conn, index, name: str, table: str):
+    """Builds without blocking writes to the table (a long existing transactions table included)."""
+    if index_valid(conn, name) is False:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+    if index_valid(conn, name) is None:
+        print(f"Creating index {name} on {table}")
+        conn.execute(text(index_ddl(index, name, table)))
+
+
+def create_index_online(conn, index):
+    table = index.table.name
+    if index_valid(conn, index.name):
+        return
+    if not partitions.is_partitioned(conn, index.table):
+        build_concurrently(conn, index, index.name, table)
+        return
+    # CONCURRENTLY does not work on a partitioned table: an empty parent index first, then
+    # each partition's own built concurrently and attached. With every one attached it is valid.
+    conn.execute(text(index_ddl(index, index.name, table, only=True)))
+    children = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+        " WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+    ), {"table": table}).scalars().all()
+    for child in children:
+        attached = conn.execute(text(
+            "SELECT 1 FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid"
+            " WHERE i.inhparent = to_regclass(:index) AND x.indrelid = to_regclass(:child)"
+        ), {"index": index.name, "child": child}).scalar()
+        if attached:
+            continue
+        name = f"{index.name}__{child[len(table) + 1:]}"[:63]
+        if child == f"{table}_legacy" and index_valid(conn, f"{index.name}_legacy"):
+            name = f"{index.name}_legacy"  # the table's own index from before the conversion
+        else:
+            build_concurrently(conn, index, name, child)
+        conn.execute(text(f"ALTER INDEX {index.name} ATTACH PARTITION {name}"))
+
+
+def open_ledger():
+    db = SessionLocal()
+    try:
+        ledger.ensure_system_accounts(db)
+        opened = ledger.open_balances(db)
+        db.commit()
+        if opened:
+            print(f"Opening ledger entries written for {opened} accounts")
+    finally:
+        db.close()
+
+
+def run():
+    wait_for_db(engine)
+    with engine.begin() as conn:
+        partitions.prepare(conn)
+        partitions.ensure_partitions(conn)
+    Base.metadata.create_all(bind=engine)
+    create_missing_indexes()
+    open_ledger()
+
+
+if __name__ == "__main__":
+    run()
+    print("Schema up to date")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, Float, Numeric, String, ForeignKey, Date, DateTime, Index, UniqueConstraint, text
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -7,9 +7,9 @@ class Account(Base):
     __tablename__ = "accounts"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, index=True) 
+    user_id = Column(Integer, index=True) # NULL for the ledger's system accounts
     account_number = Column(String, unique=True, index=True) # Checkings Account Number
-    balance = Column(Float, default=0.0)
+    balance = Column(Float, default=0.0) # Current balance, kept in step with ledger_entries
 
 class Card(Base):
     __tablename__ = "cards"
@@ -28,9 +28,22 @@ class Transaction(Base):
     amount = Column(Float)
     transaction_type = Column(String) # 'create', 'transfer_in', 'transfer_out', 'purchase'
     description = Column(String)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    timestamp = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     related_account_id = Column(Integer, nullable=True) # If transfer, who was other party?
 
+    # /movements pages with keyset on (timestamp, id) per user, so every page is an index range scan
+    __table_args__ = (
+        Index("ix_transactions_user_ts_id", "user_id", "timestamp", "id"),
+        # Reconciliation finds the incoming leg of a range of senders' transfers
+        Index(
+            "ix_transactions_related_in", "related_account_id",
+            postgresql_where=text("transaction_type = 'transfer_in'"),
+            sqlite_where=text("transaction_type = 'transfer_in'"),
+        ),
+        # Monthly range partitions on Postgres, see partitions.py
+        {"info": {"partition_by": "timestamp"}},
+    )
+
 class Beneficiary(Base):
     __tablename__ = "beneficiaries_v2"
 
@@ -51,4 +64,233 @@ class Notification(Base):
     title = Column(String)
     message = Column(String)
     is_read = Column(Integer, default=0) # 0 = unread, 1 = read
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    timestamp = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    # Partial index: unread counts only touch unread rows, whatever the history size
+    __table_args__ = (
+        Index(
+            "ix_notifications_user_unread", "user_id",
+            postgresql_where=text("is_read = 0"),
+            sqlite_where=text("is_read = 0"),
+        ),
+        {"info": {"partition_by": "timestamp"}},
+    )
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer)
+    key = Column(String)
+    request_hash = Column(String) # Same key with a different body is rejected
+    response = Column(String) # JSON of the original successful response
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_user_key"),
+    )
+
+class NumberBlock(Base):
+    __tablename__ = "number_blocks"
+
+    name = Column(String, primary_key=True) # 'account_number', 'card_number'
+    next_value = Column(BigInteger, default=0) # Next unreserved counter value
+
+class TransactionRollup(Base):
+    __tablename__ = "transaction_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer)
+    period = Column(String) # 'day', 'month'
+    period_start = Column(Date)
+    transaction_type = Column(String)
+    count = Column(Integer, default=0)
+    total = Column(Float, default=0.0)
+    inflow = Column(Float, default=0.0) # Sum of positive amounts
+    outflow = Column(Float, default=0.0) # Sum of negative amounts, as a positive number
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "period", "period_start", "transaction_type", name="uq_rollup_period"),
+    )
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String) # 'transfer.completed'
+    payload = Column(String) # JSON
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True) # Set once every consumer handled it
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, nullable=True) # Backoff after a failed delivery
+    last_error = Column(String, nullable=True)
+
+    # The worker only ever scans pending events
+    __table_args__ = (
+        Index(
+            "ix_outbox_events_pending", "id",
+            postgresql_where=text("processed_at IS NULL"),
+            sqlite_where=text("processed_at IS NULL"),
+        ),
+    )
+
+class OutboxDelivery(Base):
+    __tablename__ = "outbox_deliveries"
+
+    # One row per consumer and event: a redelivered event is skipped by that consumer
+    consumer = Column(String, primary_key=True)
+    event_id = Column(Integer, primary_key=True)
+    delivered_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class LedgerJournal(Base):
+    __tablename__ = "ledger_journals"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String) # 'transfer', 'deposit', 'opening'
+    description = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class LedgerEntry(Base):
+    __tablename__ = "ledger_entries"
+
+    # Append-only: never updated or deleted, a correction is a new journal.
+    # The entries of one journal sum to zero.
+    id = Column(Integer, primary_key=True)
+    journal_id = Column(Integer, index=True)
+    account_id = Column(Integer)
+    amount = Column(Numeric(18, 2)) # + credits the account, - debits it
+    created_at = Column(DateTime, index=True, default=datetime.datetime.utcnow)
+
+    # Balance as of a time: one snapshot plus an index range scan of the tail
+    __table_args__ = (
+        Index("ix_ledger_entries_account_created", "account_id", "created_at"),
+    )
+
+class BalanceSnapshot(Base):
+    __tablename__ = "balance_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer)
+    as_of = Column(DateTime) # Sum of the account's entries created up to this time
+    balance = Column(Numeric(18, 2))
+
+    __table_args__ = (
+        UniqueConstraint("account_id", "as_of", name="uq_balance_snapshot_account_as_of"),
+    )
+
+class ReconciliationRun(Base):
+    __tablename__ = "reconciliation_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String) # 'running', 'done', 'incomplete' (some ranges failed or were interrupted)
+    range_size = Column(Integer)
+    total_ranges = Column(Integer)
+    ranges_done = Column(Integer, default=0)
+    discrepancies = Column(Integer, default=0)
+    started_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class ReconciliationRange(Base):
+    __tablename__ = "reconciliation_ranges"
+
+    # Checkpoint: a resumed run only redoes ranges without done_at
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, index=True)
+    first_account_id = Column(Integer)
+    last_account_id = Column(Integer)
+    done_at = Column(DateTime, nullable=True)
+    discrepancies = Column(Integer, default=0)
+
+class ReconciliationDiscrepancy(Base):
+    __tablename__ = "reconciliation_discrepancies"
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, index=True)
+    kind = Column(String) # 'balance', 'unmatched_transfer'
+    account_id = Column(Integer)
+    counterparty_account_id = Column(Integer, nullable=True) # Receiver, for unmatched transfers
+    expected = Column(Float) # balance: sum of transactions; transfer: total sent
+    actual = Column(Float) # balance: accounts.balance; transfer: total received
+    detail = Column(String, nullable=True)
+
+class CardHold(Base):
+    __tablename__ = "card_holds"
+
+    id = Column(Integer, primary_key=True, index=True)
+    card_id = Column(Integer)
+    account_id = Column(Integer)
+    user_id = Column(Integer) # Cardholder
+    merchant_user_id = Column(Integer) # Who authorized it; only they (or an admin) settle it
+    merchant = Column(String)
+    amount = Column(Float) # Taken off accounts.balance while status is 'authorized'
+    captured_amount = Column(Float, nullable=True)
+    status = Column(String) # 'authorized', 'captured', 'voided', 'expired'
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime)
+    settled_at = Column(DateTime, nullable=True)
+
+    # Open holds are few whatever the history: balance checks sum them per account, the sweep by age
+    __table_args__ = (
+        Index(
+            "ix_card_holds_open_account", "account_id",
+            postgresql_where=text("status = 'authorized'"),
+            sqlite_where=text("status = 'authorized'"),
+        ),
+        Index(
+            "ix_card_holds_open_expiry", "expires_at",
+            postgresql_where=text("status = 'authorized'"),
+            sqlite_where=text("status = 'authorized'"),
+        ),
+    )
+
+class ScheduledTransfer(Base):
+    __tablename__ = "scheduled_transfers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True) # Owner, debited from their account
+    from_account_id = Column(Integer)
+    beneficiary_id = Column(Integer, nullable=True) # Set when created from a saved beneficiary
+    to_account_number = Column(String)
+    amount = Column(Float)
+    description = Column(String)
+    frequency = Column(String) # 'once', 'daily', 'weekly', 'monthly'
+    starts_at = Column(DateTime) # First occurrence; later ones keep its time (and day of month)
+    ends_at = Column(DateTime, nullable=True)
+    occurrences_done = Column(Integer, default=0) # Run, failed or skipped while paused; a catch-up never repeats one
+    next_run_at = Column(DateTime) # Next occurrence plus this order's offset in the window
+    status = Column(String, default="active") # 'active', 'paused', 'done', 'cancelled'
+    claimed_until = Column(DateTime, nullable=True) # Lease of the scheduler executing it
+    last_run_at = Column(DateTime, nullable=True)
+    last_status = Column(String, nullable=True) # 'ok', 'failed'
+    last_error = Column(String, nullable=True)
+    failures = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    # The scheduler only ever scans active orders by due time
+    __table_args__ = (
+        Index(
+            "ix_scheduled_transfers_due", "next_run_at",
+            postgresql_where=text("status = 'active'"),
+            sqlite_where=text("status = 'active'"),
+        ),
+    )
+
+class SchedulerRun(Base):
+    __tablename__ = "scheduler_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    started_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    executed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    batches = Column(Integer, default=0)
+    avg_lag_seconds = Column(Float, nullable=True) # From next_run_at to execution
+    max_lag_seconds = Column(Float, nullable=True)
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    # Logged-out tokens, checked by both services (bankcommon/tokens.py); rows can go once the token expired
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String, unique=True)
+    expires_at = Column(Integer, index=True) # Token exp, unix time
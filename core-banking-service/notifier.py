@@ -0,0 +1,158 @@
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session, object_session
+from collections import defaultdict
+from database import engine
+from models import Notification
+import asyncio
+import threading
+import select
+import time
+import os
+
+# Wakes long-poll / SSE handlers when their user gets a notification
+
+NOTIFY_BACKEND = os.getenv("NOTIFY_BACKEND", "memory")  # memory | postgres
+NOTIFY_CHANNEL = "notifications"
+NOTIFY_RECONNECT_MAX_SECONDS = float(os.getenv("NOTIFY_RECONNECT_MAX_SECONDS", "30"))
+
+
+class InProcessBackend:
+    """Wakes waiters living in this worker process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)  # user_id -> {(loop, asyncio.Event)}
+
+    def subscribe(self, user_id):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters[user_id].add(waiter)
+        return waiter
+
+    def unsubscribe(self, user_id, waiter):
+        with self._lock:
+            self._waiters[user_id].discard(waiter)
+            if not self._waiters[user_id]:
+                del self._waiters[user_id]
+
+    def publish(self, user_ids):
+        self.dispatch(user_ids)
+
+    def subscribed_user_ids(self):
+        with self._lock:
+            return set(self._waiters)
+
+    def dispatch(self, user_ids):
+        # Writers run in the threadpool
+        with self._lock:
+            waiters = [w for uid in user_ids for w in self._waiters.get(uid, ())]
+        for loop, ev in waiters:
+            loop.call_soon_threadsafe(ev.set)
+
+
+class PostgresBackend(InProcessBackend):
+    """Shares wake-ups between workers through Postgres LISTEN/NOTIFY."""
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def subscribe(self, user_id):
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, daemon=True)
+                    self._listener.start()
+        return super().subscribe(user_id)
+
+    def publish(self, user_ids):
+        with engine.begin() as conn:
+            for uid in user_ids:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": str(uid)})
+
+    def _listen(self):
+        # Reconnects with backoff
+        delay = 1.0
+        reconnecting = False
+        while True:
+            conn = None
+            try:
+                conn = engine.raw_connection()
+                conn.driver_connection.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                if reconnecting:
+                    print("Notification listener reconnected")
+                    # Wake-ups may have been missed
+                    self.dispatch(self.subscribed_user_ids())
+                delay, reconnecting = 1.0, False
+                self._receive(conn.driver_connection, cursor)
+            except Exception as e:
+                print(f"Notification listener lost its connection: {e!r}, reconnecting in {delay:.0f}s")
+                if conn is not None:
+                    conn.invalidate()
+                    conn = None
+                reconnecting = True
+                time.sleep(delay)
+                delay = min(delay * 2, NOTIFY_RECONNECT_MAX_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _receive(self, pg, cursor):
+        while True:
+            if select.select([pg], [], [], 30) == ([], [], []):
+                # Keepalive
+                cursor.execute("SELECT 1")
+                continue
+            pg.poll()
+            user_ids = set()
+            while pg.notifies:
+                user_ids.add(int(pg.notifies.pop(0).payload))
+            self.dispatch(user_ids)
+
+
+class NotificationHub:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def publish(self, user_ids):
+        if user_ids:
+            self.backend.publish(set(user_ids))
+
+    async def wait(self, waiter, timeout):
+        """Returns True if woken up by a publish, False on timeout."""
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def subscribe(self, user_id):
+        return self.backend.subscribe(user_id)
+
+    def unsubscribe(self, user_id, waiter):
+        self.backend.unsubscribe(user_id, waiter)
+
+
+hub = NotificationHub(PostgresBackend() if NOTIFY_BACKEND == "postgres" else InProcessBackend())
+
+
+# ORM inserts publish after commit; bulk inserts call hub.publish themselves
+@event.listens_for(Notification, "after_insert")
+def _track_new_notification(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("notify_user_ids", set()).add(target.user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(session):
+    user_ids = session.info.pop("notify_user_ids", None)
+    if user_ids:
+        hub.publish(user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("notify_user_ids", None)
@@ -0,0 +1,102 @@
+from sqlalchemy import update, insert
+from sqlalchemy.exc import IntegrityError
+from database import engine
+from models import NumberBlock
+import threading
+import os
+
+# Account and card number allocation without probing the table per attempt.
+# Each worker reserves a block of counter values with one atomic UPDATE and hands
+# them out from memory; blocks never overlap between workers, so numbers are unique.
+# The counter is spread over the number space with an affine permutation so
+# consecutive accounts do not get consecutive numbers.
+
+NUMBER_BLOCK_SIZE = int(os.getenv("NUMBER_BLOCK_SIZE", "100"))
+
+# 10-digit account numbers: 1000000000..9999999999
+ACCOUNT_SPACE = 9_000_000_000
+ACCOUNT_MULTIPLIER = 4_294_967_291  # prime, coprime with the space
+ACCOUNT_OFFSET = 1_234_567_891
+
+# Mastercard PAN: "52" + 13 digits + Luhn check digit
+CARD_PREFIX = "52"
+CARD_SPACE = 10_000_000_000_000
+CARD_MULTIPLIER = 7_777_777_777_771  # odd and not a multiple of 5
+CARD_OFFSET = 3_141_592_653_589
+
+
+class BlockAllocator:
+    def __init__(self, name: str, block_size: int = NUMBER_BLOCK_SIZE):
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def _reserve(self, n: int):
+        """Atomically reserves [start, start + n) from the shared counter."""
+        stmt = (
+            update(NumberBlock)
+            .where(NumberBlock.name == self.name)
+            .values(next_value=NumberBlock.next_value + n)
+            .returning(NumberBlock.next_value)
+        )
+        with engine.begin() as conn:
+            end = conn.execute(stmt).scalar()
+        if end is None:
+            # First use of this counter
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(NumberBlock).values(name=self.name, next_value=0))
+            except IntegrityError:
+                pass  # another worker created it first
+            with engine.begin() as conn:
+                end = conn.execute(stmt).scalar()
+        return end - n, end
+
+    def take(self, count: int = 1):
+        values = []
+        with self._lock:
+            while len(values) < count:
+                if self._next >= self._end:
+                    missing = count - len(values)
+                    self._next, self._end = self._reserve(max(self.block_size, missing))
+                take = min(count - len(values), self._end - self._next)
+                values.extend(range(self._next, self._next + take))
+                self._next += take
+        return values
+
+
+account_allocator = BlockAllocator("account_number")
+card_allocator = BlockAllocator("card_number")
+
+
+def luhn_check_digit(body: str) -> str:
+    total = 0
+    # Double every second digit from the right, starting next to the check digit
+    for i, digit in enumerate(reversed(body)):
+        d = int(digit)
+        if i % 2 == 0:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return str((10 - total % 10) % 10)
+
+
+def format_account_number(counter: int) -> str:
+    return str(1_000_000_000 + (counter * ACCOUNT_MULTIPLIER + ACCOUNT_OFFSET) % ACCOUNT_SPACE)
+
+
+def format_card_number(counter: int) -> str:
+    body = CARD_PREFIX + f"{(counter * CARD_MULTIPLIER + CARD_OFFSET) % CARD_SPACE:013d}"
+    pan = body + luhn_check_digit(body)
+    return " ".join(pan[i:i + 4] for i in range(0, 16, 4))
+
+
+def account_numbers(count: int):
+    return [format_account_number(c) for c in account_allocator.take(count)]
+
+
+def card_numbers(count: int):
+    return [format_card_number(c) for c in card_allocator.take(count)]
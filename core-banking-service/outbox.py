@@ -0,0 +1,245 @@
+"""
+Transactional outbox: side effects of money movements are enqueued in the same transaction
+and handed to the consumers by a worker. At-least-once; consumers skip events already in
+outbox_deliveries.
+
+The worker runs in the API process (OUTBOX_WORKER=embedded, the default) or on its own:
+    python outbox.py worker
+    python outbox.py status
+"""
+from sqlalchemy import select, insert, update, func, or_
+from sqlalchemy.orm import Session
+from collections import deque
+from database import engine, wait_for_db, SessionLocal
+from models import OutboxEvent, OutboxDelivery, Notification
+import notifier  # wakes notification listeners after commit
+import argparse
+import datetime
+import json
+import os
+import threading
+
+OUTBOX_WORKER = os.getenv("OUTBOX_WORKER", "embedded")  # embedded | external
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))  # then parked until fixed by hand
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+
+
+def event_row(event_type: str, payload: dict, now: datetime.datetime = None):
+    return dict(event_type=event_type, payload=json.dumps(payload), created_at=now or datetime.datetime.utcnow(), attempts=0)
+
+
+def enqueue(db: Session, event_type: str, payload: dict):
+    """Does not commit."""
+    db.add(OutboxEvent(**event_row(event_type, payload)))
+
+
+def enqueue_many(db: Session, event_type: str, payloads, chunk_size: int = 500):
+    """Bulk version of enqueue() for batch writers. Does not commit."""
+    now = datetime.datetime.utcnow()
+    rows = [event_row(event_type, payload, now) for payload in payloads]
+    for i in range(0, len(rows), chunk_size):
+        db.execute(insert(OutboxEvent), rows[i:i + chunk_size])
+
+
+_wakeup = threading.Event()
+
+
+def wake():
+    # No need to wait for the next poll
+    _wakeup.set()
+
+
+# Consumers: name -> (event types, handler). Handlers must not commit.
+
+def notify_transfer_received(db: Session, events):
+    # ORM inserts, so the notifier hooks see them
+    for event in events:
+        payload = json.loads(event.payload)
+        db.add(Notification(
+            user_id=payload["to_user_id"],
+            title="Transferencia Recibida",
+            message=f"Has recibido ${payload['amount']} de la cuenta {payload['from_account_number']}.",
+            is_read=0,
+            timestamp=event.created_at,
+        ))
+
+
+CONSUMERS = {
+    "notifications": ({"transfer.completed"}, notify_transfer_received),
+}
+
+
+def deliver(db: Session, events):
+    now = datetime.datetime.utcnow()
+    ids = [event.id for event in events]
+    for name, (event_types, handle) in CONSUMERS.items():
+        done = set(db.scalars(
+            select(OutboxDelivery.event_id).where(OutboxDelivery.consumer == name, OutboxDelivery.event_id.in_(ids))
+        ))
+        todo = [event for event in events if event.event_type in event_types and event.id not in done]
+        if todo:
+            handle(db, todo)
+            db.execute(insert(OutboxDelivery), [{"consumer": name, "event_id": event.id, "delivered_at": now} for event in todo])
+    db.execute(
+        update(OutboxEvent).where(OutboxEvent.id.in_(ids)).values(processed_at=now),
+        execution_options={"synchronize_session": False},
+    )
+    return now
+
+
+def pending_stmt(limit: int, event_id: int = None):
+    stmt = select(OutboxEvent).where(
+        OutboxEvent.processed_at.is_(None),
+        OutboxEvent.attempts < OUTBOX_MAX_ATTEMPTS,
+        or_(OutboxEvent.next_attempt_at.is_(None), OutboxEvent.next_attempt_at <= datetime.datetime.utcnow()),
+    )
+    if event_id is not None:
+        stmt = stmt.where(OutboxEvent.id == event_id)
+    # Several workers can drain side by side
+    return stmt.order_by(OutboxEvent.id).limit(limit).with_for_update(skip_locked=True)
+
+
+class OutboxWorker:
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self.failed = 0
+        self.batches = 0
+        self.lags = deque(maxlen=1000)  # seconds from enqueue to delivery
+        self._stop = threading.Event()
+        self._thread = None
+
+    def drain_once(self) -> int:
+        """Delivers one batch. Returns how many events were taken."""
+        db = SessionLocal()
+        try:
+            events = db.scalars(pending_stmt(self.batch_size)).all()
+            if not events:
+                return 0
+            created = [(event.id, event.created_at) for event in events]
+            try:
+                now = deliver(db, events)
+                db.commit()
+            except Exception:
+                db.rollback()
+                # One by one, so a bad event does not hold up the batch
+                for event_id, _ in created:
+                    self.drain_event(event_id)
+                return len(created)
+        finally:
+            db.close()
+        self.batches += 1
+        self.processed += len(created)
+        self.lags.extend((now - created_at).total_seconds() for _, created_at in created)
+        return len(created)
+
+    def drain_event(self, event_id: int):
+        db = SessionLocal()
+        try:
+            event = db.scalars(pending_stmt(1, event_id)).first()
+            if event is None:
+                return
+            created_at = event.created_at
+            attempts = event.attempts
+            try:
+                now = deliver(db, [event])
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                db.execute(
+                    update(OutboxEvent)
+                    .where(OutboxEvent.id == event_id)
+                    .values(
+                        attempts=attempts + 1,
+                        next_attempt_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=min(OUTBOX_MAX_BACKOFF, 2 ** attempts)),
+                        last_error=repr(e)[:500],
+                    )
+                )
+                db.commit()
+                self.failed += 1
+                print(f"Outbox event {event_id} failed: {e!r}")
+                return
+        finally:
+            db.close()
+        self.processed += 1
+        self.lags.append((now - created_at).total_seconds())
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                taken = self.drain_once()
+            except Exception as e:
+                print(f"Outbox worker error: {e!r}")
+                taken = 0
+            # A full batch means there is more waiting
+            if taken < self.batch_size:
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="outbox-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        _wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self):
+        ordered = sorted(self.lags)
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3) if ordered else None
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "delivery_lag_p50_s": pct(0.50),
+            "delivery_lag_p99_s": pct(0.99),
+        }
+
+
+worker = OutboxWorker()
+
+
+def backlog_stats(db: Session):
+    """Lag as seen from the table, valid whichever process runs the worker."""
+    pending, oldest = db.execute(
+        select(func.count(OutboxEvent.id), func.min(OutboxEvent.created_at))
+        .where(OutboxEvent.processed_at.is_(None), OutboxEvent.attempts < OUTBOX_MAX_ATTEMPTS)
+    ).one()
+    parked = db.execute(
+        select(func.count(OutboxEvent.id))
+        .where(OutboxEvent.processed_at.is_(None), OutboxEvent.attempts >= OUTBOX_MAX_ATTEMPTS)
+    ).scalar()
+    lag = (datetime.datetime.utcnow() - oldest).total_seconds() if oldest else 0.0
+    return {"pending": pending, "oldest_pending_age_s": round(lag, 3), "parked": parked}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("worker", help="drain the outbox until interrupted")
+    run.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+    run.add_argument("--poll-interval", type=float, default=OUTBOX_POLL_INTERVAL)
+    sub.add_parser("status", help="print the backlog")
+    args = parser.parse_args()
+
+    wait_for_db(engine)  # the schema comes from migrate.py
+    if args.command == "worker":
+        worker = OutboxWorker(args.batch_size, args.poll_interval)
+        print(f"Draining outbox, batches of {worker.batch_size}")
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
+        print(json.dumps(worker.stats()))
+    else:
+        db = SessionLocal()
+        try:
+            print(json.dumps(backlog_stats(db)))
+        finally:
+            db.close()
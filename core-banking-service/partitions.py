@@ -0,0 +1,318 @@
+"""
+Monthly partitions for transactions and notifications, and notification retention.
+
+On Postgres both tables are partitioned by RANGE (timestamp), one partition per month
+(notifications_2026_10, ...): queries with a timestamp bound only read the months they
+need, and old months go away with a DROP instead of a long DELETE. migrate.py creates the
+partitioned tables and the partitions up to PARTITION_MONTHS_AHEAD months ahead. A table
+created before partitioning is converted once, without copying: it becomes the
+<table>_legacy partition holding everything up to the end of the current month.
+Rows past the last month land in <table>_default, so inserts keep working if maintenance
+stops; they are moved to their month when it gets its partition, with a warning.
+
+Notifications older than NOTIFICATION_RETENTION_MONTHS whole months are archived to
+ARCHIVE_DIR as gzipped JSON lines, ARCHIVE_BATCH_SIZE rows at a time, then their partition
+is dropped. Transactions are never archived. On SQLite the tables stay plain and expired
+rows are archived and deleted batch by batch instead:
+    python partitions.py maintain --every 86400
+    python partitions.py maintain --dry-run
+    python partitions.py status
+"""
+from sqlalchemy import select, delete, func, text
+from sqlalchemy.schema import CreateTable
+from database import Base, engine, wait_for_db, SessionLocal
+import models  # registers the partitioned tables on Base.metadata
+import argparse
+import datetime
+import gzip
+import json
+import os
+import re
+import time
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+NOTIFICATION_RETENTION_MONTHS = int(os.getenv("NOTIFICATION_RETENTION_MONTHS", "12"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+# Tables whose old months are archived and dropped, and how many months they keep
+RETENTION = {"notifications": NOTIFICATION_RETENTION_MONTHS}
+
+BOUND = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def partitioned_tables():
+    return [t for t in Base.metadata.sorted_tables if t.info.get("partition_by")]
+
+
+def month_start(at: datetime.datetime) -> datetime.datetime:
+    return datetime.datetime(at.year, at.month, 1)
+
+
+def add_months(month: datetime.datetime, n: int) -> datetime.datetime:
+    months = month.year * 12 + month.month - 1 + n
+    return datetime.datetime(months // 12, months % 12 + 1, 1)
+
+
+def retention_cutoff(months: int, now=None) -> datetime.datetime:
+    """Rows before this are past retention."""
+    return add_months(month_start(now or datetime.datetime.utcnow()), -months)
+
+
+def relkind(conn, name: str):
+    # 'p' partitioned, 'r' plain table, None if missing
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": name}).scalar()
+
+
+def is_partitioned(conn, table) -> bool:
+    return conn.dialect.name == "postgresql" and relkind(conn, table.name) == "p"
+
+
+def parent_ddl(conn, table) -> str:
+    key = table.info["partition_by"]
+    pk = ", ".join(c.name for c in table.primary_key.columns)
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+    # Postgres wants the partition key in every unique constraint, the primary key included
+    ddl = ddl.replace(f"PRIMARY KEY ({pk})", f"PRIMARY KEY ({pk}, {key})")
+    return f"{ddl} PARTITION BY RANGE ({key})"
+
+
+def default_partition(conn, table):
+    return conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+        " WHERE i.inhparent = to_regclass(:name) AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'"
+    ), {"name": table.name}).scalar()
+
+
+def partitions(conn, table):
+    """(name, from, to) of every partition in date order, None for an open end."""
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i"
+        " JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:name)"
+    ), {"name": table.name})
+    found = []
+    for name, bound in rows:
+        match = BOUND.search(bound or "")
+        if not match:  # the DEFAULT partition
+            continue
+        low, high = (
+            None if value in ("MINVALUE", "MAXVALUE") else datetime.datetime.fromisoformat(value.strip("'"))
+            for value in match.groups()
+        )
+        found.append((name, low, high))
+    return sorted(found, key=lambda p: p[1] or datetime.datetime.min)
+
+
+def convert_legacy(conn, table):
+    """Makes the plain table from before partitioning the first partition of a new partitioned one."""
+    name, key = table.name, table.info["partition_by"]
+    pk = table.primary_key.columns.values()[0].name
+    legacy = f"{name}_legacy"
+    upto = add_months(month_start(datetime.datetime.utcnow()), 1)
+    old_seq = conn.execute(text("SELECT pg_get_serial_sequence(:t, :c)"), {"t": name, "c": pk}).scalar()
+    conn.execute(text(f"ALTER TABLE {name} RENAME TO {legacy}"))
+    # A partition has the parent's primary key and no other; this also frees the name
+    conn.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {name}_pkey"))
+    conn.execute(text(f"UPDATE {legacy} SET {key} = '1970-01-01' WHERE {key} IS NULL"))
+    conn.execute(text(f"ALTER TABLE {legacy} ADD PRIMARY KEY ({pk}, {key})"))
+    # Index and sequence names are per schema: free them for the new table
+    for index in table.indexes:
+        conn.execute(text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_legacy"))
+    if old_seq:
+        conn.execute(text(f"ALTER SEQUENCE {old_seq} RENAME TO {legacy}_{pk}_seq"))
+    conn.execute(text(parent_ddl(conn, table)))
+    # Ids keep growing from where the old table stopped, notification cursors rely on it
+    seq = conn.execute(text("SELECT pg_get_serial_sequence(:t, :c)"), {"t": name, "c": pk}).scalar()
+    conn.execute(text(f"SELECT setval('{seq}', (SELECT coalesce(max({pk}), 0) + 1 FROM {legacy}), false)"))
+    conn.execute(text(f"ALTER TABLE {name} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{upto:%Y-%m-%d}')"))
+
+
+def prepare(conn):
+    """Creates the partitioned tables, or converts existing plain ones. migrate.py runs it before create_all."""
+    if conn.dialect.name != "postgresql":
+        return
+    for table in partitioned_tables():
+        kind = relkind(conn, table.name)
+        if kind is None:
+            conn.execute(text(parent_ddl(conn, table)))
+            print(f"Created partitioned table {table.name}")
+        elif kind == "r":
+            convert_legacy(conn, table)
+            print(f"Converted {table.name} to a partitioned table, existing rows are in {table.name}_legacy")
+
+
+def create_month(conn, table, default, low, high):
+    name = f"{table.name}_{low:%Y_%m}"
+    ddl = f"CREATE TABLE {name} PARTITION OF {table.name} FOR VALUES FROM ('{low:%Y-%m-%d}') TO ('{high:%Y-%m-%d}')"
+    key = table.info["partition_by"]
+    in_range = f"{key} >= '{low:%Y-%m-%d}' AND {key} < '{high:%Y-%m-%d}'"
+    stray = conn.execute(text(f"SELECT count(*) FROM {default} WHERE {in_range}")).scalar() if default else 0
+    if not stray:
+        conn.execute(text(ddl))
+        return name
+    # The month was written before it had a partition: move its rows out of the default one
+    print(f"WARNING: {stray} rows of {name} were in {default}, partition maintenance is behind")
+    conn.execute(text(f"ALTER TABLE {table.name} DETACH PARTITION {default}"))
+    conn.execute(text(ddl))
+    conn.execute(text(f"INSERT INTO {table.name} SELECT * FROM {default} WHERE {in_range}"))
+    conn.execute(text(f"DELETE FROM {default} WHERE {in_range}"))
+    conn.execute(text(f"ALTER TABLE {table.name} ATTACH PARTITION {default} DEFAULT"))
+    return name
+
+
+def ensure_partitions(conn, months_ahead: int = PARTITION_MONTHS_AHEAD, now=None):
+    """Creates the default partition and the missing monthly ones up to months_ahead months from now."""
+    created = []
+    first = month_start(now or datetime.datetime.utcnow())
+    for table in partitioned_tables():
+        if not is_partitioned(conn, table):
+            continue
+        default = default_partition(conn, table)
+        if default is None:
+            default = f"{table.name}_default"
+            conn.execute(text(f"CREATE TABLE {default} PARTITION OF {table.name} DEFAULT"))
+            created.append(default)
+        existing = partitions(conn, table)
+        for n in range(months_ahead + 1):
+            low, high = add_months(first, n), add_months(first, n + 1)
+            if any((a is None or a < high) and (b is None or b > low) for _, a, b in existing):
+                continue
+            name = create_month(conn, table, default, low, high)
+            existing.append((name, low, high))
+            created.append(name)
+    return created
+
+
+def row_line(row) -> str:
+    return json.dumps(dict(row), default=str) + "\n"
+
+
+def archive_rows(db, table, where, path: str) -> int:
+    """Writes the matching rows to path as gzipped JSON lines, one batch at a time."""
+    tmp = path + ".part"
+    count, last_id = 0, None
+    with gzip.open(tmp, "wt", encoding="utf-8") as out:
+        while True:
+            stmt = select(table).where(*where).order_by(table.c.id).limit(ARCHIVE_BATCH_SIZE)
+            if last_id is not None:
+                stmt = stmt.where(table.c.id > last_id)
+            rows = db.execute(stmt).mappings().all()
+            if not rows:
+                break
+            out.writelines(row_line(row) for row in rows)
+            count += len(rows)
+            last_id = rows[-1]["id"]
+    # Only a complete file gets the real name
+    os.replace(tmp, path)
+    return count
+
+
+def drop_expired_partitions(db, table, cutoff, dry_run=False):
+    key = table.c[table.info["partition_by"]]
+    done = []
+    for name, low, high in partitions(db.connection(), table):
+        if high is None or high > cutoff:
+            continue
+        path = os.path.join(ARCHIVE_DIR, f"{name}.jsonl.gz")
+        # The bounds prune the scan down to this partition
+        where = [key < high] + ([key >= low] if low else [])
+        if dry_run:
+            done.append({"partition": name, "rows": db.scalar(select(func.count()).select_from(table).where(*where))})
+            continue
+        rows = archive_rows(db, table, where, path)
+        db.execute(text(f"DROP TABLE {name}"))
+        db.commit()
+        print(f"Archived {rows} rows of {name} to {path}, partition dropped")
+        done.append({"partition": name, "rows": rows, "file": path})
+    return done
+
+
+def delete_expired_rows(db, table, cutoff, dry_run=False):
+    """Without partitions: archive and delete batch by batch, one commit per batch."""
+    key = table.c[table.info["partition_by"]]
+    if dry_run:
+        return [{"before": cutoff.isoformat(), "rows": db.scalar(select(func.count()).select_from(table).where(key < cutoff))}]
+    path = os.path.join(ARCHIVE_DIR, f"{table.name}_before_{cutoff:%Y_%m}.jsonl.gz")
+    count = 0
+    # Appended gzip members still read as one file; a batch archived but not deleted
+    # before a crash is archived again on the next run
+    with gzip.open(path, "at", encoding="utf-8") as out:
+        while True:
+            rows = db.execute(select(table).where(key < cutoff).order_by(table.c.id).limit(ARCHIVE_BATCH_SIZE)).mappings().all()
+            if not rows:
+                break
+            out.writelines(row_line(row) for row in rows)
+            out.flush()
+            db.execute(delete(table).where(table.c.id.in_([row["id"] for row in rows])))
+            db.commit()
+            count += len(rows)
+    if count:
+        print(f"Archived {count} rows of {table.name} to {path}")
+    return [{"before": cutoff.isoformat(), "rows": count, "file": path}] if count else []
+
+
+def maintain(months_ahead: int = PARTITION_MONTHS_AHEAD, dry_run: bool = False):
+    """Partitions ahead, then retention. Returns what was (or would be) done."""
+    report = {"created": [], "archived": {}}
+    if not dry_run:
+        with engine.begin() as conn:
+            report["created"] = ensure_partitions(conn, months_ahead)
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    db = SessionLocal()
+    try:
+        for name, months in RETENTION.items():
+            table = Base.metadata.tables[name]
+            cutoff = retention_cutoff(months)
+            expire = drop_expired_partitions if is_partitioned(db.connection(), table) else delete_expired_rows
+            report["archived"][name] = expire(db, table, cutoff, dry_run)
+            db.commit()
+    finally:
+        db.close()
+    return report
+
+
+def status():
+    out = {}
+    with engine.connect() as conn:
+        for table in partitioned_tables():
+            if is_partitioned(conn, table):
+                estimates = dict(conn.execute(text(
+                    "SELECT c.relname, c.reltuples::bigint FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+                    " WHERE i.inhparent = to_regclass(:name)"
+                ), {"name": table.name}).all())
+                out[table.name] = [
+                    {"partition": name, "from": low.isoformat() if low else None, "to": high.isoformat() if high else None,
+                     "rows_estimate": max(estimates.get(name, 0), 0)}
+                    for name, low, high in partitions(conn, table)
+                ]
+                default = default_partition(conn, table)
+                if default:
+                    # Should stay 0: rows here mean maintenance fell behind the calendar
+                    rows = conn.execute(text(f"SELECT count(*) FROM {default}")).scalar()
+                    out[table.name].append({"partition": default, "default": True, "rows": rows})
+            else:
+                key = table.c[table.info["partition_by"]]
+                rows, oldest = conn.execute(select(func.count(), func.min(key)).select_from(table)).one()
+                out[table.name] = {"partitioned": False, "rows": rows, "oldest": oldest.isoformat() if oldest else None}
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("maintain", help="create the coming months' partitions, archive what is past retention")
+    run.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    run.add_argument("--dry-run", action="store_true", help="only count what retention would archive")
+    run.add_argument("--every", type=float, default=0, help="keep running, one pass every N seconds")
+    sub.add_parser("status", help="partitions (or row counts) per table")
+    args = parser.parse_args()
+
+    wait_for_db(engine)  # tables and partitions come from migrate.py
+    if args.command == "status":
+        print(json.dumps(status(), indent=2))
+    else:
+        while True:
+            print(json.dumps(maintain(args.months_ahead, args.dry_run)))
+            if not args.every:
+                break
+            time.sleep(args.every)
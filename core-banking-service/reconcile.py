@@ -0,0 +1,250 @@
+"""
+Reconciliation: balances and transfers against the transactions table, by account id range.
+Finished ranges are checkpointed, so an interrupted run resumes where it stopped:
+    python reconcile.py run --workers 4 --range-size 10000
+    python reconcile.py resume RUN_ID
+    python reconcile.py status RUN_ID
+"""
+from sqlalchemy import select, insert, update, func
+from sqlalchemy.orm import Session
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from database import engine, wait_for_db, SessionLocal, ReadSessionLocal
+from models import Account, Transaction, CardHold, ReconciliationRun, ReconciliationRange, ReconciliationDiscrepancy
+import argparse
+import datetime
+import json
+import os
+import threading
+
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", "4"))
+RECONCILE_RANGE_SIZE = int(os.getenv("RECONCILE_RANGE_SIZE", "10000"))
+TOLERANCE = 0.005  # balances are floats, compare to the cent
+
+
+def balance_discrepancies(db: Session, first_id: int, last_id: int):
+    # Open card holds are already taken off the balance
+    holds = (
+        select(CardHold.account_id, func.sum(CardHold.amount).label("held"))
+        .where(CardHold.account_id.between(first_id, last_id), CardHold.status == "authorized")
+        .group_by(CardHold.account_id)
+        .subquery()
+    )
+    held = func.coalesce(holds.c.held, 0.0)
+    expected = func.coalesce(func.sum(Transaction.amount), 0.0) - held
+    rows = db.execute(
+        select(Account.id, Account.balance, expected, held)
+        .select_from(Account)
+        .outerjoin(Transaction, Transaction.user_id == Account.user_id)
+        .outerjoin(holds, holds.c.account_id == Account.id)
+        .where(Account.id.between(first_id, last_id), Account.user_id.isnot(None))
+        .group_by(Account.id, Account.balance, holds.c.held)
+        .having(func.abs(Account.balance - expected) >= TOLERANCE)
+    )
+    return [
+        dict(kind="balance", account_id=account_id, expected=float(expected), actual=balance,
+             detail=f"balance {balance:.2f}, transactions minus {float(held):.2f} on hold give {float(expected):.2f}")
+        for account_id, balance, expected, held in rows
+    ]
+
+
+def transfer_discrepancies(db: Session, first_id: int, last_id: int):
+    """Per (sender, receiver) pair with the sender in the range: sent vs received."""
+    sent = db.execute(
+        select(Account.id, Transaction.related_account_id, func.count(Transaction.id), func.sum(-Transaction.amount))
+        .join(Transaction, Transaction.user_id == Account.user_id)
+        .where(Account.id.between(first_id, last_id), Transaction.transaction_type == "transfer_out")
+        .group_by(Account.id, Transaction.related_account_id)
+    )
+    received = db.execute(
+        select(Transaction.related_account_id, Account.id, func.count(Transaction.id), func.sum(Transaction.amount))
+        .join(Account, Account.user_id == Transaction.user_id)
+        .where(Transaction.related_account_id.between(first_id, last_id), Transaction.transaction_type == "transfer_in")
+        .group_by(Transaction.related_account_id, Account.id)
+    )
+    pairs = {}
+    for sender, receiver, count, amount in sent:
+        pairs[(sender, receiver)] = [count, float(amount or 0), 0, 0.0]
+    for sender, receiver, count, amount in received:
+        pair = pairs.setdefault((sender, receiver), [0, 0.0, 0, 0.0])
+        pair[2], pair[3] = count, float(amount or 0)
+    return [
+        dict(kind="unmatched_transfer", account_id=sender, counterparty_account_id=receiver,
+             expected=out_total, actual=in_total,
+             detail=f"{out_count} transfer_out totalling {out_total:.2f}, {in_count} transfer_in totalling {in_total:.2f}")
+        for (sender, receiver), (out_count, out_total, in_count, in_total) in sorted(pairs.items(), key=lambda p: (p[0][0], p[0][1] or 0))
+        if out_count != in_count or abs(out_total - in_total) >= TOLERANCE
+    ]
+
+
+def check_range(run_id: int, range_id: int, first_id: int, last_id: int) -> int:
+    """Checks one range and checkpoints it with its findings, in one commit."""
+    db = ReadSessionLocal()
+    try:
+        if db.get_bind().dialect.name == "postgresql":
+            db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        found = balance_discrepancies(db, first_id, last_id) + transfer_discrepancies(db, first_id, last_id)
+    finally:
+        db.close()
+
+    db = SessionLocal()
+    try:
+        if found:
+            db.execute(insert(ReconciliationDiscrepancy), [dict(run_id=run_id, **d) for d in found])
+        db.execute(
+            update(ReconciliationRange)
+            .where(ReconciliationRange.id == range_id)
+            .values(done_at=datetime.datetime.utcnow(), discrepancies=len(found))
+        )
+        db.execute(
+            update(ReconciliationRun)
+            .where(ReconciliationRun.id == run_id)
+            .values(
+                ranges_done=ReconciliationRun.ranges_done + 1,
+                discrepancies=ReconciliationRun.discrepancies + len(found),
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
+    return len(found)
+
+
+def create_run(db: Session, range_size: int = RECONCILE_RANGE_SIZE) -> int:
+    low, high = db.execute(select(func.min(Account.id), func.max(Account.id))).one()
+    bounds = [(start, min(start + range_size - 1, high)) for start in range(low, high + 1, range_size)] if low is not None else []
+    run = ReconciliationRun(status="running", range_size=range_size, total_ranges=len(bounds), ranges_done=0, discrepancies=0)
+    db.add(run)
+    db.flush()
+    if bounds:
+        db.execute(insert(ReconciliationRange), [
+            dict(run_id=run.id, first_account_id=first, last_account_id=last, discrepancies=0) for first, last in bounds
+        ])
+    db.commit()
+    return run.id
+
+
+def execute(run_id: int, workers: int = RECONCILE_WORKERS, progress=None):
+    """Checks every range of the run not done yet. Safe to call again after a crash."""
+    db = SessionLocal()
+    try:
+        pending = db.execute(
+            select(ReconciliationRange.id, ReconciliationRange.first_account_id, ReconciliationRange.last_account_id)
+            .where(ReconciliationRange.run_id == run_id, ReconciliationRange.done_at.is_(None))
+            .order_by(ReconciliationRange.id)
+        ).all()
+        db.execute(update(ReconciliationRun).where(ReconciliationRun.id == run_id).values(status="running", finished_at=None))
+        db.commit()
+    finally:
+        db.close()
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(check_range, run_id, *r): r for r in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Reconciliation range {futures[future][1]}..{futures[future][2]} failed: {e!r}")
+            if progress:
+                progress(done, len(pending))
+
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(ReconciliationRun)
+            .where(ReconciliationRun.id == run_id)
+            .values(status="incomplete" if failed else "done", finished_at=datetime.datetime.utcnow())
+        )
+        db.commit()
+        return run_status(db, run_id)
+    finally:
+        db.close()
+
+
+def run_status(db: Session, run_id: int, limit: int = 100, offset: int = 0):
+    run = db.get(ReconciliationRun, run_id)
+    if run is None:
+        return None
+    found = db.scalars(
+        select(ReconciliationDiscrepancy)
+        .where(ReconciliationDiscrepancy.run_id == run_id)
+        .order_by(ReconciliationDiscrepancy.id)
+        .offset(offset)
+        .limit(limit)
+    )
+    return {
+        "id": run.id,
+        "status": run.status,
+        "range_size": run.range_size,
+        "ranges_done": run.ranges_done,
+        "total_ranges": run.total_ranges,
+        "discrepancies": run.discrepancies,
+        "started_at": run.started_at.isoformat() if run.started_at else None,
+        "finished_at": run.finished_at.isoformat() if run.finished_at else None,
+        "items": [
+            {
+                "kind": d.kind, "account_id": d.account_id, "counterparty_account_id": d.counterparty_account_id,
+                "expected": d.expected, "actual": d.actual, "detail": d.detail,
+            }
+            for d in found
+        ],
+    }
+
+
+# One background run per API process
+_background = None
+_background_lock = threading.Lock()
+
+
+def busy() -> bool:
+    return _background is not None and _background.is_alive()
+
+
+def start_in_background(run_id: int, workers: int = RECONCILE_WORKERS) -> bool:
+    global _background
+    with _background_lock:
+        if busy():
+            return False
+        _background = threading.Thread(target=execute, args=(run_id, workers), name="reconciliation", daemon=True)
+        _background.start()
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="start a new reconciliation")
+    run.add_argument("--workers", type=int, default=RECONCILE_WORKERS)
+    run.add_argument("--range-size", type=int, default=RECONCILE_RANGE_SIZE)
+    resume = sub.add_parser("resume", help="finish the ranges an earlier run did not get to")
+    resume.add_argument("run_id", type=int)
+    resume.add_argument("--workers", type=int, default=RECONCILE_WORKERS)
+    status = sub.add_parser("status", help="print progress and the first discrepancies")
+    status.add_argument("run_id", type=int)
+    args = parser.parse_args()
+
+    wait_for_db(engine)  # the schema comes from migrate.py
+
+    def report(done, total):
+        if done == total or done % max(1, total // 20) == 0:
+            print(f"  {done}/{total} ranges checked")
+
+    if args.command == "status":
+        db = SessionLocal()
+        try:
+            print(json.dumps(run_status(db, args.run_id), indent=2))
+        finally:
+            db.close()
+    else:
+        if args.command == "run":
+            db = SessionLocal()
+            try:
+                run_id = create_run(db, args.range_size)
+            finally:
+                db.close()
+            print(f"Reconciliation run {run_id}")
+        else:
+            run_id = args.run_id
+        result = execute(run_id, args.workers, report)
+        print(json.dumps({k: v for k, v in result.items() if k != "items"}))
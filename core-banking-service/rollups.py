@@ -0,0 +1,129 @@
+"""
+Daily and monthly totals per user (transaction_rollups), updated by the writers.
+
+Backfill existing data in a quiet window, each range is deleted and rebuilt:
+    python rollups.py backfill --workers 4 --users-per-chunk 1000
+"""
+from sqlalchemy import select, delete, func, literal, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from database import engine, wait_for_db, SessionLocal
+from models import Transaction, TransactionRollup
+import argparse
+import datetime
+
+PERIODS = ("day", "month")
+
+
+def period_start(period: str, ts: datetime.datetime) -> datetime.date:
+    if period == "day":
+        return ts.date()
+    return ts.date().replace(day=1)
+
+
+def apply_rollups(db: Session, rows):
+    """rows are dicts with user_id, amount, transaction_type and timestamp. Does not commit."""
+    merged = defaultdict(lambda: [0, 0.0, 0.0, 0.0])  # count, total, inflow, outflow
+    for row in rows:
+        ts = row.get("timestamp") or datetime.datetime.utcnow()
+        amount = row["amount"]
+        for period in PERIODS:
+            agg = merged[(row["user_id"], period, period_start(period, ts), row["transaction_type"])]
+            agg[0] += 1
+            agg[1] += amount
+            if amount > 0:
+                agg[2] += amount
+            else:
+                agg[3] += -amount
+    if not merged:
+        return
+
+    # Sorted: same lock order for every writer
+    values = [
+        {
+            "user_id": user_id, "period": period, "period_start": start, "transaction_type": tx_type,
+            "count": agg[0], "total": agg[1], "inflow": agg[2], "outflow": agg[3],
+        }
+        for (user_id, period, start, tx_type), agg in sorted(merged.items())
+    ]
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(TransactionRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "period", "period_start", "transaction_type"],
+        set_={
+            "count": TransactionRollup.count + stmt.excluded["count"],
+            "total": TransactionRollup.total + stmt.excluded.total,
+            "inflow": TransactionRollup.inflow + stmt.excluded.inflow,
+            "outflow": TransactionRollup.outflow + stmt.excluded.outflow,
+        },
+    )
+    db.execute(stmt, values)
+
+
+def period_expr(period: str, dialect_name: str):
+    if dialect_name == "postgresql":
+        return func.cast(func.date_trunc(period, Transaction.timestamp), postgresql.DATE)
+    if period == "day":
+        return func.date(Transaction.timestamp)
+    return func.date(Transaction.timestamp, "start of month")
+
+
+def rebuild_range(first_user_id: int, last_user_id: int):
+    """Recomputes every rollup of users in [first_user_id, last_user_id] from transactions."""
+    db = SessionLocal()
+    try:
+        dialect_name = db.get_bind().dialect.name
+        db.execute(delete(TransactionRollup).where(TransactionRollup.user_id.between(first_user_id, last_user_id)))
+        for period in PERIODS:
+            start = period_expr(period, dialect_name)
+            agg = (
+                select(
+                    Transaction.user_id,
+                    literal(period),
+                    start,
+                    Transaction.transaction_type,
+                    func.count(Transaction.id),
+                    func.sum(Transaction.amount),
+                    func.sum(case((Transaction.amount > 0, Transaction.amount), else_=0.0)),
+                    func.sum(case((Transaction.amount < 0, -Transaction.amount), else_=0.0)),
+                )
+                .where(Transaction.user_id.between(first_user_id, last_user_id))
+                .group_by(Transaction.user_id, start, Transaction.transaction_type)
+            )
+            db.execute(
+                TransactionRollup.__table__.insert().from_select(
+                    ["user_id", "period", "period_start", "transaction_type", "count", "total", "inflow", "outflow"],
+                    agg,
+                )
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+def backfill(workers: int, users_per_chunk: int):
+    with engine.connect() as conn:
+        low, high = conn.execute(select(func.min(Transaction.user_id), func.max(Transaction.user_id))).one()
+    if low is None:
+        print("No transactions, nothing to backfill")
+        return
+    ranges = [(start, min(start + users_per_chunk - 1, high)) for start in range(low, high + 1, users_per_chunk)]
+    print(f"Rebuilding rollups for users {low}..{high} in {len(ranges)} chunks with {workers} workers")
+    # One connection per worker
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for done, _ in enumerate(pool.map(lambda r: rebuild_range(*r), ranges), 1):
+            print(f"  {done}/{len(ranges)} chunks done")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    bf = sub.add_parser("backfill", help="rebuild rollups from the transactions table")
+    bf.add_argument("--workers", type=int, default=4)
+    bf.add_argument("--users-per-chunk", type=int, default=1000)
+    args = parser.parse_args()
+    if args.command == "backfill":
+        wait_for_db(engine)  # the schema comes from migrate.py
+        backfill(args.workers, args.users_per_chunk)
@@ -0,0 +1,411 @@
+"""
+Scheduled and recurring transfers (standing orders): once, daily, weekly or monthly.
+Due orders are claimed in batches and run through the batch transfer path, grouped by
+source account; missed occurrences run one per claim until the order has caught up:
+    python scheduler.py run [--every 60]
+    python scheduler.py status
+"""
+from fastapi import HTTPException
+from sqlalchemy import select, update, or_
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import DBAPIError
+from collections import defaultdict
+from itertools import groupby
+from database import engine, wait_for_db, SessionLocal
+from models import Account, Beneficiary, Notification, ScheduledTransfer, SchedulerRun
+from bankcommon.cache import response_cache
+from transfers import AccountRef, apply_batch, check_amount, is_retryable, BATCH_CHUNK_SIZE, MAX_RETRIES
+import outbox
+import argparse
+import calendar
+import datetime
+import json
+import os
+import time
+
+SCHEDULED_TRANSFER_WINDOW = int(os.getenv("SCHEDULED_TRANSFER_WINDOW", "3600"))  # seconds
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+SCHEDULER_LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", "300"))
+
+FREQUENCIES = ("once", "daily", "weekly", "monthly")
+
+
+def add_months(at: datetime.datetime, months: int) -> datetime.datetime:
+    # Same day of month, or the month's last day: Jan 31 -> Feb 28 -> Mar 31
+    month = at.month - 1 + months
+    year = at.year + month // 12
+    month = month % 12 + 1
+    return at.replace(year=year, month=month, day=min(at.day, calendar.monthrange(year, month)[1]))
+
+
+def occurrence(order: ScheduledTransfer, n: int):
+    """The nth occurrence (0 is starts_at), None past the last one."""
+    if order.frequency == "once":
+        at = order.starts_at if n == 0 else None
+    elif order.frequency == "monthly":
+        at = add_months(order.starts_at, n)
+    else:
+        at = order.starts_at + datetime.timedelta(days=n * (7 if order.frequency == "weekly" else 1))
+    if at is None or (order.ends_at is not None and at > order.ends_at):
+        return None
+    return at
+
+
+def window_offset(order_id: int) -> datetime.timedelta:
+    # Fixed per order, spreads the midnight rush over the window
+    if SCHEDULED_TRANSFER_WINDOW <= 0:
+        return datetime.timedelta(0)
+    return datetime.timedelta(seconds=(order_id * 2654435761) % SCHEDULED_TRANSFER_WINDOW)
+
+
+def schedule_next(order: ScheduledTransfer):
+    """Points next_run_at at occurrence number occurrences_done, or finishes the order."""
+    at = occurrence(order, order.occurrences_done)
+    if at is None:
+        order.status = "done"
+    else:
+        order.next_run_at = at + window_offset(order.id)
+
+
+def skip_missed(order: ScheduledTransfer, now: datetime.datetime):
+    # A resumed order does not run what it missed while paused
+    while True:
+        at = occurrence(order, order.occurrences_done)
+        if at is None or at >= now:
+            break
+        order.occurrences_done += 1
+    schedule_next(order)
+
+
+def utc_naive(at: datetime.datetime):
+    if at is not None and at.tzinfo is not None:
+        return at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return at
+
+
+# ---- Orders (API) ----
+
+def order_response(order: ScheduledTransfer) -> dict:
+    return {
+        "id": order.id,
+        "to_account_number": order.to_account_number,
+        "beneficiary_id": order.beneficiary_id,
+        "amount": order.amount,
+        "description": order.description,
+        "frequency": order.frequency,
+        "starts_at": order.starts_at,
+        "ends_at": order.ends_at,
+        "status": order.status,
+        "next_run_at": order.next_run_at if order.status == "active" else None,
+        "occurrences_done": order.occurrences_done,
+        "last_run_at": order.last_run_at,
+        "last_status": order.last_status,
+        "last_error": order.last_error,
+    }
+
+
+def create_order(db: Session, user_id: int, amount: float, frequency: str, starts_at: datetime.datetime,
+                 to_account_number: str = None, beneficiary_id: int = None, description: str = None,
+                 ends_at: datetime.datetime = None) -> dict:
+    check_amount(amount)
+    starts_at, ends_at = utc_naive(starts_at), utc_naive(ends_at)
+    if starts_at < datetime.datetime.utcnow() - datetime.timedelta(minutes=5):
+        raise HTTPException(status_code=400, detail="starts_at is in the past")
+    if ends_at is not None and ends_at < starts_at:
+        raise HTTPException(status_code=400, detail="ends_at is before starts_at")
+    if beneficiary_id is not None:
+        beneficiary = db.query(Beneficiary).filter(Beneficiary.id == beneficiary_id, Beneficiary.user_id == user_id).first()
+        if not beneficiary:
+            raise HTTPException(status_code=404, detail="Beneficiary not found")
+        to_account_number = beneficiary.account_number
+    if not to_account_number:
+        raise HTTPException(status_code=400, detail="to_account_number or beneficiary_id is required")
+
+    from_account = db.query(Account).filter(Account.user_id == user_id).first()
+    if not from_account:
+        raise HTTPException(status_code=404, detail="Origin account not found")
+    to_account = db.query(Account).filter(Account.account_number == to_account_number).first()
+    if not to_account or to_account.user_id is None:
+        raise HTTPException(status_code=404, detail="Destination account not found")
+    if to_account.id == from_account.id:
+        raise HTTPException(status_code=400, detail="Cannot transfer to the same account")
+
+    order = ScheduledTransfer(
+        user_id=user_id, from_account_id=from_account.id, beneficiary_id=beneficiary_id,
+        to_account_number=to_account_number, amount=amount, description=description or "Transferencia programada",
+        frequency=frequency, starts_at=starts_at, ends_at=ends_at, occurrences_done=0, status="active", failures=0,
+    )
+    db.add(order)
+    db.flush()  # the window offset comes from the id
+    schedule_next(order)
+    db.commit()
+    return order_response(order)
+
+
+def load_order(db: Session, user_id: int, order_id: int) -> ScheduledTransfer:
+    # Row lock: waits for a scheduler running this order right now
+    order = db.scalars(
+        select(ScheduledTransfer).where(ScheduledTransfer.id == order_id, ScheduledTransfer.user_id == user_id).with_for_update()
+    ).first()
+    if order is None:
+        raise HTTPException(status_code=404, detail="Scheduled transfer not found")
+    return order
+
+
+def update_order(db: Session, user_id: int, order_id: int, changes: dict) -> dict:
+    """changes may hold amount, description, ends_at (None clears it) and status ('active' or 'paused')."""
+    try:
+        order = load_order(db, user_id, order_id)
+        if order.status in ("done", "cancelled"):
+            raise HTTPException(status_code=409, detail=f"Scheduled transfer already {order.status}")
+        if changes.get("amount") is not None:
+            check_amount(changes["amount"])
+            order.amount = changes["amount"]
+        if changes.get("description") is not None:
+            order.description = changes["description"]
+        if "ends_at" in changes:
+            order.ends_at = utc_naive(changes["ends_at"])
+        if "status" in changes:
+            if changes["status"] == "active" and order.status == "paused":
+                order.status = "active"
+                skip_missed(order, datetime.datetime.utcnow())
+            elif changes["status"] == "paused":
+                order.status = "paused"
+        if order.status == "active":
+            schedule_next(order)
+    except HTTPException:
+        db.rollback()
+        raise
+    db.commit()
+    return order_response(order)
+
+
+def cancel_order(db: Session, user_id: int, order_id: int) -> dict:
+    order = load_order(db, user_id, order_id)
+    if order.status != "done":
+        order.status = "cancelled"
+    db.commit()
+    return order_response(order)
+
+
+# ---- Scheduler ----
+
+def claim(db: Session, now: datetime.datetime, limit: int):
+    """Leases up to limit due orders. Returns (order id, source account id) pairs."""
+    rows = db.execute(
+        select(ScheduledTransfer.id, ScheduledTransfer.from_account_id)
+        .where(
+            ScheduledTransfer.status == "active",
+            ScheduledTransfer.next_run_at <= now,
+            or_(ScheduledTransfer.claimed_until.is_(None), ScheduledTransfer.claimed_until < now),
+        )
+        .order_by(ScheduledTransfer.from_account_id, ScheduledTransfer.next_run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if rows:
+        db.execute(
+            update(ScheduledTransfer)
+            .where(ScheduledTransfer.id.in_([order_id for order_id, _ in rows]))
+            .values(claimed_until=now + datetime.timedelta(seconds=SCHEDULER_LEASE_SECONDS)),
+            execution_options={"synchronize_session": False},
+        )
+    db.commit()
+    return rows
+
+
+def execute_group(db: Session, from_account_id: int, order_ids: list, chunk_size: int = BATCH_CHUNK_SIZE):
+    """One occurrence of each order, all from the same account. Does not commit.
+
+    Returns (executed, failed, lags, user ids whose balance changed).
+    """
+    now = datetime.datetime.utcnow()
+    orders = db.scalars(
+        select(ScheduledTransfer)
+        .where(ScheduledTransfer.id.in_(order_ids), ScheduledTransfer.status == "active")
+        .order_by(ScheduledTransfer.next_run_at, ScheduledTransfer.id)
+        .with_for_update()
+    ).all()
+    sender = db.get(Account, from_account_id)
+    numbers = {order.to_account_number for order in orders}
+    rows = db.query(Account.id, Account.user_id, Account.account_number).filter(
+        Account.account_number.in_(numbers), Account.user_id.isnot(None)
+    )
+    destinations = {row.account_number: AccountRef(*row) for row in rows}
+
+    # Oldest first while the balance lasts
+    balance = sender.balance if sender else 0.0
+    errors = {}
+    payable = []
+    for order in orders:
+        to_acc = destinations.get(order.to_account_number)
+        if sender is None:
+            errors[order.id] = "Origin account not found"
+        elif not to_acc:
+            errors[order.id] = "Destination account not found"
+        elif to_acc.id == sender.id:
+            errors[order.id] = "Cannot transfer to the same account"
+        elif order.amount > balance:
+            errors[order.id] = "Insufficient funds"
+        else:
+            balance -= order.amount
+            payable.append((order, to_acc))
+
+    users = set()
+    if payable:
+        from_account = AccountRef(sender.id, sender.user_id, sender.account_number)
+        # apply_batch takes one description
+        payable.sort(key=lambda p: p[0].description)
+        for description, group in groupby(payable, key=lambda p: p[0].description):
+            apply_batch(db, from_account, [(order.id, to_acc, order.amount) for order, to_acc in group], description, chunk_size)
+        users.add(sender.user_id)
+        users.update(to_acc.user_id for _, to_acc in payable)
+
+    lags = []
+    for order in orders:
+        lags.append((now - order.next_run_at).total_seconds())
+        error = errors.get(order.id)
+        order.occurrences_done += 1
+        order.last_run_at = now
+        order.last_status = "failed" if error else "ok"
+        order.last_error = error
+        order.failures += 1 if error else 0
+        schedule_next(order)
+        if error:
+            db.add(Notification(
+                user_id=order.user_id,
+                title="Transferencia Programada Fallida",
+                message=f"No se pudo enviar ${order.amount} a la cuenta {order.to_account_number}: {error}.",
+                is_read=0,
+                timestamp=now,
+            ))
+    db.execute(
+        update(ScheduledTransfer).where(ScheduledTransfer.id.in_(order_ids)).values(claimed_until=None),
+        execution_options={"synchronize_session": False},
+    )
+    return len(orders) - len(errors), len(errors), lags, users
+
+
+def run_groups(groups: dict):
+    """groups are source account id -> order ids, run in one DB transaction. Returns (executed, failed, lags)."""
+    db = SessionLocal()
+    try:
+        for attempt in range(MAX_RETRIES):
+            executed = failed = 0
+            lags = []
+            users = set()
+            try:
+                for from_account_id in sorted(groups):
+                    ok, bad, group_lags, group_users = execute_group(db, from_account_id, groups[from_account_id])
+                    executed += ok
+                    failed += bad
+                    lags.extend(group_lags)
+                    users |= group_users
+                db.commit()
+            except (HTTPException, DBAPIError) as e:
+                db.rollback()
+                # Balance changed under us or lock contention: try again
+                if (isinstance(e, DBAPIError) and not is_retryable(e)) or attempt == MAX_RETRIES - 1:
+                    raise
+                continue
+            if users:
+                response_cache.invalidate("account", *users)
+                outbox.wake()
+            return executed, failed, lags
+    finally:
+        db.close()
+
+
+def run_due(batch_size: int = SCHEDULER_BATCH_SIZE) -> dict:
+    """Runs everything due, catch-up included. Records and returns the run's report."""
+    db = SessionLocal()
+    try:
+        run = SchedulerRun(executed=0, failed=0, batches=0)
+        db.add(run)
+        db.commit()
+        run_id = run.id
+
+        executed = failed = batches = 0
+        lags = []
+        while True:
+            claimed = claim(db, datetime.datetime.utcnow(), batch_size)
+            if not claimed:
+                break
+            batches += 1
+            groups = defaultdict(list)
+            for order_id, from_account_id in claimed:
+                groups[from_account_id].append(order_id)
+            try:
+                results = [run_groups(groups)]
+            except Exception:
+                # Isolate the bad account(s)
+                results = []
+                for from_account_id, order_ids in groups.items():
+                    try:
+                        results.append(run_groups({from_account_id: order_ids}))
+                    except Exception as e:
+                        # Left claimed until the lease is over
+                        print(f"Scheduled transfers from account {from_account_id} failed: {e!r}")
+            for ok, bad, group_lags in results:
+                executed += ok
+                failed += bad
+                lags.extend(group_lags)
+
+        db.execute(
+            update(SchedulerRun)
+            .where(SchedulerRun.id == run_id)
+            .values(
+                finished_at=datetime.datetime.utcnow(), executed=executed, failed=failed, batches=batches,
+                avg_lag_seconds=sum(lags) / len(lags) if lags else None,
+                max_lag_seconds=max(lags) if lags else None,
+            )
+        )
+        db.commit()
+        return run_report(db.get(SchedulerRun, run_id))
+    finally:
+        db.close()
+
+
+def run_report(run: SchedulerRun) -> dict:
+    elapsed = (run.finished_at - run.started_at).total_seconds() if run.finished_at else None
+    done = run.executed + run.failed
+    return {
+        "id": run.id,
+        "started_at": run.started_at.isoformat(),
+        "finished_at": run.finished_at.isoformat() if run.finished_at else None,
+        "executed": run.executed,
+        "failed": run.failed,
+        "batches": run.batches,
+        "per_second": round(done / elapsed, 1) if elapsed else None,
+        "avg_lag_seconds": round(run.avg_lag_seconds, 3) if run.avg_lag_seconds is not None else None,
+        "max_lag_seconds": round(run.max_lag_seconds, 3) if run.max_lag_seconds is not None else None,
+    }
+
+
+def recent_runs(db: Session, limit: int = 20):
+    return [run_report(run) for run in db.scalars(select(SchedulerRun).order_by(SchedulerRun.id.desc()).limit(limit))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="execute every scheduled transfer that is due")
+    run.add_argument("--every", type=float, default=0, help="keep running, one pass every N seconds")
+    run.add_argument("--batch-size", type=int, default=SCHEDULER_BATCH_SIZE)
+    status = sub.add_parser("status", help="throughput and lag of the last runs")
+    status.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    wait_for_db(engine)  # the schema comes from migrate.py
+    if args.command == "status":
+        db = SessionLocal()
+        try:
+            print(json.dumps(recent_runs(db, args.limit), indent=2))
+        finally:
+            db.close()
+    else:
+        while True:
+            print(json.dumps(run_due(args.batch_size)))
+            if not args.every:
+                break
+            time.sleep(args.every)
@@ -0,0 +1,102 @@
+"""
+Test setup for core-banking-service. The modules read their settings at import, so they
+are set here first: TEST_POSTGRES_URL when given (emptied by the repo root conftest.py),
+a new SQLite file otherwise, migrated once per run. Each test module works on its own
+block of user ids instead of cleaning up.
+"""
+import atexit
+import os
+import sys
+import tempfile
+
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ROOT = os.path.dirname(SERVICE_DIR)
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+if TEST_POSTGRES_URL:
+    os.environ["DATABASE_URL"] = TEST_POSTGRES_URL
+else:
+    fd, db_file = tempfile.mkstemp(prefix="core_test_", suffix=".db")
+    os.close(fd)
+    atexit.register(os.remove, db_file)
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_file
+os.environ.update(APP_ENV="dev", OUTBOX_WORKER="external", CACHE_BACKEND="memory", NOTIFY_BACKEND="memory")
+
+# pytest from the repo root loads both services, whose modules share names (main, database,
+# models...): each conftest puts its own ones back before collecting or running its tests
+SERVICE_MODULES = {}
+
+
+def use_this_service():
+    for name, module in list(sys.modules.items()):
+        folder = os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or ""))
+        if folder.endswith("-service") and folder != SERVICE_DIR:
+            del sys.modules[name]
+    sys.modules.update(SERVICE_MODULES)
+    sys.path[:] = [SERVICE_DIR] + [p for p in sys.path if p != SERVICE_DIR]
+
+
+def pytest_collectstart(collector):
+    use_this_service()
+
+
+def pytest_runtest_setup(item):
+    use_this_service()
+
+
+sys.path.append(os.path.join(ROOT, "shared"))
+use_this_service()
+
+import pytest
+from fastapi.testclient import TestClient
+
+import migrate
+migrate.run()
+import main
+from bankcommon import tokens
+from database import SessionLocal
+
+SERVICE_MODULES.update(
+    (name, module) for name, module in sys.modules.items()
+    if os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or "")) == SERVICE_DIR
+)
+
+
+@pytest.fixture(scope="session")
+def client():
+    # One client for the whole run: the async engine's connections belong to its event loop
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def headers(user_id: int, role: str = "client"):
+    return {"Authorization": "Bearer " + tokens.create_access_token(f"user{user_id}", role, user_id)}
+
+
+ADMIN = headers(1, "admin")
+
+
+@pytest.fixture(scope="session")
+def auth():
+    return headers
+
+
+@pytest.fixture(scope="session")
+def open_account(client):
+    """Account (and card) for user_id with an opening deposit. Returns the onboarding row."""
+    def open_account(user_id: int, balance: float = 0, card: bool = False):
+        r = client.post("/admin/onboarding/issue", json={"user_ids": [user_id], "issue_cards": card}, headers=ADMIN)
+        assert r.status_code == 200, r.text
+        issued = r.json()[0]
+        if balance:
+            r = client.post("/admin/mint-money", json={"account_number": issued["account_number"], "amount": balance}, headers=ADMIN)
+            assert r.status_code == 200, r.text
+        return issued
+    return open_account
@@ -0,0 +1,52 @@
+import asyncio
+
+import transfers
+
+USER = 5001
+
+
+def test_sync_and_async_routes_agree(client, auth, open_account):
+    open_account(USER, 25, card=True)
+    for path in ["/accounts/me", "/cards/me", "/movements", "/notifications", "/beneficiaries", "/dashboard"]:
+        r_async = client.get(path, headers=auth(USER))
+        r_sync = client.get("/sync" + path, headers=auth(USER))
+        assert r_async.status_code == r_sync.status_code == 200, path
+        assert r_async.json() == r_sync.json(), path
+
+
+class RunSync:
+    """Stands in for AsyncSession.run_sync."""
+
+    async def run_sync(self, fn, *args):
+        return fn(None, *args)
+
+
+def test_async_retries_wait_without_blocking_the_loop(monkeypatch):
+    attempts = []
+
+    def conflict_twice(db, *args):
+        attempts.append(args[-1])
+        return None if len(attempts) < 3 else {"message": "Transfer successful"}
+
+    monkeypatch.setattr(transfers, "try_transfer", conflict_twice)
+    monkeypatch.setattr(transfers, "RETRY_BASE_DELAY", 0.05)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        result = await transfers.post_transfer_async(RunSync(), USER, "0000000000", 1)
+        ticker.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    assert result == {"message": "Transfer successful"}
+    assert attempts == [0, 1, 2]
+    # At least 0.15s of backoff went by with the loop still running other tasks
+    assert ticks >= 10
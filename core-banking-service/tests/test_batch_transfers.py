@@ -0,0 +1,52 @@
+import pytest
+
+from models import Account
+from transfers import post_batch_transfer
+
+USER = 4001
+
+
+def balances(db, *user_ids):
+    db.expire_all()
+    return [db.query(Account.balance).filter(Account.user_id == u).scalar() for u in user_ids]
+
+
+@pytest.fixture(scope="module")
+def payees(open_account):
+    return [open_account(USER + i)["account_number"] for i in range(1, 4)]
+
+
+def test_all_or_nothing_rejects_the_whole_batch(client, auth, open_account, payees, db):
+    open_account(USER, 100)
+    items = [{"to_account_number": payees[0], "amount": 10}, {"to_account_number": "0000000000", "amount": 10}]
+    r = client.post("/transfers/batch", json={"items": items}, headers=auth(USER))
+    assert r.status_code == 400
+    assert [x["status"] for x in r.json()["detail"]["results"]] == ["skipped", "error"]
+
+    items = [{"to_account_number": n, "amount": 60} for n in payees[:2]]
+    r = client.post("/transfers/batch", json={"items": items}, headers=auth(USER))
+    assert r.status_code == 400 and r.json()["detail"]["message"] == "Insufficient funds"
+    assert balances(db, USER, USER + 1, USER + 2) == [100, 0, 0]
+
+
+def test_all_or_nothing_pays_everyone(client, auth, open_account, payees, db):
+    open_account(USER + 10, 100)
+    items = [{"to_account_number": n, "amount": 10 * (i + 1)} for i, n in enumerate(payees)]
+    r = client.post("/transfers/batch", json={"items": items, "description": "Nomina"}, headers=auth(USER + 10))
+    assert r.status_code == 200
+    report = r.json()
+    assert (report["processed"], report["failed"], report["total_debited"], report["new_balance"]) == (3, 0, 60, 40)
+    assert balances(db, USER + 10, USER + 1, USER + 2, USER + 3) == [40, 10, 20, 30]
+
+
+def test_best_effort_pays_what_fits_in_order(open_account, payees, db):
+    open_account(USER + 20, 50)
+    items = [(payees[0], 20), ("0000000000", 5), (payees[1], 20), (payees[2], 5), (payees[0], 20)]
+    before = balances(db, USER + 1, USER + 2, USER + 3)
+    # Chunks of two: the second chunk runs short and only its first item is paid
+    report = post_batch_transfer(db, USER + 20, items, all_or_nothing=False, chunk_size=2)
+    assert [r["status"] for r in report["results"]] == ["ok", "error", "ok", "ok", "error"]
+    assert report["results"][4]["detail"] == "Insufficient funds"
+    assert (report["processed"], report["total_debited"], report["new_balance"]) == (3, 45, 5)
+    after = balances(db, USER + 1, USER + 2, USER + 3)
+    assert [a - b for a, b in zip(after, before)] == [20, 20, 5]
@@ -0,0 +1,89 @@
+import datetime
+
+import pytest
+
+import cards
+from models import CardHold
+
+USER = 22001
+MERCHANT = 22100
+
+
+@pytest.fixture(scope="module")
+def card(client, auth, open_account):
+    """The holder's card details, digits unspaced."""
+    open_account(USER, 100, card=True)
+    mine = client.get("/cards/me", headers=auth(USER)).json()[0]
+    return dict(mine, card_number=mine["card_number"].replace(" ", ""))
+
+
+def balance(client, auth):
+    return client.get("/accounts/me/balance", headers=auth(USER)).json()
+
+
+def authorize(client, auth, card, amount, **changes):
+    body = dict(card_number=card["card_number"], expiry=card["expiry"], cvv=card["cvv"], amount=amount, merchant="Shop")
+    return client.post("/cards/authorize", json=dict(body, **changes), headers=auth(MERCHANT))
+
+
+def test_capture_books_the_purchase_and_releases_the_rest(client, auth, card):
+    hold = authorize(client, auth, card, 30)
+    assert hold.status_code == 200 and hold.json()["status"] == "authorized"
+    hold_id = hold.json()["hold_id"]
+    assert balance(client, auth)["balance"] == 70 and balance(client, auth)["held"] == 30
+
+    # Only the merchant that authorized it (or an admin) settles a hold
+    assert client.post("/cards/capture", json={"hold_id": hold_id}, headers=auth(MERCHANT + 1)).status_code == 404
+    assert client.post("/cards/capture", json={"hold_id": hold_id, "amount": 31}, headers=auth(MERCHANT)).status_code == 400
+    captured = client.post("/cards/capture", json={"hold_id": hold_id, "amount": 20}, headers=auth(MERCHANT))
+    assert captured.json()["status"] == "captured" and captured.json()["captured_amount"] == 20
+    assert balance(client, auth) == dict(balance(client, auth), balance=80, ledger_balance=80, held=0)
+    assert client.post("/cards/void", json={"hold_id": hold_id}, headers=auth(MERCHANT)).status_code == 409
+
+    purchases = client.get("/movements", params={"transaction_type": "purchase"}, headers=auth(USER)).json()
+    assert [(m["amount"], m["description"]) for m in purchases] == [(-20, "Card purchase - Shop")]
+
+
+def test_void_gives_the_hold_back(client, auth, card):
+    before = balance(client, auth)["balance"]
+    hold_id = authorize(client, auth, card, 15).json()["hold_id"]
+    assert balance(client, auth)["balance"] == before - 15
+    assert client.post("/cards/void", json={"hold_id": hold_id}, headers=auth(MERCHANT)).json()["status"] == "voided"
+    assert balance(client, auth)["balance"] == before
+
+
+def test_declines(client, auth, card):
+    assert authorize(client, auth, card, 10_000).json()["detail"] == "Insufficient funds"
+    assert authorize(client, auth, card, 5, card_number="4000000000000002").status_code == 402
+    # The spaced form is the same card
+    spaced = " ".join(card["card_number"][i:i + 4] for i in range(0, 16, 4))
+    hold = authorize(client, auth, card, 1, card_number=spaced)
+    assert hold.status_code == 200
+    client.post("/cards/void", json={"hold_id": hold.json()["hold_id"]}, headers=auth(MERCHANT))
+
+
+def test_wrong_cvvs_lock_the_card(client, auth, card, monkeypatch):
+    monkeypatch.setattr(cards, "CARD_CVV_MAX_FAILURES", 3)
+    wrong = "000" if card["cvv"] != "000" else "111"
+    for _ in range(3):
+        assert authorize(client, auth, card, 1, cvv=wrong).json()["detail"] == "Card declined"
+    # Locked: the right CVV is declined too, with the same answer
+    assert authorize(client, auth, card, 1).json()["detail"] == "Card declined"
+
+    monkeypatch.setattr(cards, "CARD_CVV_LOCK_MINUTES", 0)
+    hold = authorize(client, auth, card, 1)
+    assert hold.status_code == 200
+    client.post("/cards/void", json={"hold_id": hold.json()["hold_id"]}, headers=auth(MERCHANT))
+
+
+def test_expired_holds_are_given_back(client, auth, card, db):
+    before = balance(client, auth)["balance"]
+    hold_id = authorize(client, auth, card, 12).json()["hold_id"]
+    db.query(CardHold).filter(CardHold.id == hold_id).update(
+        {CardHold.expires_at: datetime.datetime.utcnow() - datetime.timedelta(minutes=1)}
+    )
+    db.commit()
+    assert cards.expire_holds(db) == 1
+    assert db.get(CardHold, hold_id).status == "expired"
+    assert balance(client, auth)["balance"] == before
+    assert cards.expire_holds(db) == 0
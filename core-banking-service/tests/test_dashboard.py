@@ -0,0 +1,40 @@
+from models import Notification
+
+USER = 11001
+
+
+def transfer_body(to_account_number, amount):
+    return {"to_account_number": to_account_number, "amount": amount, "description": "Pago",
+            "beneficiary_cedula": "V12345678", "beneficiary_phone": "04121234567"}
+
+
+def test_dashboard_in_one_call(client, auth, open_account, db):
+    me = open_account(USER, 100, card=True)
+    often = open_account(USER + 1)["account_number"]
+    once = open_account(USER + 2)["account_number"]
+    never = open_account(USER + 3)["account_number"]
+    for name, number in [("Often", often), ("Once", once), ("Never", never)]:
+        assert client.post("/beneficiaries", json={"name": name, "account_number": number}, headers=auth(USER)).status_code == 200
+    for number, amount in [(often, 10), (once, 5), (often, 15)]:
+        assert client.post("/transfer", json=transfer_body(number, amount), headers=auth(USER)).status_code == 200
+    db.add(Notification(user_id=USER, title="Hi", message="unread"))
+    db.commit()
+
+    for path in ["/dashboard", "/sync/dashboard"]:
+        r = client.get(path, params={"recent": 2, "top": 2}, headers=auth(USER))
+        assert r.status_code == 200
+        dash = r.json()
+        assert dash["account"]["account_number"] == me["account_number"]
+        assert dash["account"]["balance"] == 70
+        assert [c["card_number"] for c in dash["cards"]] == [me["card_number"]]
+        assert dash["unread_notifications"] == 1
+        assert (dash["month_income"], dash["month_expense"]) == (100, 30)
+        assert [t["amount"] for t in dash["recent_transactions"]] == [-15, -5]
+        assert [b["name"] for b in dash["top_beneficiaries"]] == ["Often", "Once"]
+    # A fixed handful of statements, whatever the history size
+    assert int(r.headers["X-DB-Queries"]) <= 5
+
+
+def test_dashboard_without_an_account(client, auth):
+    dash = client.get("/dashboard", headers=auth(USER + 10)).json()
+    assert dash["account"] is None and dash["cards"] == [] and dash["recent_transactions"] == []
@@ -0,0 +1,36 @@
+import database
+from sqlalchemy import create_engine
+
+
+def test_async_urls_use_the_asyncio_drivers():
+    assert database.to_async_url("postgresql://u:p@db/bank") == "postgresql+asyncpg://u:p@db/bank"
+    assert database.to_async_url("sqlite:///./bank.db") == "sqlite+aiosqlite:///./bank.db"
+
+
+def test_pool_settings_apply_to_postgres_only(monkeypatch):
+    assert database.engine_options("sqlite:///x.db") == {}
+    monkeypatch.setattr(database, "DB_STATEMENT_TIMEOUT_MS", 5000)
+    sync = database.engine_options("postgresql://db/bank")
+    assert sync["poolclass"] is database.TimedQueuePool
+    assert (sync["pool_size"], sync["max_overflow"]) == (database.DB_POOL_SIZE, database.DB_MAX_OVERFLOW)
+    assert sync["connect_args"] == {"options": "-c statement_timeout=5000"}
+    async_ = database.engine_options("postgresql+asyncpg://db/bank", is_async=True)
+    assert async_["poolclass"] is database.TimedAsyncQueuePool
+    assert async_["connect_args"] == {"server_settings": {"statement_timeout": "5000"}}
+
+
+def test_checkout_waits_are_recorded():
+    engine = create_engine("sqlite://", poolclass=database.TimedQueuePool, pool_size=1, max_overflow=0)
+    engine.pool.wait_stats = database.PoolWaitStats()
+    for _ in range(3):
+        engine.connect().close()
+    stats = engine.pool.wait_stats.snapshot()
+    assert stats["checkouts"] == 3
+    assert stats["wait_max_ms"] >= stats["wait_avg_ms"] >= 0
+
+
+def test_reads_share_the_primary_without_a_replica(client):
+    assert database.DATABASE_READ_URL is None
+    assert database.read_engine is database.engine
+    assert database.async_read_engine is database.async_engine
+    assert set(client.get("/internal/db-pool").json()) == {"primary", "async_primary"}
@@ -0,0 +1,51 @@
+import csv
+import datetime
+import io
+import json
+
+import pytest
+
+import main
+from database import SessionLocal
+from models import Transaction
+
+USER = 10001
+T0 = datetime.datetime(2025, 6, 1)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def history():
+    db = SessionLocal()
+    amounts = [100, -30, 45.5, -10, 20]
+    db.add_all(
+        Transaction(user_id=USER, amount=a, transaction_type="purchase" if a < 0 else "transfer_in",
+                    description=f"row {i}", timestamp=T0 + datetime.timedelta(days=i))
+        for i, a in enumerate(amounts)
+    )
+    db.commit()
+    db.close()
+
+
+def test_csv_has_a_running_balance(client, auth):
+    r = client.get("/movements/export", headers=auth(USER))
+    assert r.headers["content-type"].startswith("text/csv")
+    assert r.headers["content-disposition"].startswith('attachment; filename="statement-')
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [row["description"] for row in rows] == [f"row {i}" for i in range(5)]
+    assert [row["balance"] for row in rows] == ["100.00", "70.00", "115.50", "105.50", "125.50"]
+
+
+def test_jsonl_range_opens_with_the_earlier_balance(client, auth):
+    params = {"format": "jsonl", "from": (T0 + datetime.timedelta(days=2)).isoformat(),
+              "to": (T0 + datetime.timedelta(days=4)).isoformat()}
+    r = client.get("/movements/export", params=params, headers=auth(USER))
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [(row["amount"], row["balance"]) for row in rows] == [(45.5, 115.5), (-10, 105.5)]
+
+
+def test_output_is_produced_in_chunks(monkeypatch):
+    monkeypatch.setattr(main, "EXPORT_CHUNK_ROWS", 2)
+    chunks = list(main.export_csv(main.export_rows(USER, None, None)))
+    # Header plus two rows, then two rows, then the last one
+    assert [chunk.count("\n") for chunk in chunks] == [3, 2, 1]
+    assert len(list(main.export_jsonl(main.export_rows(USER, None, None)))) == 3
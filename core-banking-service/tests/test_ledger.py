@@ -0,0 +1,71 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+import ledger
+from models import Account, LedgerEntry
+
+USER = 20001
+
+
+def transfer_body(to_account_number, amount):
+    return {"to_account_number": to_account_number, "amount": amount, "description": "x",
+            "beneficiary_cedula": "V1", "beneficiary_phone": "04121234567"}
+
+
+def test_money_is_whole_cents():
+    assert ledger.to_money(0.1 + 0.2) == Decimal("0.30")
+    assert ledger.is_money(10.25) and not ledger.is_money(10.255)
+
+
+def test_unbalanced_journals_are_refused(db):
+    with pytest.raises(ValueError):
+        ledger.post(db, "transfer", "x", [(1, Decimal("5.00")), (2, Decimal("-4.99"))])
+    db.rollback()
+
+
+def test_balance_at_a_past_time_with_and_without_snapshots(client, auth, open_account, db):
+    before_opening = datetime.datetime.utcnow()
+    me = open_account(USER, 100)
+    to = open_account(USER + 1)["account_number"]
+    account_id = db.query(Account.id).filter(Account.user_id == USER).scalar()
+    after_opening = datetime.datetime.utcnow()
+    client.post("/transfer", json=transfer_body(to, 30), headers=auth(USER))
+    after_first = datetime.datetime.utcnow()
+
+    assert ledger.take_snapshots(db, after_first) >= 2
+    assert ledger.take_snapshots(db, after_first) == 0  # nothing newer
+    client.post("/transfer", json=transfer_body(to, 12.5), headers=auth(USER))
+    now = datetime.datetime.utcnow()
+
+    expected = [(before_opening, 0), (after_opening, 100), (after_first, 70), (now, 57.5)]
+    for at, balance in expected:
+        assert ledger.balance_at(db, account_id, at) == ledger.to_money(balance)
+        # Same as summing every entry
+        full = sum(e.amount for e in db.query(LedgerEntry).filter(
+            LedgerEntry.account_id == account_id, LedgerEntry.created_at <= at))
+        assert ledger.to_money(full) == ledger.to_money(balance)
+
+    r = client.get("/accounts/me/balance", params={"as_of": after_first.isoformat()}, headers=auth(USER))
+    assert r.json() == {"account_number": me["account_number"], "balance": 70, "ledger_balance": 70,
+                        "held": 0, "as_of": after_first.isoformat()}
+    assert client.get("/accounts/me/balance", headers=auth(USER)).json()["balance"] == 57.5
+
+
+def test_verify_finds_a_balance_that_drifted(db, open_account):
+    open_account(USER + 10, 40)
+    report = ledger.verify(db)
+    assert report["unbalanced_journals"] == [] and report["mismatched_accounts"] == []
+
+    account = db.query(Account).filter(Account.user_id == USER + 10).one()
+    account.balance += 5
+    db.commit()
+    try:
+        report = ledger.verify(db)
+        assert report["mismatched_accounts"] == [
+            {"account_number": account.account_number, "balance": 45, "ledger_balance": 40}
+        ]
+    finally:
+        account.balance -= 5
+        db.commit()
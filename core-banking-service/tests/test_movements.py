@@ -0,0 +1,67 @@
+import datetime
+
+import pytest
+
+from models import Transaction
+from database import SessionLocal
+
+USER = 1001
+T0 = datetime.datetime(2026, 3, 1, 12, 0)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def movements():
+    db = SessionLocal()
+    # Two rows share a timestamp: the id breaks the tie
+    times = [T0, T0, T0 + datetime.timedelta(hours=1), T0 + datetime.timedelta(days=1),
+             T0 + datetime.timedelta(days=2), T0 + datetime.timedelta(days=3), T0 + datetime.timedelta(days=40)]
+    for i, at in enumerate(times):
+        kind = "purchase" if i % 2 else "transfer_in"
+        db.add(Transaction(user_id=USER, amount=(i + 1) * 10.0 * (-1 if i % 2 else 1), transaction_type=kind,
+                           description=f"tx {i}", timestamp=at))
+    db.add(Transaction(user_id=USER + 1, amount=1.0, transaction_type="create", description="someone else", timestamp=T0))
+    db.commit()
+    db.close()
+
+
+def pages(client, auth, path, **params):
+    seen, cursor = [], None
+    while True:
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get(path, params=params, headers=auth(USER))
+        assert r.status_code == 200, r.text
+        seen.append(r.json())
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            return seen
+
+
+@pytest.mark.parametrize("path", ["/movements", "/transactions", "/sync/movements"])
+def test_cursor_walks_every_row_once_newest_first(client, auth, path):
+    got = pages(client, auth, path, limit=3)
+    assert [len(page) for page in got] == [3, 3, 1]
+    rows = [tx for page in got for tx in page]
+    assert [tx["description"] for tx in rows] == ["tx 6", "tx 5", "tx 4", "tx 3", "tx 2", "tx 1", "tx 0"]
+    assert len({tx["id"] for tx in rows}) == 7
+
+
+def test_exact_last_page_has_no_cursor(client, auth):
+    r = client.get("/movements", params={"limit": 7}, headers=auth(USER))
+    assert len(r.json()) == 7
+    assert "X-Next-Cursor" not in r.headers
+
+
+def test_filters_combine_with_the_cursor(client, auth):
+    rows = [tx for page in pages(client, auth, "/movements", limit=1, transaction_type="transfer_in",
+                                 date_from=T0.isoformat(), date_to=(T0 + datetime.timedelta(days=30)).isoformat())
+            for tx in page]
+    assert [tx["description"] for tx in rows] == ["tx 4", "tx 2", "tx 0"]
+
+    r = client.get("/movements", params={"min_amount": -40, "max_amount": 20}, headers=auth(USER))
+    assert sorted(tx["amount"] for tx in r.json()) == [-40.0, -20.0, 10.0]
+
+
+def test_bad_cursor_is_a_400(client, auth):
+    r = client.get("/movements", params={"cursor": "not-a-cursor"}, headers=auth(USER))
+    assert r.status_code == 400
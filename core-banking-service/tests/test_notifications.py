@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+import threading
+import time
+
+from database import SessionLocal
+from models import Notification
+import main
+
+USER = 2001
+
+
+def notify(user_id, message, at=None):
+    db = SessionLocal()
+    n = Notification(user_id=user_id, title="Test", message=message, timestamp=at or datetime.datetime.utcnow())
+    db.add(n)
+    db.commit()
+    notification_id = n.id
+    db.close()
+    return notification_id
+
+
+def test_poll_answers_right_away_with_what_is_new(client, auth):
+    first = notify(USER, "one")
+    second = notify(USER, "two")
+    r = client.get("/notifications/poll", params={"since_id": first, "timeout": 0}, headers=auth(USER))
+    assert [n["id"] for n in r.json()] == [second]
+
+
+def test_poll_wakes_up_on_a_new_notification(client, auth):
+    user = USER + 1
+    since = notify(user, "before")
+    answer = {}
+
+    def poll():
+        started = time.monotonic()
+        answer["response"] = client.get("/notifications/poll", params={"since_id": since, "timeout": 20}, headers=auth(user))
+        answer["seconds"] = time.monotonic() - started
+
+    waiting = threading.Thread(target=poll)
+    waiting.start()
+    time.sleep(0.5)
+    new_id = notify(user, "after")
+    waiting.join(10)
+    assert [n["id"] for n in answer["response"].json()] == [new_id]
+    assert answer["seconds"] < 10
+
+
+def test_poll_times_out_empty(client, auth):
+    r = client.get("/notifications/poll", params={"since_id": 10 ** 9, "timeout": 1}, headers=auth(USER + 2))
+    assert r.status_code == 200 and r.json() == []
+
+
+class OneRound:
+    """Request that disconnects after the first pass of the SSE loop."""
+
+    def __init__(self):
+        self.checks = 0
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.checks > 1
+
+
+def test_stream_resumes_after_last_event_id():
+    # The test client buffers whole responses, so the generator is read directly
+    user = USER + 3
+    first = notify(user, "one")
+    second = notify(user, "two")
+
+    async def read():
+        response = await main.stream_notifications(OneRound(), 0, str(first), {"user_id": user})
+        return [chunk async for chunk in response.body_iterator]
+
+    events = asyncio.run(read())
+    assert len(events) == 1
+    assert events[0].startswith(f"id: {second}\nevent: notification\ndata: ")
+    assert '"message":"two"' in events[0]
+
+
+def test_unread_count_and_read_all_around_the_window(client, auth):
+    user = USER + 4
+    notify(user, "old", datetime.datetime.utcnow() - datetime.timedelta(days=200))
+    notify(user, "new")
+    r = client.get("/notifications", headers=auth(user))
+    assert [n["message"] for n in r.json()] == ["new"]
+    assert r.headers["X-Notification-Window-Days"] == "90"
+    assert client.get("/notifications/unread-count", headers=auth(user)).json() == {"unread": 1, "window_days": 90}
+
+    assert client.put("/notifications/read-all", headers=auth(user)).status_code == 200
+    assert client.get("/notifications/unread-count", headers=auth(user)).json()["unread"] == 0
+    db = SessionLocal()
+    # Read-all is not bound to the window
+    assert db.query(Notification).filter(Notification.user_id == user, Notification.is_read == 0).count() == 0
+    db.close()
@@ -0,0 +1,66 @@
+import threading
+
+import main
+import numbering
+from models import Account
+
+USER = 9001
+
+
+def luhn_valid(number: str) -> bool:
+    return numbering.luhn_check_digit(number[:-1]) == number[-1]
+
+
+def test_luhn_check_digit():
+    assert numbering.luhn_check_digit("7992739871") == "3"
+    assert numbering.luhn_check_digit("543210987654321") == "2"
+
+
+def test_formatted_numbers_are_distinct_and_well_formed():
+    accounts = {numbering.format_account_number(c) for c in range(20000)}
+    assert len(accounts) == 20000
+    assert all(len(n) == 10 and n[0] != "0" for n in accounts)
+    cards = [numbering.format_card_number(c) for c in range(20000)]
+    assert len(set(cards)) == 20000
+    for card in cards[:500]:
+        assert len(card) == 19 and card.startswith("52")
+        assert luhn_valid(card.replace(" ", ""))
+
+
+def test_workers_never_get_the_same_counter():
+    workers = [numbering.BlockAllocator("test_counter", block_size=7) for _ in range(4)]
+    taken = []
+
+    def take(allocator):
+        for count in [1, 3, 10, 2] * 5:
+            taken.extend(allocator.take(count))
+
+    threads = [threading.Thread(target=take, args=(w,)) for w in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    assert len(taken) == 4 * 80 and len(set(taken)) == len(taken)
+
+
+def test_legacy_numbers_are_skipped(db, monkeypatch):
+    legacy = numbering.format_account_number(10 ** 6)
+    db.add(Account(user_id=USER, account_number=legacy, balance=0))
+    db.commit()
+    offered = iter([[legacy, "1000000001"], ["1000000002"]])
+    numbers = main.allocate_free_numbers(db, Account.account_number, lambda n: next(offered)[:n], 2)
+    assert numbers == ["1000000001", "1000000002"]
+
+
+def test_onboarding_issues_unique_numbers_once(client, auth):
+    admin = auth(1, "admin")
+    users = list(range(USER + 1, USER + 51))
+    first = client.post("/admin/onboarding/issue", json={"user_ids": users, "issue_cards": True}, headers=admin).json()
+    assert len({row["account_number"] for row in first}) == 50
+    assert len({row["card_number"] for row in first}) == 50
+    assert all(luhn_valid(row["card_number"].replace(" ", "")) for row in first)
+
+    # Existing accounts are kept
+    again = client.post("/admin/onboarding/issue", json={"user_ids": users[:5], "issue_cards": False}, headers=admin).json()
+    assert [row["account_number"] for row in again] == [row["account_number"] for row in first[:5]]
+    assert client.post("/admin/onboarding/issue", json={"user_ids": [1], "issue_cards": False}, headers=auth(USER)).status_code == 403
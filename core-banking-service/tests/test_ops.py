@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+import database
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UNREACHABLE = "postgresql://postgres@127.0.0.1:1/bank_db"
+
+
+def test_metrics_endpoint(client, auth):
+    client.get("/movements", headers=auth(16001))
+    r = client.get("/metrics")
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_requests_total{method="GET",route="/movements",status="200"}' in r.text
+
+
+def test_ready_once_the_pools_are_warm(client):
+    for _ in range(50):
+        r = client.get("/readyz")
+        if r.status_code == 200:
+            break
+        time.sleep(0.1)
+    assert r.status_code == 200
+    assert r.json()["ready"] and r.json()["warm_up_seconds"] is not None
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+
+def test_waiting_for_the_database_ends_on_shutdown(monkeypatch):
+    readiness = database.Readiness()
+    monkeypatch.setattr(database, "readiness", readiness)
+    readiness.stopping.set()
+    started = time.monotonic()
+    assert database.wait_for_db(create_engine(UNREACHABLE), retry_interval=30) is False
+    assert time.monotonic() - started < 10
+    assert readiness.error
+
+
+STARTUP_SCRIPT = """
+from fastapi.testclient import TestClient
+import main
+with TestClient(main.app) as c:
+    print(c.get("/healthz").status_code, c.get("/readyz").status_code)
+"""
+
+
+def test_starts_and_stops_without_a_database():
+    env = {**os.environ, "DATABASE_URL": UNREACHABLE, "DB_CONNECT_RETRY_INTERVAL": "0.2"}
+    env.pop("ASYNC_DATABASE_URL", None)
+    run = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=SERVICE_DIR, env=env,
+                         capture_output=True, text=True, timeout=60)
+    assert run.returncode == 0, run.stderr
+    # Live right away, not ready
+    assert run.stdout.splitlines()[-1] == "200 503"
@@ -0,0 +1,83 @@
+import datetime
+import json
+
+import pytest
+
+import outbox
+from models import Notification, OutboxDelivery, OutboxEvent
+
+USER = 14001
+
+
+def transfer_body(to_account_number, amount):
+    return {"to_account_number": to_account_number, "amount": amount, "description": "x",
+            "beneficiary_cedula": "V1", "beneficiary_phone": "04121234567"}
+
+
+def drain():
+    worker = outbox.OutboxWorker(batch_size=50)
+    while worker.drain_once():
+        pass
+    return worker
+
+
+def received(db, user_id):
+    db.expire_all()
+    return db.query(Notification).filter(Notification.user_id == user_id).count()
+
+
+def test_transfer_notification_is_delivered_once(client, auth, open_account, db):
+    open_account(USER, 100)
+    to = open_account(USER + 1)["account_number"]
+    client.post("/transfer", json=transfer_body(to, 10), headers=auth(USER))
+    # Nothing is sent inside the transfer itself
+    assert received(db, USER + 1) == 0
+    [event] = [e for e in db.query(OutboxEvent).filter(OutboxEvent.processed_at.is_(None))
+               if json.loads(e.payload)["to_user_id"] == USER + 1]
+
+    drain()
+    assert received(db, USER + 1) == 1
+    db.refresh(event)
+    assert event.processed_at is not None
+    assert db.get(OutboxDelivery, ("notifications", event.id)) is not None
+
+    # Redelivered, e.g. the worker died before marking it: the consumer skips it
+    event.processed_at = None
+    db.commit()
+    drain()
+    assert received(db, USER + 1) == 1
+
+
+@pytest.fixture
+def failing_consumer(monkeypatch):
+    def handle(db, events):
+        for event in events:
+            if json.loads(event.payload).get("fail"):
+                raise ValueError("bad payload")
+    monkeypatch.setitem(outbox.CONSUMERS, "test", ({"test.event"}, handle))
+
+
+def test_bad_events_back_off_then_park(db, failing_consumer):
+    outbox.enqueue(db, "test.event", {"fail": True})
+    outbox.enqueue(db, "test.event", {"fail": False})
+    db.commit()
+    bad, good = db.query(OutboxEvent).filter(OutboxEvent.event_type == "test.event").order_by(OutboxEvent.id).all()[-2:]
+
+    worker = drain()
+    db.expire_all()
+    # The rest of the batch went through
+    assert good.processed_at is not None and worker.failed == 1
+    assert (bad.processed_at, bad.attempts, bad.last_error) == (None, 1, "ValueError('bad payload')")
+    assert bad.next_attempt_at > datetime.datetime.utcnow()
+    drain()
+    db.expire_all()
+    assert bad.attempts == 1  # still backing off
+
+    bad.attempts = outbox.OUTBOX_MAX_ATTEMPTS - 1
+    bad.next_attempt_at = None
+    db.commit()
+    drain()
+    db.expire_all()
+    assert bad.attempts == outbox.OUTBOX_MAX_ATTEMPTS and bad.processed_at is None
+    assert outbox.backlog_stats(db)["parked"] >= 1
+    assert bad.id not in [e.id for e in db.scalars(outbox.pending_stmt(1000))]
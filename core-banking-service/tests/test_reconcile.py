@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+import reconcile
+from models import Account, Transaction
+
+USER = 21001
+
+
+def transfer_body(to_account_number, amount):
+    return {"to_account_number": to_account_number, "amount": amount, "description": "recon",
+            "beneficiary_cedula": "V1", "beneficiary_phone": "04121234567"}
+
+
+def mine(status, account_ids):
+    return sorted((d["kind"], d["account_id"], d["counterparty_account_id"], d["expected"], d["actual"])
+                  for d in status["items"] if d["account_id"] in account_ids)
+
+
+@pytest.fixture(scope="module")
+def damaged(client, auth, open_account):
+    """Three accounts: one balance changed by hand, one transfer_in leg lost."""
+    from database import SessionLocal
+    open_account(USER, 100)
+    open_account(USER + 1, 100)
+    to = open_account(USER + 2)["account_number"]
+    client.post("/transfer", json=transfer_body(to, 25), headers=auth(USER + 1))
+    db = SessionLocal()
+    ids = dict(db.query(Account.user_id, Account.id).filter(Account.user_id.between(USER, USER + 2)))
+    drifted = db.query(Account).filter(Account.user_id == USER).one()
+    drifted.balance += 7
+    lost = db.query(Transaction).filter(Transaction.user_id == USER + 2, Transaction.transaction_type == "transfer_in").one()
+    lost_row = {c.name: getattr(lost, c.name) for c in Transaction.__table__.columns}
+    db.delete(lost)
+    db.commit()
+    yield ids
+    drifted.balance -= 7
+    db.add(Transaction(**lost_row))
+    db.commit()
+    db.close()
+
+
+def test_run_finds_the_planted_discrepancies(db, damaged):
+    run_id = reconcile.create_run(db, range_size=3)
+    status = reconcile.execute(run_id, workers=2)
+    assert status["status"] == "done" and status["ranges_done"] == status["total_ranges"] > 1
+    sender, receiver = damaged[USER + 1], damaged[USER + 2]
+    assert mine(reconcile.run_status(db, run_id, limit=1000), set(damaged.values())) == [
+        ("balance", damaged[USER], None, 100, 107),
+        ("balance", receiver, None, 0, 25),
+        ("unmatched_transfer", sender, receiver, 25, 0),
+    ]
+
+
+def test_failed_ranges_are_resumed(db, damaged, monkeypatch):
+    run_id = reconcile.create_run(db, range_size=3)
+    check_range = reconcile.check_range
+
+    def flaky(run_id, range_id, first_id, last_id):
+        if first_id <= damaged[USER] <= last_id:
+            raise ConnectionError("lost the database")
+        return check_range(run_id, range_id, first_id, last_id)
+
+    monkeypatch.setattr(reconcile, "check_range", flaky)
+    status = reconcile.execute(run_id, workers=2)
+    assert status["status"] == "incomplete" and status["ranges_done"] == status["total_ranges"] - 1
+    assert mine(status, {damaged[USER]}) == []
+
+    monkeypatch.setattr(reconcile, "check_range", check_range)
+    status = reconcile.execute(run_id, workers=2)
+    assert status["status"] == "done" and status["ranges_done"] == status["total_ranges"]
+    assert [d[0] for d in mine(reconcile.run_status(db, run_id, limit=1000), {damaged[USER]})] == ["balance"]
+
+
+def test_admin_api_runs_in_the_background(client, auth, damaged):
+    admin = auth(1, "admin")
+    assert client.post("/admin/reconciliations", headers=auth(USER)).status_code == 403
+    started = client.post("/admin/reconciliations", params={"range_size": 100, "workers": 2}, headers=admin)
+    assert started.status_code == 202
+    run_id = started.json()["id"]
+    for _ in range(100):
+        status = client.get(f"/admin/reconciliations/{run_id}", params={"limit": 1000}, headers=admin).json()
+        if status["status"] != "running":
+            break
+        time.sleep(0.05)
+    assert status["status"] == "done"
+    assert len(mine(status, set(damaged.values()))) == 3
+    assert client.get("/admin/reconciliations/999999", headers=admin).status_code == 404
@@ -0,0 +1,21 @@
+USER = 13001
+
+
+def test_account_etag_changes_after_a_transfer(client, auth, open_account):
+    open_account(USER, 50, card=True)
+    to = open_account(USER + 1)["account_number"]
+    me = auth(USER)
+    for path in ["/accounts/me", "/cards/me", "/beneficiaries"]:
+        r = client.get(path, headers=me)
+        assert r.status_code == 200 and "ETag" in r.headers, path
+        assert client.get(path, headers={**me, "If-None-Match": r.headers["ETag"]}).status_code == 304, path
+
+    etag = client.get("/accounts/me", headers=me).headers["ETag"]
+    assert client.get("/accounts/me", headers=auth(USER + 1)).json()["balance"] == 0
+    body = {"to_account_number": to, "amount": 20, "description": "x",
+            "beneficiary_cedula": "V1", "beneficiary_phone": "04121234567"}
+    assert client.post("/transfer", json=body, headers=me).status_code == 200
+    r = client.get("/accounts/me", headers={**me, "If-None-Match": etag})
+    assert r.status_code == 200 and r.json()["balance"] == 30
+    # The receiver's cached account was dropped too
+    assert client.get("/accounts/me", headers=auth(USER + 1)).json()["balance"] == 20
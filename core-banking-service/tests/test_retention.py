@@ -0,0 +1,44 @@
+"""Retention on plain tables (SQLite); the partitioned path is in test_partitions.py."""
+import datetime
+import gzip
+import json
+
+import pytest
+from sqlalchemy import insert
+
+import partitions
+from models import Notification
+
+USER = 25001
+
+
+def test_cutoff_is_whole_months_back():
+    now = datetime.datetime(2026, 3, 18, 12)
+    assert partitions.retention_cutoff(12, now) == datetime.datetime(2025, 3, 1)
+    assert partitions.add_months(datetime.datetime(2026, 1, 1), -13) == datetime.datetime(2024, 12, 1)
+
+
+def test_expired_rows_are_archived_and_deleted_in_batches(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(partitions, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(partitions, "ARCHIVE_BATCH_SIZE", 2)
+    table = Notification.__table__
+    if partitions.is_partitioned(db.connection(), table):
+        pytest.skip("partitioned: retention drops partitions")
+    now = datetime.datetime.utcnow()
+    cutoff = partitions.retention_cutoff(12, now)
+    old = cutoff - datetime.timedelta(days=20)
+    db.execute(insert(Notification), [
+        dict(user_id=USER, title="t", message=str(i), is_read=0, timestamp=old) for i in range(5)
+    ] + [dict(user_id=USER, title="t", message="recent", is_read=0, timestamp=now)])
+    db.commit()
+
+    assert partitions.delete_expired_rows(db, table, cutoff, dry_run=True)[0]["rows"] == 5
+    done = partitions.delete_expired_rows(db, table, cutoff)
+    assert [d["rows"] for d in done] == [5]
+    with gzip.open(done[0]["file"], "rt", encoding="utf-8") as archived:
+        assert sorted(json.loads(line)["message"] for line in archived) == ["0", "1", "2", "3", "4"]
+    assert [n.message for n in db.query(Notification).filter(Notification.user_id == USER)] == ["recent"]
+    assert partitions.delete_expired_rows(db, table, cutoff) == []
+
+    notifications = partitions.status()["notifications"]
+    assert notifications["partitioned"] is False and notifications["oldest"] >= cutoff.isoformat()
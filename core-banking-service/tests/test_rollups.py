@@ -0,0 +1,61 @@
+import datetime
+
+from sqlalchemy import insert
+
+import rollups
+from models import Transaction, TransactionRollup
+
+USER = 12001
+JAN = datetime.datetime(2026, 1, 30, 10)
+FEB = datetime.datetime(2026, 2, 2, 10)
+
+
+def rows(db, user_id):
+    db.expire_all()
+    return sorted(
+        (r.period, r.period_start, r.transaction_type, r.count, r.total, r.inflow, r.outflow)
+        for r in db.query(TransactionRollup).filter(TransactionRollup.user_id == user_id)
+    )
+
+
+def write(db, user_id, amount, kind, at):
+    row = dict(user_id=user_id, amount=amount, transaction_type=kind, description="r", timestamp=at)
+    db.execute(insert(Transaction), [row])
+    rollups.apply_rollups(db, [row])
+    db.commit()
+
+
+def test_writes_upsert_day_and_month(db):
+    write(db, USER, 50, "transfer_in", JAN)
+    write(db, USER, 20, "transfer_in", JAN)
+    write(db, USER, -5, "transfer_in", FEB)
+    assert rows(db, USER) == [
+        ("day", datetime.date(2026, 1, 30), "transfer_in", 2, 70, 70, 0),
+        ("day", datetime.date(2026, 2, 2), "transfer_in", 1, -5, 0, 5),
+        ("month", datetime.date(2026, 1, 1), "transfer_in", 2, 70, 70, 0),
+        ("month", datetime.date(2026, 2, 1), "transfer_in", 1, -5, 0, 5),
+    ]
+
+
+def test_backfill_matches_the_incremental_rollups(db):
+    for i, (amount, kind) in enumerate([(100, "create"), (-30, "purchase"), (-12.5, "purchase"), (7, "transfer_in")]):
+        write(db, USER + 1, amount, kind, JAN + datetime.timedelta(days=i))
+    incremental = rows(db, USER + 1)
+    # Lost rollups, e.g. written before the table existed
+    db.query(TransactionRollup).filter(TransactionRollup.user_id == USER + 1).delete()
+    db.commit()
+    rollups.rebuild_range(USER + 1, USER + 1)
+    assert rows(db, USER + 1) == incremental
+    assert rows(db, USER) != []  # other users are left alone
+
+
+def test_transfers_keep_the_summary_current(client, auth, open_account):
+    open_account(USER + 10, 100)
+    to = open_account(USER + 11)["account_number"]
+    body = {"to_account_number": to, "amount": 40, "description": "x",
+            "beneficiary_cedula": "V1", "beneficiary_phone": "04121234567"}
+    client.post("/transfer", json=body, headers=auth(USER + 10))
+    summary = client.get("/analytics/summary", params={"period": "day"}, headers=auth(USER + 10)).json()
+    [today] = summary["periods"]
+    assert (today["count"], today["inflow"], today["outflow"], today["net"]) == (2, 100, 40, 60)
+    assert today["by_type"]["transfer_out"] == {"count": 1, "total": -40}
@@ -0,0 +1,89 @@
+import datetime
+
+import pytest
+
+import scheduler
+from models import Notification, ScheduledTransfer
+
+USER = 23001
+
+
+@pytest.fixture(autouse=True)
+def no_window(monkeypatch):
+    # Orders run right at their occurrence
+    monkeypatch.setattr(scheduler, "SCHEDULED_TRANSFER_WINDOW", 0)
+
+
+def create(client, auth, user_id, to, amount, frequency, starts_at=None):
+    starts_at = starts_at or datetime.datetime.utcnow()
+    r = client.post("/scheduled-transfers", headers=auth(user_id), json={
+        "to_account_number": to, "amount": amount, "frequency": frequency, "starts_at": starts_at.isoformat(),
+    })
+    assert r.status_code == 201, r.text
+    return r.json()
+
+
+def backdate(db, order_id, days):
+    order = db.get(ScheduledTransfer, order_id)
+    order.starts_at -= datetime.timedelta(days=days)
+    scheduler.schedule_next(order)
+    db.commit()
+
+
+def balance(client, auth, user_id):
+    return client.get("/accounts/me", headers=auth(user_id)).json()["balance"]
+
+
+def test_months_keep_the_day_or_take_the_last_one():
+    jan31 = datetime.datetime(2026, 1, 31, 9, 30)
+    assert scheduler.add_months(jan31, 1) == datetime.datetime(2026, 2, 28, 9, 30)
+    assert scheduler.add_months(jan31, 2) == datetime.datetime(2026, 3, 31, 9, 30)
+    assert scheduler.add_months(jan31, 12) == datetime.datetime(2027, 1, 31, 9, 30)
+
+
+def test_due_orders_run_and_catch_up(client, auth, open_account, db):
+    open_account(USER, 100)
+    to = open_account(USER + 1)["account_number"]
+    order = create(client, auth, USER, to, 10, "daily")
+    assert order["next_run_at"] == order["starts_at"]
+    backdate(db, order["id"], 3)
+
+    report = scheduler.run_due()
+    assert (report["executed"], report["failed"]) == (4, 0)
+    assert balance(client, auth, USER) == 60 and balance(client, auth, USER + 1) == 40
+
+    order = client.get(f"/scheduled-transfers/{order['id']}", headers=auth(USER)).json()
+    assert order["occurrences_done"] == 4 and order["last_status"] == "ok"
+    starts_at = datetime.datetime.fromisoformat(order["starts_at"])
+    assert datetime.datetime.fromisoformat(order["next_run_at"]) == starts_at + datetime.timedelta(days=4)
+    assert scheduler.run_due()["executed"] == 0
+    assert client.get("/admin/scheduler/runs", params={"limit": 1}, headers=auth(1, "admin")).json()[0]["executed"] == 0
+
+
+def test_unaffordable_orders_fail_and_notify(client, auth, open_account, db):
+    open_account(USER + 2, 5)
+    order = create(client, auth, USER + 2, open_account(USER + 3)["account_number"], 10, "once")
+    assert scheduler.run_due()["failed"] == 1
+    order = client.get(f"/scheduled-transfers/{order['id']}", headers=auth(USER + 2)).json()
+    assert (order["status"], order["last_status"], order["last_error"]) == ("done", "failed", "Insufficient funds")
+    assert balance(client, auth, USER + 2) == 5
+    assert db.query(Notification).filter(Notification.user_id == USER + 2, Notification.title == "Transferencia Programada Fallida").count() == 1
+
+
+def test_resumed_orders_skip_what_they_missed(client, auth, open_account, db):
+    open_account(USER + 4, 100)
+    order = create(client, auth, USER + 4, open_account(USER + 5)["account_number"], 10, "daily")
+    paused = client.patch(f"/scheduled-transfers/{order['id']}", json={"status": "paused"}, headers=auth(USER + 4)).json()
+    assert paused["status"] == "paused" and paused["next_run_at"] is None
+    backdate(db, order["id"], 3)
+    assert scheduler.run_due()["executed"] == 0
+
+    resumed = client.patch(f"/scheduled-transfers/{order['id']}", json={"status": "active"}, headers=auth(USER + 4)).json()
+    assert resumed["occurrences_done"] == 4
+    assert datetime.datetime.fromisoformat(resumed["next_run_at"]) > datetime.datetime.utcnow()
+    assert scheduler.run_due()["executed"] == 0
+    assert balance(client, auth, USER + 4) == 100
+
+    cancelled = client.delete(f"/scheduled-transfers/{order['id']}", headers=auth(USER + 4)).json()
+    assert cancelled["status"] == "cancelled"
+    assert client.patch(f"/scheduled-transfers/{order['id']}", json={"amount": 1}, headers=auth(USER + 4)).status_code == 409
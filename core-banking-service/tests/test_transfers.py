@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from database import SessionLocal
+from models import Account, IdempotencyKey, Transaction
+from transfers import post_transfer
+
+USER = 3001
+
+
+def transfer_body(to_account_number, amount, description="Test"):
+    return {"to_account_number": to_account_number, "amount": amount, "description": description,
+            "beneficiary_cedula": "V12345678", "beneficiary_phone": "04121234567"}
+
+
+def balance(user_id):
+    db = SessionLocal()
+    try:
+        return db.query(Account.balance).filter(Account.user_id == user_id).scalar()
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def accounts(open_account):
+    return open_account(USER, 100), open_account(USER + 1, 100)
+
+
+@pytest.mark.parametrize("path", ["/transfer", "/sync/transfer"])
+def test_idempotency_key_replays_the_first_answer(client, auth, accounts, path):
+    _, to = accounts
+    key = {"Idempotency-Key": "pay-" + path, **auth(USER)}
+    before = balance(USER)
+    first = client.post(path, json=transfer_body(to["account_number"], 5), headers=key)
+    again = client.post(path, json=transfer_body(to["account_number"], 5), headers=key)
+    assert first.status_code == again.status_code == 200
+    assert again.json() == first.json() == {"message": "Transfer successful", "new_balance": before - 5}
+    assert balance(USER) == before - 5
+
+    reused = client.post(path, json=transfer_body(to["account_number"], 6), headers=key)
+    assert reused.status_code == 422
+
+
+def test_failed_transfers_leave_nothing_behind(client, auth, accounts, db):
+    sender, to = accounts
+    before = balance(USER), balance(USER + 1)
+    cases = [
+        (transfer_body(to["account_number"], 10 ** 6), 400, "Insufficient funds"),
+        (transfer_body(to["account_number"], -1), 400, "Amount must be positive"),
+        (transfer_body(to["account_number"], 0.001), 400, "Amount must be in whole cents"),
+        (transfer_body(sender["account_number"], 1), 400, "Cannot transfer to the same account"),
+        (transfer_body("0000000000", 1), 404, "Destination account not found"),
+    ]
+    for i, (body, status, detail) in enumerate(cases):
+        r = client.post("/transfer", json=body, headers={"Idempotency-Key": f"bad-{i}", **auth(USER)})
+        assert (r.status_code, r.json()["detail"]) == (status, detail)
+    assert (balance(USER), balance(USER + 1)) == before
+    # A failed request does not burn its key
+    assert db.query(IdempotencyKey).filter(IdempotencyKey.key.like("bad-%")).count() == 0
+
+
+def test_both_legs_are_logged(client, auth, accounts, db):
+    sender, to = accounts
+    client.post("/transfer", json=transfer_body(to["account_number"], 3, "legs"), headers=auth(USER))
+    legs = db.query(Transaction.user_id, Transaction.amount, Transaction.transaction_type).filter(
+        Transaction.description.like("% - legs")
+    ).order_by(Transaction.amount).all()
+    assert legs == [(USER, -3, "transfer_out"), (USER + 1, 3, "transfer_in")]
+
+
+def test_opposite_concurrent_transfers_keep_the_total(open_account):
+    a = open_account(USER + 10, 50)
+    b = open_account(USER + 11, 50)
+    errors = []
+
+    def pay(from_user, to_number):
+        db = SessionLocal()
+        try:
+            for _ in range(10):
+                post_transfer(db, from_user, to_number, 1)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=pay, args=(USER + 10, b["account_number"])),
+               threading.Thread(target=pay, args=(USER + 11, a["account_number"]))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+    assert errors == []
+    assert (balance(USER + 10), balance(USER + 11)) == (50, 50)
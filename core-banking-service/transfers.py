@@ -0,0 +1,396 @@
+from fastapi import HTTPException
+from sqlalchemy import update, insert, bindparam
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from models import Account, Transaction, IdempotencyKey
+from bankcommon.cache import response_cache
+import outbox
+import ledger
+from rollups import apply_rollups
+from collections import namedtuple
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import time
+
+# Transfer engine shared by /transfer and anything else that moves money between accounts.
+# Balances are changed with atomic UPDATEs taken in account id order, so concurrent
+# transfers never lose updates and two opposite transfers cannot deadlock each other.
+# Every movement also posts its double-entry journal (ledger.py) in the same transaction.
+
+MAX_RETRIES = int(os.getenv("TRANSFER_MAX_RETRIES", "5"))
+RETRY_BASE_DELAY = float(os.getenv("TRANSFER_RETRY_BASE_DELAY", "0.01"))
+BATCH_CHUNK_SIZE = int(os.getenv("TRANSFER_BATCH_CHUNK_SIZE", "500"))
+
+# Postgres serialization_failure / deadlock_detected
+RETRYABLE_PGCODES = {"40001", "40P01"}
+
+
+def is_retryable(exc: DBAPIError) -> bool:
+    if getattr(exc.orig, "pgcode", None) in RETRYABLE_PGCODES:
+        return True
+    # SQLite (benchmarks/dev) reports lock contention as "database is locked"
+    return "database is locked" in str(exc.orig)
+
+
+def debit(db: Session, account_id: int, amount: float):
+    """Atomic debit, only applied if funds are enough. Returns the new balance or None."""
+    stmt = (
+        update(Account)
+        .where(Account.id == account_id, Account.balance >= amount)
+        .values(balance=Account.balance - amount)
+        .returning(Account.balance)
+    )
+    return db.execute(stmt).scalar()
+
+
+def credit(db: Session, account_id: int, amount: float):
+    stmt = (
+        update(Account)
+        .where(Account.id == account_id)
+        .values(balance=Account.balance + amount)
+        .returning(Account.balance)
+    )
+    return db.execute(stmt).scalar()
+
+
+def request_hash(to_account_number: str, amount: float, description: str) -> str:
+    raw = json.dumps([to_account_number, amount, description])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def find_idempotent_response(db: Session, user_id: int, key: str, req_hash: str):
+    record = db.query(IdempotencyKey).filter(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key).first()
+    if not record:
+        return None
+    if record.request_hash != req_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request")
+    return json.loads(record.response)
+
+
+def transfer_event(from_account, to_account, amount: float, description: str, now: datetime.datetime) -> dict:
+    return {
+        "from_user_id": from_account.user_id,
+        "from_account_number": from_account.account_number,
+        "to_user_id": to_account.user_id,
+        "to_account_number": to_account.account_number,
+        "amount": amount,
+        "description": description,
+        "timestamp": now.isoformat(),
+    }
+
+
+def apply_transfer(db: Session, from_account: Account, to_account: Account, amount: float, description: str):
+    """Moves the money and writes the ledger rows. Does not commit."""
+    # Lock order is always by account id
+    new_balance = None
+    for account_id in sorted([from_account.id, to_account.id]):
+        if account_id == from_account.id:
+            new_balance = debit(db, from_account.id, amount)
+            if new_balance is None:
+                raise HTTPException(status_code=400, detail="Insufficient funds")
+        else:
+            credit(db, to_account.id, amount)
+
+    now = datetime.datetime.utcnow()
+    money = ledger.to_money(amount)
+    ledger.post(db, "transfer", description, [(from_account.id, -money), (to_account.id, money)], now)
+    # Sender Log
+    tx_out = dict(
+        user_id=from_account.user_id,
+        amount=-amount,
+        transaction_type="transfer_out",
+        description=f"Transfer to {to_account.account_number} - {description}",
+        related_account_id=to_account.id, # Internal ID tracking
+        timestamp=now,
+    )
+    # Receiver Log
+    tx_in = dict(
+        user_id=to_account.user_id,
+        amount=amount,
+        transaction_type="transfer_in",
+        description=f"Received from {from_account.account_number} - {description}",
+        related_account_id=from_account.id,
+        timestamp=now,
+    )
+    db.add(Transaction(**tx_out))
+    db.add(Transaction(**tx_in))
+    apply_rollups(db, [tx_out, tx_in])
+    # Receiver notification and any other side effect run from the outbox
+    outbox.enqueue(db, "transfer.completed", transfer_event(from_account, to_account, amount, description, now))
+    return new_balance
+
+
+def apply_deposit(db: Session, account: Account, amount: float, description: str):
+    """Cash in at a branch, against the SYS-MINT system account. Does not commit."""
+    mint_id = ledger.system_account_id(db, "mint")
+    new_balance = credit(db, account.id, amount)
+
+    now = datetime.datetime.utcnow()
+    money = ledger.to_money(amount)
+    ledger.post(db, "deposit", description, [(mint_id, -money), (account.id, money)], now)
+    tx_deposit = dict(
+        user_id=account.user_id,
+        amount=amount,
+        transaction_type="deposit",
+        description=description,
+        timestamp=now,
+    )
+    db.add(Transaction(**tx_deposit))
+    apply_rollups(db, [tx_deposit])
+    return new_balance
+
+
+def check_amount(amount: float):
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    if not ledger.is_money(amount):
+        raise HTTPException(status_code=400, detail="Amount must be in whole cents")
+
+
+def retry_delay(attempt: int) -> float:
+    # Bounded exponential backoff with jitter
+    return RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random())
+
+
+def post_transfer(db: Session, from_user_id: int, to_account_number: str, amount: float,
+                  description: str = "Transferencia", idempotency_key: str = None) -> dict:
+    for attempt in range(MAX_RETRIES):
+        result = try_transfer(db, from_user_id, to_account_number, amount, description, idempotency_key, attempt)
+        if result is not None:
+            return result
+        time.sleep(retry_delay(attempt))
+
+
+async def post_transfer_async(db: AsyncSession, from_user_id: int, to_account_number: str, amount: float,
+                              description: str = "Transferencia", idempotency_key: str = None) -> dict:
+    """post_transfer for the async router: waits between retries without blocking the event loop."""
+    for attempt in range(MAX_RETRIES):
+        result = await db.run_sync(
+            try_transfer, from_user_id, to_account_number, amount, description, idempotency_key, attempt
+        )
+        if result is not None:
+            return result
+        await asyncio.sleep(retry_delay(attempt))
+
+
+def try_transfer(db: Session, from_user_id: int, to_account_number: str, amount: float,
+                 description: str, idempotency_key: str, attempt: int):
+    """One attempt. Returns None after a retryable conflict (rolled back) while attempts remain."""
+    req_hash = request_hash(to_account_number, amount, description)
+    if attempt == 0:
+        check_amount(amount)
+        if idempotency_key:
+            previous = find_idempotent_response(db, from_user_id, idempotency_key, req_hash)
+            if previous is not None:
+                return previous
+
+    try:
+        from_account = db.query(Account).filter(Account.user_id == from_user_id).first()
+        if not from_account:
+            raise HTTPException(status_code=404, detail="Origin account not found")
+        to_account = db.query(Account).filter(Account.account_number == to_account_number).first()
+        if not to_account or to_account.user_id is None:
+            raise HTTPException(status_code=404, detail="Destination account not found")
+        if to_account.id == from_account.id:
+            raise HTTPException(status_code=400, detail="Cannot transfer to the same account")
+        to_user_id = to_account.user_id
+
+        new_balance = apply_transfer(db, from_account, to_account, amount, description)
+        result = {"message": "Transfer successful", "new_balance": new_balance}
+
+        if idempotency_key:
+            db.add(IdempotencyKey(
+                user_id=from_user_id,
+                key=idempotency_key,
+                request_hash=req_hash,
+                response=json.dumps(result),
+            ))
+        db.commit()
+        response_cache.invalidate("account", from_user_id, to_user_id)
+        outbox.wake()
+        return result
+    except HTTPException:
+        db.rollback()
+        raise
+    except IntegrityError:
+        db.rollback()
+        # A concurrent retry with the same key won the race, answer with its result
+        if idempotency_key:
+            previous = find_idempotent_response(db, from_user_id, idempotency_key, req_hash)
+            if previous is not None:
+                return previous
+        raise
+    except DBAPIError as e:
+        db.rollback()
+        if not is_retryable(e) or attempt == MAX_RETRIES - 1:
+            raise
+        return None
+
+
+# ---- Batch transfers (payroll / mass disbursement) ----
+
+# Plain snapshot of an account row; ORM rows expire on every chunk commit
+AccountRef = namedtuple("AccountRef", "id user_id account_number")
+
+accounts_table = Account.__table__
+credit_many_stmt = (
+    update(accounts_table)
+    .where(accounts_table.c.id == bindparam("b_account_id"))
+    .values(balance=accounts_table.c.balance + bindparam("b_amount"))
+)
+
+
+def apply_batch(db: Session, from_account: AccountRef, items: list, description: str, chunk_size: int):
+    """Debits the sender once for all items and credits every destination.
+
+    items are (index, AccountRef, amount). Does not commit.
+    """
+    total = sum(amount for _, _, amount in items)
+    credits = sorted(
+        ({"b_account_id": to_acc.id, "b_amount": amount} for _, to_acc, amount in items),
+        key=lambda c: c["b_account_id"],
+    )
+    # Same lock order as single transfers: lower account ids first
+    lower = [c for c in credits if c["b_account_id"] < from_account.id]
+    higher = [c for c in credits if c["b_account_id"] > from_account.id]
+    for i in range(0, len(lower), chunk_size):
+        db.execute(credit_many_stmt, lower[i:i + chunk_size])
+    new_balance = debit(db, from_account.id, total)
+    if new_balance is None:
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    for i in range(0, len(higher), chunk_size):
+        db.execute(credit_many_stmt, higher[i:i + chunk_size])
+
+    now = datetime.datetime.utcnow()
+    tx_rows = []
+    for _, to_acc, amount in items:
+        tx_rows.append(dict(
+            user_id=from_account.user_id, amount=-amount, transaction_type="transfer_out",
+            description=f"Transfer to {to_acc.account_number} - {description}",
+            related_account_id=to_acc.id, timestamp=now,
+        ))
+        tx_rows.append(dict(
+            user_id=to_acc.user_id, amount=amount, transaction_type="transfer_in",
+            description=f"Received from {from_account.account_number} - {description}",
+            related_account_id=from_account.id, timestamp=now,
+        ))
+    for i in range(0, len(tx_rows), chunk_size):
+        db.execute(insert(Transaction), tx_rows[i:i + chunk_size])
+    ledger.post_many(db, "transfer", (
+        (description, [(from_account.id, -ledger.to_money(amount)), (to_acc.id, ledger.to_money(amount))])
+        for _, to_acc, amount in items
+    ), now, chunk_size)
+    apply_rollups(db, tx_rows)
+    outbox.enqueue_many(db, "transfer.completed", (
+        transfer_event(from_account, to_acc, amount, description, now) for _, to_acc, amount in items
+    ), chunk_size)
+    return new_balance
+
+
+def post_batch_transfer(db: Session, from_user_id: int, items: list, description: str = "Pago",
+                        all_or_nothing: bool = True, chunk_size: int = BATCH_CHUNK_SIZE) -> dict:
+    """items are (to_account_number, amount) pairs. Returns a per-item report."""
+    sender = db.query(Account).filter(Account.user_id == from_user_id).first()
+    if not sender:
+        raise HTTPException(status_code=404, detail="Origin account not found")
+    from_account = AccountRef(sender.id, sender.user_id, sender.account_number)
+    new_balance = sender.balance
+
+    # Resolve every destination in a single IN query
+    numbers = {number for number, _ in items}
+    rows = db.query(Account.id, Account.user_id, Account.account_number).filter(
+        Account.account_number.in_(numbers), Account.user_id.isnot(None)
+    )
+    destinations = {row.account_number: AccountRef(*row) for row in rows}
+
+    results = [None] * len(items)
+    valid = []
+    for i, (number, amount) in enumerate(items):
+        to_acc = destinations.get(number)
+        if amount <= 0:
+            error = "Amount must be positive"
+        elif not ledger.is_money(amount):
+            error = "Amount must be in whole cents"
+        elif not to_acc:
+            error = "Destination account not found"
+        elif to_acc.id == from_account.id:
+            error = "Cannot transfer to the same account"
+        else:
+            valid.append((i, to_acc, amount))
+            continue
+        results[i] = {"index": i, "to_account_number": number, "amount": amount, "status": "error", "detail": error}
+
+    def mark(chunk, status, detail=None):
+        for i, to_acc, amount in chunk:
+            results[i] = {"index": i, "to_account_number": to_acc.account_number, "amount": amount, "status": status, "detail": detail}
+
+    credited_users = set()
+
+    if all_or_nothing:
+        if len(valid) < len(items):
+            mark(valid, "skipped", "Batch rejected")
+            raise HTTPException(status_code=400, detail={"message": "Batch rejected", "results": results})
+        try:
+            if valid:
+                new_balance = apply_batch(db, from_account, valid, description, chunk_size)
+            db.commit()
+        except HTTPException as e:
+            db.rollback()
+            mark(valid, "skipped", e.detail)
+            raise HTTPException(status_code=e.status_code, detail={"message": e.detail, "results": results})
+        except Exception:
+            db.rollback()
+            raise
+        mark(valid, "ok")
+        credited_users.update(to_acc.user_id for _, to_acc, _ in valid)
+    else:
+        # Best effort: each chunk commits on its own; a chunk without funds is skipped
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start:start + chunk_size]
+            try:
+                new_balance = apply_batch(db, from_account, chunk, description, chunk_size)
+                db.commit()
+            except HTTPException as e:
+                db.rollback()
+                # Short of funds: still pay the items that fit, in request order
+                balance = db.query(Account.balance).filter(Account.id == from_account.id).scalar()
+                affordable = []
+                for entry in chunk:
+                    if entry[2] > balance:
+                        break
+                    balance -= entry[2]
+                    affordable.append(entry)
+                mark(chunk[len(affordable):], "error", e.detail)
+                if not affordable:
+                    continue
+                chunk = affordable
+                try:
+                    new_balance = apply_batch(db, from_account, chunk, description, chunk_size)
+                    db.commit()
+                except HTTPException as e:
+                    db.rollback()
+                    mark(chunk, "error", e.detail)
+                    continue
+            except DBAPIError:
+                db.rollback()
+                mark(chunk, "error", "Database error")
+                continue
+            mark(chunk, "ok")
+            credited_users.update(to_acc.user_id for _, to_acc, _ in chunk)
+
+    response_cache.invalidate("account", from_user_id, *credited_users)
+    outbox.wake()
+
+    succeeded = [r for r in results if r["status"] == "ok"]
+    return {
+        "processed": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "total_debited": sum(r["amount"] for r in succeeded),
+        "new_balance": new_balance,
+        "results": results,
+    }
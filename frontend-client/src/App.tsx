@@ -25,12 +25,19 @@ export default function App() {
   const [showTimeoutModal, setShowTimeoutModal] = useState(false);
 
   const handleLogout = useCallback(() => {
+    if (authToken) {
+      // Revoke the token server-side, best effort
+      fetch(`${API_URL}/auth/logout`, {
+        method: 'POST',
+        headers: { 'Authorization': `Bearer ${authToken}` }
+      }).catch(() => { });
+    }
     setCurrentUser(null);
     setAuthToken(null);
     sessionStorage.removeItem('token');
     setShowTimeoutModal(false);
     navigate('/');
-  }, [navigate]);
+  }, [navigate, authToken]);
 
   // Activity Tracker
   useEffect(() => {
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { User, Account, Notification } from '../types';
+import { User, Account, Notification, DashboardSummary } from '../types';
 import { LayoutDashboard, CreditCard, ArrowRightLeft, History, LogOut, Menu, X, Bell, User as UserIcon } from 'lucide-react';
 import { Overview } from './dashboard/Overview';
 import { Movements } from './dashboard/Movements';
@@ -22,24 +22,29 @@ export function Dashboard({ user, onLogout, token, apiUrl }: DashboardProps) {
   const [activeTab, setActiveTab] = useState<Tab>('overview');
   const [isMobileMenuOpen, setIsMobileMenuOpen] = useState(false);
   const [account, setAccount] = useState<Account | null>(null);
+  const [summary, setSummary] = useState<DashboardSummary | null>(null);
   const [showNotifications, setShowNotifications] = useState(false);
   const [hasUnreadNotifications, setHasUnreadNotifications] = useState(true);
 
   const [notifications, setNotifications] = useState<Notification[]>([]);
 
+  // Account, cards, unread count and month stats in one request
   const fetchAccount = () => {
-    fetch(`${apiUrl}/core/accounts/me`, {
+    fetch(`${apiUrl}/core/dashboard`, {
       headers: { Authorization: `Bearer ${token}` }
     })
       .then(res => res.json())
       .then(data => {
-        if (!data.detail) setAccount(data);
+        if (!data.detail) {
+          setSummary(data);
+          if (data.account) setAccount(data.account);
+        }
       })
       .catch(console.error);
   };
 
   const fetchNotifications = () => {
-    fetch(`${apiUrl}/core/notifications`, {
+    return fetch(`${apiUrl}/core/notifications`, {
       headers: { Authorization: `Bearer ${token}` }
     })
       .then(res => res.json())
@@ -47,17 +52,42 @@ export function Dashboard({ user, onLogout, token, apiUrl }: DashboardProps) {
         if (Array.isArray(data)) {
           setNotifications(data);
           setHasUnreadNotifications(data.some(n => n.is_read === 0));
+          return data.reduce((max: number, n: Notification) => Math.max(max, n.id), 0);
         }
+        return 0;
       })
-      .catch(console.error);
+      .catch(err => {
+        console.error(err);
+        return 0;
+      });
   }
 
   useEffect(() => {
     fetchAccount();
-    fetchNotifications();
-    // Poll every 10s
-    const interval = setInterval(fetchNotifications, 10000);
-    return () => clearInterval(interval);
+    // Long-poll: the server holds the request until a new notification arrives
+    let active = true;
+    const poll = async () => {
+      let sinceId = await fetchNotifications();
+      while (active) {
+        try {
+          const res = await fetch(`${apiUrl}/core/notifications/poll?since_id=${sinceId}`, {
+            headers: { Authorization: `Bearer ${token}` }
+          });
+          const data = await res.json();
+          if (!Array.isArray(data)) throw new Error(data.detail);
+          if (active && data.length > 0) {
+            sinceId = data[data.length - 1].id;
+            setNotifications(prev => [...data.reverse(), ...prev]);
+            setHasUnreadNotifications(true);
+          }
+        } catch (err) {
+          console.error(err);
+          await new Promise(resolve => setTimeout(resolve, 10000));
+        }
+      }
+    };
+    poll();
+    return () => { active = false; };
   }, [token, apiUrl]);
 
   const markRead = () => {
@@ -189,7 +219,7 @@ export function Dashboard({ user, onLogout, token, apiUrl }: DashboardProps) {
         {/* Scrollable Area */}
         <div className="flex-1 overflow-y-auto p-4 md:p-8">
           <div className="max-w-6xl mx-auto">
-            {activeTab === 'overview' && <Overview account={account} token={token} apiUrl={apiUrl} />}
+            {activeTab === 'overview' && <Overview account={account} summary={summary} />}
             {activeTab === 'movements' && <Movements token={token} apiUrl={apiUrl} />}
             {activeTab === 'cards' && <Cards token={token} apiUrl={apiUrl} userFullName={user.full_name || user.username} />}
             {activeTab === 'transfers' && (
@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 import { Transaction } from '../../types';
-import { ArrowUpRight, ArrowDownLeft, Search } from 'lucide-react';
+import { ArrowUpRight, ArrowDownLeft, Search, Download } from 'lucide-react';
 
 interface MovementsProps {
     token: string;
@@ -11,22 +11,45 @@ export function Movements({ token, apiUrl }: MovementsProps) {
     const [transactions, setTransactions] = useState<Transaction[]>([]);
     const [loading, setLoading] = useState(true);
     const [filter, setFilter] = useState('');
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
 
-    useEffect(() => {
-        fetch(`${apiUrl}/core/movements`, {
+    const fetchPage = (cursor: string | null) => {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        return fetch(`${apiUrl}/core/movements${query}`, {
             headers: { Authorization: `Bearer ${token}` }
         })
-            .then(res => res.json())
+            .then(res => {
+                setNextCursor(res.headers.get('X-Next-Cursor'));
+                return res.json();
+            })
             .then(data => {
-                setTransactions(Array.isArray(data) ? data : []);
+                const page = Array.isArray(data) ? data : [];
+                setTransactions(prev => cursor ? [...prev, ...page] : page);
                 setLoading(false);
             })
             .catch(err => {
                 console.error(err);
                 setLoading(false);
             });
+    };
+
+    useEffect(() => {
+        fetchPage(null);
     }, [token, apiUrl]);
 
+    const downloadStatement = async () => {
+        const res = await fetch(`${apiUrl}/core/movements/export?format=csv`, {
+            headers: { Authorization: `Bearer ${token}` }
+        });
+        if (!res.ok) return;
+        const url = URL.createObjectURL(await res.blob());
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = 'estado-de-cuenta.csv';
+        link.click();
+        URL.revokeObjectURL(url);
+    };
+
     const filtered = transactions.filter(t =>
         t.description.toLowerCase().includes(filter.toLowerCase()) ||
         t.amount.toString().includes(filter)
@@ -43,6 +66,13 @@ export function Movements({ token, apiUrl }: MovementsProps) {
                     value={filter}
                     onChange={(e) => setFilter(e.target.value)}
                 />
+                <button
+                    onClick={downloadStatement}
+                    title="Descargar estado de cuenta"
+                    className="p-2 rounded-md text-muted-foreground hover:bg-muted transition-colors"
+                >
+                    <Download className="w-4 h-4" />
+                </button>
             </div>
 
             <div className="rounded-xl border bg-card text-card-foreground shadow-sm overflow-hidden">
@@ -77,6 +107,14 @@ export function Movements({ token, apiUrl }: MovementsProps) {
                                 </div>
                             </div>
                         ))}
+                        {nextCursor && (
+                            <button
+                                onClick={() => fetchPage(nextCursor)}
+                                className="w-full p-3 text-sm text-muted-foreground hover:bg-muted/50 transition-colors"
+                            >
+                                Cargar más movimientos
+                            </button>
+                        )}
                     </div>
                 )}
             </div>
@@ -1,46 +1,14 @@
-import { useState, useEffect } from 'react';
-import { Account, Transaction } from '../../types';
+import { Account, DashboardSummary } from '../../types';
 import { ArrowUpRight, ArrowDownLeft, Wallet } from 'lucide-react';
 
 interface OverviewProps {
     account: Account | null;
-    token: string;
-    apiUrl: string;
+    summary: DashboardSummary | null;
 }
 
-export function Overview({ account, token, apiUrl }: OverviewProps) {
-    const [stats, setStats] = useState({ income: 0, expense: 0 });
-
-    useEffect(() => {
-        if (!token) return;
-
-        fetch(`${apiUrl}/core/transactions`, {
-            headers: { Authorization: `Bearer ${token}` }
-        })
-            .then(res => res.json())
-            .then(data => {
-                if (Array.isArray(data)) {
-                    let income = 0;
-                    let expense = 0;
-                    const now = new Date();
-                    const currentMonth = now.getMonth();
-                    const currentYear = now.getFullYear();
-
-                    data.forEach((tx: Transaction) => {
-                        const txDate = new Date(tx.timestamp);
-                        if (txDate.getMonth() === currentMonth && txDate.getFullYear() === currentYear) {
-                            if (tx.amount > 0) {
-                                income += tx.amount;
-                            } else {
-                                expense += Math.abs(tx.amount);
-                            }
-                        }
-                    });
-                    setStats({ income, expense });
-                }
-            })
-            .catch(console.error);
-    }, [token, apiUrl]);
+export function Overview({ account, summary }: OverviewProps) {
+    // Month totals are aggregated server-side by /dashboard
+    const stats = { income: summary?.month_income ?? 0, expense: summary?.month_expense ?? 0 };
 
     if (!account) return <div className="p-4 text-muted-foreground">Cargando cuentas...</div>;
 
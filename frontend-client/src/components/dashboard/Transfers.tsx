@@ -35,6 +35,9 @@ export function Transfers({ token, apiUrl, myAccount, onTransferSuccess }: Trans
             .catch(console.error);
     }, [token, apiUrl]);
 
+    // Same key for every retry of this transfer, renewed after it succeeds
+    const [idempotencyKey, setIdempotencyKey] = useState(() => crypto.randomUUID());
+
     const handleTransfer = async (e: React.FormEvent) => {
         e.preventDefault();
         setMessage(null);
@@ -43,7 +46,8 @@ export function Transfers({ token, apiUrl, myAccount, onTransferSuccess }: Trans
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
-                    Authorization: `Bearer ${token}`
+                    Authorization: `Bearer ${token}`,
+                    'Idempotency-Key': idempotencyKey
                 },
                 body: JSON.stringify({
                     to_account_number: destAccount,
@@ -58,6 +62,7 @@ export function Transfers({ token, apiUrl, myAccount, onTransferSuccess }: Trans
             if (!res.ok) throw new Error(data.detail || 'Error en transferencia');
 
             setMessage({ type: 'success', text: 'Transferencia realizada con éxito' });
+            setIdempotencyKey(crypto.randomUUID());
             setAmount('');
             setDescription('');
             setDestCedula('');
@@ -3,7 +3,10 @@ import { Search, CreditCard, DollarSign } from 'lucide-react';
 import { API_URL } from '../../config';
 
 export function CustomerServiceView() {
-    const [cedula, setCedula] = useState('');
+    const [query, setQuery] = useState('');
+    const [results, setResults] = useState<any[]>([]);
+    const [page, setPage] = useState(1);
+    const [hasMore, setHasMore] = useState(false);
     const [foundUser, setFoundUser] = useState<any>(null);
     const [amount, setAmount] = useState('');
 
@@ -11,8 +14,7 @@ export function CustomerServiceView() {
     const [message, setMessage] = useState('');
     const [loading, setLoading] = useState(false);
 
-    const handleSearch = async (e: React.FormEvent) => {
-        e.preventDefault();
+    const search = async (nextPage: number) => {
         setLoading(true);
         setStatus('idle');
         setFoundUser(null);
@@ -21,17 +23,20 @@ export function CustomerServiceView() {
             const token = localStorage.getItem('token');
             if (!token) throw new Error("No authorized");
 
-            const res = await fetch(`${API_URL}/auth/users/search?cedula=${cedula}`, {
+            // Name, username, cédula or phone; account numbers come in the same response
+            const params = new URLSearchParams({ q: query, page: String(nextPage), include_accounts: 'true' });
+            const res = await fetch(`${API_URL}/auth/users/search?${params}`, {
                 headers: { 'Authorization': `Bearer ${token}` }
             });
 
-            if (!res.ok) {
-                if (res.status === 404) throw new Error("Usuario no encontrado");
-                throw new Error("Error buscando usuario");
-            }
+            if (!res.ok) throw new Error("Error buscando usuario");
 
             const data = await res.json();
-            setFoundUser(data);
+            if (data.items.length === 0) throw new Error("Usuario no encontrado");
+            setResults(data.items);
+            setPage(data.page);
+            setHasMore(data.has_more);
+            if (data.items.length === 1) setFoundUser(data.items[0]);
         } catch (err: any) {
             setStatus('error');
             setMessage(err.message);
@@ -40,8 +45,14 @@ export function CustomerServiceView() {
         }
     };
 
+    const handleSearch = (e: React.FormEvent) => {
+        e.preventDefault();
+        setResults([]);
+        search(1);
+    };
+
     const handleInject = async () => {
-        if (!foundUser || !amount) return;
+        if (!foundUser?.account_number || !amount) return;
         setLoading(true);
         setStatus('idle');
 
@@ -59,7 +70,7 @@ export function CustomerServiceView() {
                     'Authorization': `Bearer ${token}`
                 },
                 body: JSON.stringify({
-                    user_id: foundUser.id,
+                    account_number: foundUser.account_number,
                     amount: parseFloat(amount)
                 })
             });
@@ -91,16 +102,16 @@ export function CustomerServiceView() {
 
                     {/* Step 1: Search */}
                     <form onSubmit={handleSearch} className="mb-8">
-                        <label className="block text-sm font-medium mb-2">Buscar por Cédula</label>
+                        <label className="block text-sm font-medium mb-2">Buscar Cliente</label>
                         <div className="flex gap-2">
                             <div className="relative flex-1">
                                 <Search className="w-5 h-5 text-muted-foreground absolute left-3 top-1/2 -translate-y-1/2" />
                                 <input
                                     type="text"
-                                    value={cedula}
-                                    onChange={(e) => setCedula(e.target.value)}
+                                    value={query}
+                                    onChange={(e) => setQuery(e.target.value)}
                                     className="w-full pl-10 pr-4 py-3 bg-input border border-border rounded-lg outline-none focus:ring-2 focus:ring-primary"
-                                    placeholder="V-12345678"
+                                    placeholder="Nombre, usuario, cédula o teléfono"
                                     required
                                 />
                             </div>
@@ -127,6 +138,28 @@ export function CustomerServiceView() {
                         </div>
                     )}
 
+                    {results.length > 1 && (
+                        <div className="mb-6 space-y-2">
+                            {results.map((user) => (
+                                <button
+                                    key={user.id}
+                                    onClick={() => setFoundUser(user)}
+                                    className={`w-full text-left p-3 rounded-lg border ${foundUser?.id === user.id ? 'border-primary bg-primary/10' : 'border-border hover:bg-secondary/50'}`}
+                                >
+                                    <p className="font-medium">{user.full_name || user.username}</p>
+                                    <p className="text-xs text-muted-foreground">
+                                        {user.username} · {user.cedula || 'sin cédula'} · {user.account_number || 'sin cuenta'}
+                                    </p>
+                                </button>
+                            ))}
+                            <div className="flex justify-between text-sm">
+                                <button onClick={() => search(page - 1)} disabled={loading || page === 1} className="disabled:opacity-30">Anterior</button>
+                                <span className="text-muted-foreground">Página {page}</span>
+                                <button onClick={() => search(page + 1)} disabled={loading || !hasMore} className="disabled:opacity-30">Siguiente</button>
+                            </div>
+                        </div>
+                    )}
+
                     {foundUser && (
                         <div className="space-y-6 animate-in fade-in slide-in-from-bottom-4">
                             <div className="bg-secondary/50 p-4 rounded-lg space-y-2">
@@ -138,6 +171,7 @@ export function CustomerServiceView() {
                                 </div>
                                 <p className="text-sm text-muted-foreground">ID: {foundUser.id}</p>
                                 <p className="text-sm text-muted-foreground">Cédula: {foundUser.cedula}</p>
+                                <p className="text-sm text-muted-foreground">Cuenta: {foundUser.account_number || 'Sin cuenta'}</p>
                             </div>
 
                             <div className="space-y-4">
@@ -154,7 +188,7 @@ export function CustomerServiceView() {
                                 </div>
                                 <button
                                     onClick={handleInject}
-                                    disabled={loading || !amount}
+                                    disabled={loading || !amount || !foundUser.account_number}
                                     className="w-full py-3 bg-gradient-to-r from-green-600 to-emerald-600 text-white font-bold rounded-lg shadow-lg hover:opacity-90 disabled:opacity-50"
                                 >
                                     PROCESAR DEPÓSITO
@@ -51,3 +51,13 @@ export interface Notification {
     is_read: number;
     timestamp: string;
 }
+
+export interface DashboardSummary {
+    account: Account | null;
+    cards: Card[];
+    unread_notifications: number;
+    month_income: number;
+    month_expense: number;
+    recent_transactions: Transaction[];
+    top_beneficiaries: Beneficiary[];
+}
@@ -0,0 +1,2 @@
+# Code used by both auth-service and core-banking-service. Both Dockerfiles install this
+# package (build context is the repo root); locally: pip install -e shared
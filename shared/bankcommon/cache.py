@@ -0,0 +1,266 @@
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine, text
+from collections import OrderedDict
+import json
+import select
+import threading
+import time
+import uuid
+import os
+
+# Per-user read-through cache for small GET endpoints (/accounts/me, /cards/me, ...).
+# Every (scope, user) pair has a version. Writers drop it after commit and the next
+# read picks a fresh one. Entries are stored under the version they were loaded with,
+# so a read racing a write can never bring old data back, and the version is the ETag.
+
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+# postgres: entries per worker, invalidations reach every process through NOTIFY (default on Postgres)
+# memory: only the writing process drops its entries, for tests and single-process runs
+CACHE_BACKEND = os.getenv("CACHE_BACKEND") or ("postgres" if DATABASE_URL.startswith("postgresql") else "memory")
+CACHE_CHANNEL = "cache_invalidation"
+CACHE_RECONNECT_MAX_SECONDS = float(os.getenv("CACHE_RECONNECT_MAX_SECONDS", "30"))
+CACHE_TTL = int(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class InProcessBackend:
+    """TTL + LRU dict in this worker.
+
+    Invalidations do not reach other processes, they see the change once their entry
+    expires (CACHE_TTL_SECONDS). The postgres and redis backends do not have that problem.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._put(key, value)
+
+    def add(self, key, value):
+        """Stores value unless the key is already set. Returns the stored value."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
+            self._put(key, value)
+            return value
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _put(self, key, value):
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class PostgresBackend(InProcessBackend):
+    """Entries in this worker, deletes sent to every worker of both services with NOTIFY.
+
+    Writers outside the API (scheduler, card hold expiry, other uvicorn workers) publish
+    too. While the listener has no connection the cache is off, every read is a miss.
+    """
+
+    def __init__(self, url: str, max_entries: int, ttl: int):
+        super().__init__(max_entries, ttl)
+        self._engine = create_engine(url, pool_size=1, max_overflow=4, pool_pre_ping=True)
+        self._listener = None
+        self._listening = threading.Event()
+
+    def get(self, key):
+        if not self._ready():
+            return None
+        return super().get(key)
+
+    def set(self, key, value):
+        if self._ready():
+            super().set(key, value)
+
+    def add(self, key, value):
+        if not self._ready():
+            return value  # a version nobody else has, so no 304 and no stored data
+        return super().add(key, value)
+
+    def delete(self, *keys):
+        super().delete(*keys)
+        if not keys:
+            return
+        try:
+            self.publish(keys)
+        except Exception as e:
+            # The write is committed already; other workers catch up within CACHE_TTL_SECONDS
+            print(f"Cache invalidation publish failed: {e!r}")
+
+    def publish(self, keys):
+        keys = list(keys)
+        with self._engine.begin() as conn:
+            # NOTIFY payloads stop at 8000 bytes
+            for i in range(0, len(keys), 200):
+                conn.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": CACHE_CHANNEL, "payload": " ".join(keys[i:i + 200])},
+                )
+
+    def _ready(self):
+        # Only readers listen, a job that just writes never starts the thread
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, name="cache-invalidation", daemon=True)
+                    self._listener.start()
+            self._listening.wait(5)
+        return self._listening.is_set()
+
+    def _listen(self):
+        delay = 1.0
+        while True:
+            conn = None
+            try:
+                conn = self._engine.raw_connection()
+                conn.driver_connection.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {CACHE_CHANNEL}")
+                # Deletes published while we were not listening are lost, start over
+                self.clear()
+                self._listening.set()
+                delay = 1.0
+                self._receive(conn.driver_connection, cursor)
+            except Exception as e:
+                self._listening.clear()
+                print(f"Cache invalidation listener lost its connection: {e!r}, reconnecting in {delay:.0f}s")
+                if conn is not None:
+                    conn.invalidate()
+                    conn = None
+                time.sleep(delay)
+                delay = min(delay * 2, CACHE_RECONNECT_MAX_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _receive(self, pg, cursor):
+        while True:
+            if select.select([pg], [], [], 30) == ([], [], []):
+                cursor.execute("SELECT 1")
+                continue
+            pg.poll()
+            keys = []
+            while pg.notifies:
+                keys += pg.notifies.pop(0).payload.split()
+            InProcessBackend.delete(self, *keys)
+
+
+class RedisBackend:
+    """Shared between workers and services. Needs the redis package."""
+
+    def __init__(self, url: str, ttl: int):
+        import redis  # optional dependency, only needed with CACHE_BACKEND=redis
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._redis.get(key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value):
+        self._redis.set(key, json.dumps(value), ex=self.ttl)
+
+    def add(self, key, value):
+        if self._redis.set(key, json.dumps(value), ex=self.ttl, nx=True):
+            return value
+        current = self.get(key)
+        return value if current is None else current
+
+    def delete(self, *keys):
+        if keys:
+            self._redis.delete(*keys)
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def version(self, scope: str, user_id: int) -> str:
+        return self.backend.add(f"v:{scope}:{user_id}", uuid.uuid4().hex[:16])
+
+    def lookup(self, request: Request, scope: str, user_id: int):
+        """Returns (version, response). response is None on a miss: load the data and call store()."""
+        version = self.version(scope, user_id)
+        etag = f'"{scope}-{user_id}-{version}"'
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return version, Response(status_code=304, headers=cache_headers(etag))
+        data = self.backend.get(f"d:{scope}:{user_id}:{version}")
+        if data is None:
+            self.misses += 1
+            return version, None
+        self.hits += 1
+        return version, JSONResponse(data, headers=cache_headers(etag))
+
+    def store(self, scope: str, user_id: int, version: str, data) -> JSONResponse:
+        data = jsonable_encoder(data)
+        self.backend.set(f"d:{scope}:{user_id}:{version}", data)
+        return JSONResponse(data, headers=cache_headers(f'"{scope}-{user_id}-{version}"'))
+
+    def invalidate(self, scope: str, *user_ids):
+        # Call after commit. Old entries are left to expire, nothing can reach them anymore.
+        self.backend.delete(*(f"v:{scope}:{uid}" for uid in set(user_ids)))
+
+    def stats(self):
+        return {
+            "backend": CACHE_BACKEND,
+            "ttl_seconds": CACHE_TTL,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def cache_headers(etag: str):
+    # Browsers keep the body but must revalidate, which costs a 304 at most
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def make_backend():
+    if CACHE_BACKEND == "redis":
+        return RedisBackend(REDIS_URL, CACHE_TTL)
+    if CACHE_BACKEND == "postgres":
+        return PostgresBackend(DATABASE_URL, CACHE_MAX_ENTRIES, CACHE_TTL)
+    return InProcessBackend(CACHE_MAX_ENTRIES, CACHE_TTL)
+
+
+response_cache = ResponseCache(make_backend())
@@ -0,0 +1,196 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from collections import defaultdict, Counter
+import contextvars
+import logging
+import threading
+import time
+import os
+
+# Per-route latency / status metrics in Prometheus text format, plus SQL instrumentation:
+# every request gets X-DB-Queries / X-DB-Time-Ms headers, slow statements and statements
+# repeated many times in one request (N+1) are logged. Counters are per worker process.
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))  # same statement this many times in one request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+logger = logging.getLogger("sql")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+
+
+# Mutable per-request holder: worker threads get a copy of the context but share the object
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()  # (method, route, status) -> n
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (method, route)
+        self.queries = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))  # (method, route)
+        self.db_time = Counter()  # (method, route) -> seconds
+        self.slow_queries = 0
+
+    def record(self, method, route, status, elapsed, stats: RequestStats):
+        with self._lock:
+            self.requests[(method, route, str(status))] += 1
+            self.latency[(method, route)].observe(elapsed)
+            self.queries[(method, route)].observe(stats.queries)
+            self.db_time[(method, route)] += stats.db_time
+
+    def slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP http_requests_total Requests by route and status.",
+                "# TYPE http_requests_total counter",
+            ]
+            for (method, route, status), n in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {n}')
+            lines += render_histograms(
+                "http_request_duration_seconds", "Request latency by route.", self.latency
+            )
+            lines += render_histograms(
+                "db_queries_per_request", "SQL statements executed per request.", self.queries
+            )
+            lines += [
+                "# HELP db_time_seconds_total Time spent in SQL statements by route.",
+                "# TYPE db_time_seconds_total counter",
+            ]
+            for (method, route), seconds in sorted(self.db_time.items()):
+                lines.append(f'db_time_seconds_total{{method="{method}",route="{route}"}} {seconds:.6f}')
+            lines += [
+                "# HELP db_slow_queries_total Statements slower than SLOW_QUERY_MS.",
+                "# TYPE db_slow_queries_total counter",
+                f"db_slow_queries_total {self.slow_queries}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def render_histograms(name, help_text, histograms):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for (method, route), h in sorted(histograms.items()):
+        labels = f'method="{method}",route="{route}"'
+        for bound, count in zip(h.buckets, h.counts):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.total}')
+        lines.append(f"{name}_sum{{{labels}}} {h.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {h.total}")
+    return lines
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    """Pure ASGI so streaming responses are timed until their last byte."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-queries", str(stats.queries).encode()))
+                headers.append((b"x-db-time-ms", f"{stats.db_time * 1000:.1f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current_request.reset(token)
+            # Route template, not the raw path, keeps label cardinality bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "<unmatched>"
+            registry.record(scope["method"], route_path, status, time.perf_counter() - start, stats)
+            repeated = [(sql, n) for sql, n in stats.statements.items() if n >= N_PLUS_ONE_THRESHOLD]
+            for sql, n in repeated:
+                logger.warning("Possible N+1 on %s %s: %d x %s", scope["method"], route_path, n, one_line(sql))
+
+
+def one_line(sql: str, limit: int = 300) -> str:
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= limit else sql[:limit] + "..."
+
+
+def parameter_shape(parameters, executemany: bool):
+    # Types only: bound values may be personal data
+    def shape(params):
+        if isinstance(params, dict):
+            return {k: type(v).__name__ for k, v in params.items()}
+        if isinstance(params, (list, tuple)):
+            return [type(v).__name__ for v in params]
+        return type(params).__name__
+    if executemany and parameters:
+        return f"{len(parameters)} x {shape(parameters[0])}"
+    return shape(parameters)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        stats.statements[statement] += 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        registry.slow_query()
+        logger.warning(
+            "Slow query (%.1f ms): %s params=%s",
+            elapsed * 1000, one_line(statement), parameter_shape(parameters, executemany),
+        )
+
+
+@event.listens_for(Engine, "handle_error")
+def _drop_timer(exception_context):
+    # after_cursor_execute does not run for failed statements
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
@@ -0,0 +1,222 @@
+from fastapi import Depends, HTTPException, Header
+from collections import OrderedDict
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
+import hashlib
+import threading
+import time
+import uuid
+import os
+import jwt
+
+# Token issuing and verification for auth-service and core-banking-service.
+
+# APP_ENV=dev allows the well-known development key, anything else needs a real one
+APP_ENV = os.getenv("APP_ENV", "production")
+SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+if not SECRET_KEY:
+    if APP_ENV != "dev":
+        raise RuntimeError("JWT_SECRET_KEY is not set (APP_ENV=dev uses a development key)")
+    SECRET_KEY = "mysecretkey"
+ALGORITHM = "HS256"
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", "3600"))
+
+CLAIMS_CACHE_SIZE = int(os.getenv("CLAIMS_CACHE_SIZE", "10000"))
+CLAIMS_CACHE_TTL = int(os.getenv("CLAIMS_CACHE_TTL_SECONDS", "300"))
+# database: logouts are shared by every worker of both services (same database)
+# memory: only the worker that handled /logout knows, for tests and single-process runs
+REVOCATION_BACKEND = os.getenv("REVOCATION_BACKEND", "database")
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "2"))
+
+
+def create_access_token(sub: str, role: str, user_id: int) -> str:
+    now = int(time.time())
+    claims = {
+        "sub": sub,
+        "role": role,
+        "user_id": user_id,
+        "iat": now,
+        "exp": now + ACCESS_TOKEN_TTL,
+        "jti": uuid.uuid4().hex,
+    }
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+
+class RevocationStore:
+    """In-process revoked jti list, only the worker that revoked knows."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}  # jti -> exp
+
+    def revoke(self, jti: str, exp: int):
+        with self._lock:
+            self._revoked[jti] = exp
+            # Revoked tokens only matter until they expire anyway
+            now = time.time()
+            for old in [j for j, e in self._revoked.items() if e < now]:
+                del self._revoked[old]
+
+    def is_revoked(self, jti: str) -> bool:
+        return jti in self._revoked
+
+
+class DatabaseRevocationStore(RevocationStore):
+    """revoked_tokens table plus the in-process list as a local copy.
+
+    Checking a token never queries: a background thread reads the rows added since its
+    last pass every REVOCATION_REFRESH_SECONDS, so a logout handled by another worker or
+    the other service takes effect within that time. The revoking worker knows at once.
+    """
+
+    def __init__(self, session_factory, model, refresh_seconds: float = REVOCATION_REFRESH_SECONDS):
+        super().__init__()
+        # The service's own SessionLocal and RevokedToken model
+        self.session_factory = session_factory
+        self.model = model
+        self.refresh_seconds = refresh_seconds
+        self._last_id = 0
+        self._thread = None
+
+    def revoke(self, jti: str, exp: int):
+        RevokedToken = self.model
+        db = self.session_factory()
+        try:
+            db.execute(delete(RevokedToken).where(RevokedToken.expires_at < int(time.time())))
+            db.add(RevokedToken(jti=jti, expires_at=exp))
+            db.commit()
+        except IntegrityError:
+            db.rollback()  # revoked already
+        finally:
+            db.close()
+        super().revoke(jti, exp)
+
+    def is_revoked(self, jti: str) -> bool:
+        if self._thread is None:
+            self._start()
+        return super().is_revoked(jti)
+
+    def refresh(self):
+        RevokedToken = self.model
+        db = self.session_factory()
+        try:
+            rows = db.execute(
+                select(RevokedToken.id, RevokedToken.jti, RevokedToken.expires_at)
+                .where(RevokedToken.id > self._last_id, RevokedToken.expires_at >= int(time.time()))
+                .order_by(RevokedToken.id)
+            ).all()
+        finally:
+            db.close()
+        now = time.time()
+        with self._lock:
+            for row_id, jti, exp in rows:
+                self._revoked[jti] = exp
+                self._last_id = row_id
+            for old in [j for j, e in self._revoked.items() if e < now]:
+                del self._revoked[old]
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="revocations", daemon=True)
+        # First read before answering, so a restarted worker does not accept old logouts
+        self._refresh_logged()
+        self._thread.start()
+
+    def _refresh_logged(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Revoked token refresh failed: {e!r}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_seconds)
+            self._refresh_logged()
+
+
+class ClaimsCache:
+    """Bounded LRU of verified claims, keyed by the token hash."""
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, claims)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, claims: dict):
+        # Never outlive the token itself
+        expires_at = min(claims["exp"], time.time() + self.ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+claims_cache = ClaimsCache(CLAIMS_CACHE_SIZE, CLAIMS_CACHE_TTL)
+revocation_store = RevocationStore()
+
+
+def set_revocation_store(store):
+    global revocation_store
+    revocation_store = store
+
+
+def use_database_revocations(session_factory, model):
+    """Called by each service at import; keeps the in-process store with REVOCATION_BACKEND=memory."""
+    if REVOCATION_BACKEND == "database":
+        set_revocation_store(DatabaseRevocationStore(session_factory, model))
+
+
+def verify_token(token: str) -> dict:
+    """Returns the claims of a valid token, raises HTTPException(401) otherwise."""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    claims = claims_cache.get(key)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "iat", "jti"]})
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=401, detail="Invalid Token")
+        claims_cache.put(key, claims)
+    if revocation_store.is_revoked(claims["jti"]):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return claims
+
+
+def revoke_token(claims: dict):
+    revocation_store.revoke(claims["jti"], claims["exp"])
+
+
+async def get_current_user_payload(authorization: str = Header(None)):
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing Authorization Header")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Invalid Token")
+    return verify_token(token)
+
+
+def require_roles(*roles):
+    """Dependency that returns the token claims if the caller has one of the roles."""
+    async def check_role(payload: dict = Depends(get_current_user_payload)):
+        if payload.get("role") not in roles:
+            raise HTTPException(status_code=403, detail="Not authorized")
+        return payload
+    return check_role
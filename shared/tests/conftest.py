@@ -0,0 +1,4 @@
+import os
+
+# The development JWT key, unless the environment has a real one
+os.environ.setdefault("APP_ENV", "dev")
@@ -0,0 +1,72 @@
+import os
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from bankcommon import cache
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+
+@pytest.fixture
+def app_and_cache():
+    response_cache = cache.ResponseCache(cache.InProcessBackend(100, 60))
+    loads = []
+    app = FastAPI()
+
+    @app.get("/me/{user_id}")
+    def me(user_id: int, request: Request):
+        version, cached = response_cache.lookup(request, "me", user_id)
+        if cached:
+            return cached
+        loads.append(user_id)
+        return response_cache.store("me", user_id, version, {"user_id": user_id, "loads": len(loads)})
+
+    return TestClient(app), response_cache, loads
+
+
+def test_etag_revalidation_and_invalidation(app_and_cache):
+    client, response_cache, loads = app_and_cache
+    first = client.get("/me/1")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    assert client.get("/me/1").json() == first.json()  # served from the cache
+    for if_none_match in [etag, "W/" + etag, '"other", ' + etag, "*"]:
+        assert client.get("/me/1", headers={"If-None-Match": if_none_match}).status_code == 304
+    assert client.get("/me/1", headers={"If-None-Match": '"other"'}).status_code == 200
+    assert loads == [1]
+
+    response_cache.invalidate("me", 1)
+    after = client.get("/me/1", headers={"If-None-Match": etag})
+    assert after.status_code == 200 and after.headers["ETag"] != etag
+    assert loads == [1, 1]
+    assert client.get("/me/2").headers["ETag"] != after.headers["ETag"]
+    stats = response_cache.stats()
+    assert (stats["hits"], stats["not_modified"]) == (2, 4)
+
+
+def test_in_process_entries_expire_and_are_bounded():
+    backend = cache.InProcessBackend(2, 60)
+    for key in "abc":
+        backend.set(key, key)
+    assert backend.get("a") is None and backend.get("c") == "c"
+    assert backend.add("c", "new") == "c"
+    backend.ttl = 0
+    backend.set("d", "d")
+    assert backend.get("d") is None
+
+
+@pytest.mark.skipif(not TEST_POSTGRES_URL, reason="TEST_POSTGRES_URL not set")
+def test_postgres_backend_invalidates_other_processes():
+    # Two workers of the same or the other service
+    writer = cache.PostgresBackend(TEST_POSTGRES_URL, 100, 60)
+    reader = cache.PostgresBackend(TEST_POSTGRES_URL, 100, 60)
+    reader.set("v:account:1", "old")
+    assert reader.get("v:account:1") == "old"
+    writer.delete("v:account:1")
+    deadline = time.time() + 5
+    while reader.get("v:account:1") is not None and time.time() < deadline:
+        time.sleep(0.05)
+    assert reader.get("v:account:1") is None
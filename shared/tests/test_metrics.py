@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from bankcommon import metrics
+
+
+@pytest.fixture
+def client():
+    engine = create_engine("sqlite://")
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int, repeat: int = 1):
+        with engine.connect() as conn:
+            for _ in range(repeat):
+                conn.execute(text("SELECT :id"), {"id": item_id}).scalar()
+        return {"id": item_id}
+
+    return TestClient(app)
+
+
+def test_db_headers_count_the_request_statements(client):
+    r = client.get("/items/1", params={"repeat": 3})
+    assert r.headers["X-DB-Queries"] == "3"
+    assert float(r.headers["X-DB-Time-Ms"]) >= 0
+
+
+def test_routes_are_labelled_by_template(client):
+    client.get("/items/41")
+    client.get("/items/42")
+    client.get("/nope")
+    text_format = metrics.registry.render()
+    assert 'http_requests_total{method="GET",route="/items/{item_id}",status="200"}' in text_format
+    assert 'route="/items/41"' not in text_format
+    assert 'http_requests_total{method="GET",route="<unmatched>",status="404"}' in text_format
+    assert 'db_queries_per_request_bucket{method="GET",route="/items/{item_id}",le="1"}' in text_format
+
+
+def test_slow_and_repeated_statements_are_logged(client, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0)
+    monkeypatch.setattr(metrics, "N_PLUS_ONE_THRESHOLD", 3)
+    slow_before = metrics.registry.slow_queries
+    with caplog.at_level(logging.WARNING, logger="sql"):
+        client.get("/items/7", params={"repeat": 3})
+    assert metrics.registry.slow_queries - slow_before == 3
+    messages = [r.getMessage() for r in caplog.records]
+    assert any(m.startswith("Possible N+1 on GET /items/{item_id}: 3 x SELECT ?") for m in messages)
+    # Parameter types only, never the values
+    slow = [m for m in messages if m.startswith("Slow query")]
+    assert slow and all("params=['int']" in m and "7" not in m.split("params=")[1] for m in slow)
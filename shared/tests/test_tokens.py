@@ -0,0 +1,109 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from bankcommon import tokens
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(tokens, "claims_cache", tokens.ClaimsCache(100, 60))
+    monkeypatch.setattr(tokens, "revocation_store", tokens.RevocationStore())
+
+
+def test_valid_token_round_trip():
+    claims = tokens.verify_token(tokens.create_access_token("ana", "client", 7))
+    assert (claims["sub"], claims["role"], claims["user_id"]) == ("ana", "client", 7)
+    assert claims["exp"] - claims["iat"] == tokens.ACCESS_TOKEN_TTL
+
+
+def test_bad_and_expired_tokens_are_401(monkeypatch):
+    token = tokens.create_access_token("ana", "client", 7)
+    for bad in [token[:-2] + "xx", "not.a.token"]:
+        with pytest.raises(HTTPException) as e:
+            tokens.verify_token(bad)
+        assert e.value.status_code == 401
+    monkeypatch.setattr(tokens, "ACCESS_TOKEN_TTL", -5)
+    with pytest.raises(HTTPException):
+        tokens.verify_token(tokens.create_access_token("ana", "client", 7))
+
+
+def test_claims_cache_is_bounded_and_never_outlives_the_token():
+    cache = tokens.ClaimsCache(2, 60)
+    now = time.time()
+    for key in "abc":
+        cache.put(key, {"exp": now + 600})
+    assert cache.get("a") is None and cache.get("c") is not None
+    cache.put("gone", {"exp": now - 1})
+    assert cache.get("gone") is None
+
+
+def test_logout_revokes_a_cached_token():
+    token = tokens.create_access_token("ana", "client", 7)
+    claims = tokens.verify_token(token)
+    tokens.revoke_token(claims)
+    with pytest.raises(HTTPException) as e:
+        tokens.verify_token(token)
+    assert e.value.detail == "Token revoked"
+
+
+Base = declarative_base()
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    id = Column(Integer, primary_key=True)
+    jti = Column(String, unique=True)
+    expires_at = Column(Integer)
+
+
+def test_revocations_reach_other_workers_through_the_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/tokens.db")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    # Two workers, refreshing by hand
+    worker_a = tokens.DatabaseRevocationStore(Session, RevokedToken, refresh_seconds=3600)
+    worker_b = tokens.DatabaseRevocationStore(Session, RevokedToken, refresh_seconds=3600)
+    assert not worker_b.is_revoked("abc")
+
+    now = int(time.time())
+    worker_a.revoke("expired", now - 10)
+    worker_a.revoke("abc", now + 60)
+    worker_a.revoke("abc", now + 60)  # twice is fine
+    assert worker_a.is_revoked("abc")
+    assert not worker_b.is_revoked("abc")
+    worker_b.refresh()
+    assert worker_b.is_revoked("abc") and not worker_b.is_revoked("expired")
+    with Session() as db:
+        # Expired rows are cleared on the next revoke
+        assert [row.jti for row in db.query(RevokedToken)] == ["abc"]
+
+
+def test_dependencies_check_the_header_and_role():
+    app = FastAPI()
+
+    @app.get("/admin")
+    def admin(payload: dict = Depends(tokens.require_roles("admin"))):
+        return payload["user_id"]
+
+    client = TestClient(app)
+    assert client.get("/admin").status_code == 401
+    assert client.get("/admin", headers={"Authorization": "Basic abc"}).status_code == 401
+    as_client = {"Authorization": "Bearer " + tokens.create_access_token("ana", "client", 7)}
+    assert client.get("/admin", headers=as_client).status_code == 403
+    as_admin = {"Authorization": "Bearer " + tokens.create_access_token("root", "admin", 1)}
+    assert client.get("/admin", headers=as_admin).json() == 1
+
+
+def test_production_needs_a_secret_key():
+    env = {k: v for k, v in os.environ.items() if k not in ("JWT_SECRET_KEY", "APP_ENV")}
+    run = subprocess.run([sys.executable, "-c", "import bankcommon.tokens"], env=env, capture_output=True, text=True)
+    assert run.returncode != 0
+    assert "JWT_SECRET_KEY is not set" in run.stderr